@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+import itertools
+import json
+import sys
+from contextlib import redirect_stdout
+from io import StringIO
+from unittest.mock import patch
+
+import pytest
+
+import toac.analyze as analyze
+import toac.dealer as dealer
+import toac.player as player
+
+SMALL_SUSPECTS = {"a", "b", "c", "d"}
+SMALL_DECK = list(map(frozenset, itertools.combinations(sorted(SMALL_SUSPECTS), r=2)))
+
+
+# Play every possible ordering of a deck as dealer.run_game would, with every
+# player guessing the first possible match in deck order, and count how often
+# the game is won on each turn
+def count_win_turns(deck):
+    win_turns = [0] * (len(deck) - 1)
+    for order in itertools.permutations(deck):
+        order = list(order)
+        real_suspects = order.pop()
+        data = {
+            "base_suspects": SMALL_SUSPECTS,
+            "match_length": 2,
+            "cards": [],
+            "previous_guesses": set(),
+        }
+        for turn in range(len(order)):
+            suspects = order.pop()
+            match_count = dealer.get_match_count(suspects, real_suspects)
+            data["cards"].append({"suspects": suspects, "match_count": match_count})
+            guess = frozenset(player.choose_match(player.get_matches(**data)))
+            if guess == real_suspects:
+                win_turns[turn] += 1
+                break
+            data["previous_guesses"].add(guess)
+    return win_turns
+
+
+def test_get_mask_cards():
+    """should retrieve the index of every card in a mask"""
+    assert analyze.get_mask_cards(0b101001) == [0, 3, 5]
+
+
+def test_get_consistent_masks():
+    """should find the cards which agree with the eyewitness card on each card"""
+    masks = analyze.get_consistent_masks(SMALL_DECK, 0)
+    # The eyewitness card ab shares one suspect with ac, as do ad, bc and cd
+    assert analyze.get_mask_cards(masks[1]) == [0, 2, 3, 5]
+
+
+def test_get_win_probabilities_first():
+    """should match the outcomes of playing every ordering of the deck"""
+    win_turns = count_win_turns(SMALL_DECK)
+    probabilities = [0.0] * (len(SMALL_DECK) - 1)
+    for eyewitness in range(len(SMALL_DECK)):
+        eyewitness_probabilities, _ = analyze.get_win_probabilities(
+            SMALL_DECK, eyewitness, "first"
+        )
+        for turn, probability in enumerate(eyewitness_probabilities):
+            probabilities[turn] += probability
+    num_orders = sum(win_turns)
+    assert probabilities == pytest.approx(
+        [count * len(SMALL_DECK) / num_orders for count in win_turns]
+    )
+
+
+def test_analyze_game_symmetric():
+    """should analyze a single eyewitness card for symmetric strategies"""
+    win_probabilities, _ = analyze.analyze_game(SMALL_DECK, "random", jobs=1)
+    all_probabilities = [
+        analyze.get_win_probabilities(SMALL_DECK, eyewitness, "random")[0]
+        for eyewitness in range(len(SMALL_DECK))
+    ]
+    for probabilities in all_probabilities:
+        assert probabilities == pytest.approx(win_probabilities)
+    assert sum(win_probabilities) == pytest.approx(1)
+
+
+def test_get_game_stats():
+    """should compute expected rounds and win probabilities for every seat"""
+    stats = analyze.get_game_stats([0.5, 0.25, 0.125], 2)
+    assert stats["expected_rounds"] == pytest.approx(0.5 + 0.5 + 0.375 + 0.375)
+    assert stats["wins"] == {"P1": 0.625, "P2": 0.25}
+    assert stats["no_winner"] == 0.125
+
+
+def test_main():
+    """should print the exact statistics of the default game via toac analyze"""
+    argv = ["toac", "analyze", "--jobs", "1", "--format", "json"]
+    with patch.object(sys, "argv", argv), redirect_stdout(StringIO()) as out:
+        dealer.main()
+    stats = json.loads(out.getvalue())
+    assert stats["expected_rounds"] == pytest.approx(3.0045, abs=1e-4)
+    assert sum(stats["wins"].values()) == pytest.approx(1)
+    assert stats["num_states"] > 0
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import random
+from unittest.mock import patch
+
+import pytest
+
+import toac.batch as batch
+import toac.player as player
+import toac.solver as solver
+
+np = pytest.importorskip("numpy")
+
+BASE_SUSPECTS = {"pto", "nnn", "jco", "lel", "lsl", "kca", "hbu"}
+
+
+# Generate random payloads, as JSON would encode them, for the given game
+def build_payloads(base_suspects, match_length, num_payloads, rng):
+    deck = solver.get_deck(base_suspects, match_length)
+    payloads = []
+    for _ in range(num_payloads):
+        rng.shuffle(deck)
+        real_suspects = deck[0]
+        payloads.append(
+            {
+                "base_suspects": sorted(base_suspects),
+                "match_length": match_length,
+                "cards": [
+                    {"suspects": sorted(card), "match_count": len(card & real_suspects)}
+                    for card in deck[1 : rng.randint(1, 10)]
+                ],
+                "previous_guesses": [sorted(guess) for guess in deck[-2:]],
+            }
+        )
+    return payloads
+
+
+# Solve a payload on its own with get_matches
+def get_matches(payload):
+    payload = json.loads(json.dumps(payload))
+    player.transform_data(payload)
+    return player.get_matches(**payload)
+
+
+def test_get_combination_matrix():
+    """should encode every combination as a row of zeros and ones"""
+    deck = solver.get_deck({"a", "b", "c"}, 2)
+    matrix = batch.get_combination_matrix(deck, {"a": 0, "b": 1, "c": 2})
+    assert matrix.tolist() == [[1, 1, 0], [1, 0, 1], [0, 1, 1]]
+
+
+def test_get_candidate_masks():
+    """should retrieve one candidate mask per payload over the deck"""
+    with open(os.path.join(os.path.dirname(player.__file__), "example.json")) as f:
+        payload = json.load(f)
+    (mask,) = batch.get_candidate_masks([payload])
+    deck = solver.get_deck(BASE_SUSPECTS, 3)
+    assert mask.shape == (len(deck),)
+    assert [deck[c] for c in np.flatnonzero(mask)] == [frozenset({"lel", "pto", "hbu"})]
+
+
+def test_get_candidate_masks_no_cards():
+    """should keep every combination but the guesses when no cards are drawn"""
+    payload = {
+        "base_suspects": list(BASE_SUSPECTS),
+        "match_length": 3,
+        "cards": [],
+        "previous_guesses": [["pto", "nnn", "jco"]],
+    }
+    (mask,) = batch.get_candidate_masks([payload])
+    assert mask.sum() == 34
+
+
+def test_get_matches_batch():
+    """should find exactly the same matches as get_matches for every payload"""
+    rng = random.Random(531)
+    payloads = build_payloads(BASE_SUSPECTS, 3, 100, rng)
+    payloads += build_payloads({"s{}".format(s) for s in range(9)}, 4, 50, rng)
+    rng.shuffle(payloads)
+    matches = batch.get_matches_batch(payloads, batch_size=16)
+    assert matches == [get_matches(payload) for payload in payloads]
+
+
+@patch("toac.numeric.np", None)
+def test_get_candidate_masks_without_numpy():
+    """should explain how to install NumPy when it is missing"""
+    with pytest.raises(ImportError, match=r"three-of-a-crime\[numpy\]"):
+        batch.get_candidate_masks([])
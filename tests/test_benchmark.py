@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+import json
+import random
+import sys
+from contextlib import redirect_stderr, redirect_stdout
+from io import StringIO
+from unittest.mock import Mock, patch
+
+import pytest
+
+import toac.benchmark as benchmark
+import toac.dealer as dealer
+import toac.player as player
+
+
+def test_time_function():
+    """should time the fastest of several calls"""
+    func = Mock()
+    with patch("time.perf_counter", side_effect=[0, 3, 10, 12, 20, 25]):
+        assert benchmark.time_function(func, 3) == 2
+    assert func.call_count == 3
+
+
+def test_build_game_states():
+    """should generate the same consistent game states for the same seed"""
+    states = benchmark.build_game_states(9, 4, 5, random.Random(1))
+    assert states == benchmark.build_game_states(9, 4, 5, random.Random(1))
+    for state in states:
+        assert len(state["base_suspects"]) == 9
+        assert len(state["cards"]) == 4
+        assert player.get_matches(**state)
+
+
+def test_stub_player():
+    """should never guess correctly"""
+    assert benchmark.stub_player(dealer.build_data_object()) == ()
+
+
+@patch("toac.benchmark.SUSPECT_COUNTS", (7,))
+@patch("toac.benchmark.GAME_PHASES", {"early": 1})
+@patch("toac.benchmark.NUM_GAME_STATES", 2)
+def test_benchmark_solver():
+    """should time every engine for every suspect count and game phase"""
+    results = benchmark.benchmark_solver(random.Random(1), 1)
+    assert [result["name"] for result in results] == [
+        "get_matches[engine=sets,suspects=7,phase=early]",
+        "get_matches[engine=bitmask,suspects=7,phase=early]",
+        "get_matches[engine=incremental,suspects=7,phase=early]",
+        "get_matches[engine=constraints,suspects=7,phase=early]",
+        "get_matches[engine=lazy,suspects=7,phase=early]",
+    ]
+    assert all(result["seconds"] > 0 for result in results)
+
+
+@patch("toac.benchmark.NUM_DEALER_GAMES", 2)
+def test_benchmark_dealer():
+    """should time the dealer's overhead per turn with stand-in players"""
+    (result,) = benchmark.benchmark_dealer(1, 1)
+    assert result["name"] == "run_game[players=stub]"
+    assert result["unit"] == "turn"
+
+
+@patch("toac.benchmark.JOB_COUNTS", (1, 2))
+@patch("toac.benchmark.NUM_GAMES_PER_JOB", 3)
+@patch("toac.dealer.run_games")
+def test_benchmark_games(run_games):
+    """should time whole simulations for every number of jobs"""
+    results = benchmark.benchmark_games(1, 1)
+    assert [result["name"] for result in results] == [
+        "run_games[players=toac.player:guess,jobs=1]",
+        "run_games[players=toac.player:guess,jobs=2]",
+    ]
+    run_games.assert_called_with(
+        6,
+        dealer.create_players(["toac.player:guess"] * 2),
+        jobs=2,
+        output_format="quiet",
+        seed=1,
+    )
+
+
+@patch("toac.benchmark.benchmark_solver", return_value=[])
+@patch("toac.benchmark.benchmark_games", return_value=[])
+def test_run_benchmarks(benchmark_games, benchmark_solver):
+    """should only run the chosen groups of benchmarks"""
+    report = benchmark.run_benchmarks(["games"], 531, 1)
+    assert report["seed"] == 531
+    assert report["results"] == []
+    benchmark_games.assert_called_once_with(531, 1)
+    benchmark_solver.assert_not_called()
+
+
+def test_get_regressions():
+    """should flag benchmarks which got slower than the threshold allows"""
+    baseline = {
+        "results": [
+            benchmark.create_result("a", 1.0, "call"),
+            benchmark.create_result("b", 1.0, "call"),
+        ]
+    }
+    report = {
+        "results": [
+            benchmark.create_result("a", 1.1, "call"),
+            benchmark.create_result("b", 1.5, "call"),
+            benchmark.create_result("c", 9.0, "call"),
+        ]
+    }
+    assert benchmark.get_regressions(report, baseline, 0.2) == [("b", 1.5)]
+
+
+@patch("toac.benchmark.benchmark_dealer")
+def test_main(benchmark_dealer, tmp_path):
+    """should write results and fail when they regress against the baseline"""
+    output_path = str(tmp_path / "results.json")
+    baseline_path = str(tmp_path / "baseline.json")
+    benchmark_dealer.return_value = [benchmark.create_result("a", 1.0, "turn")]
+    argv = ["toac-benchmark", "--only", "dealer", "--output", output_path]
+    with patch.object(sys, "argv", argv):
+        benchmark.main()
+    with open(output_path) as output_file:
+        results = json.load(output_file)
+    assert results["results"] == benchmark_dealer.return_value
+    with open(baseline_path, "w") as baseline_file:
+        json.dump(results, baseline_file)
+
+    benchmark_dealer.return_value = [benchmark.create_result("a", 2.0, "turn")]
+    argv = ["toac-benchmark", "--only", "dealer", "--baseline", baseline_path]
+    with patch.object(sys, "argv", argv), pytest.raises(SystemExit):
+        with redirect_stdout(StringIO()), redirect_stderr(StringIO()) as err:
+            benchmark.main()
+    assert "Regression: a is 2.00x slower" in err.getvalue()
@@ -1,27 +1,58 @@
 #!/usr/bin/env python3
 
+import asyncio
 import copy
+import importlib.metadata
+import itertools
 import json
+import os
+import pstats
+import random
 import subprocess
 import sys
-from contextlib import redirect_stdout
+from contextlib import redirect_stderr, redirect_stdout
 from io import StringIO
-from unittest.mock import ANY, Mock, NonCallableMagicMock, patch
+from unittest.mock import ANY, Mock, patch
+
+import pytest
 
 import toac.dealer as dealer
+import toac.player
+import toac.solver
 
 
 def test_create_game():
     """should create game object with correct properties"""
-    assert dealer.create_game(3) == {"id": 3, "winner": None, "rounds": 0}
+    assert dealer.create_game(3) == {
+        "id": 3,
+        "winner": None,
+        "rounds": 0,
+        "error": None,
+    }
 
 
-def test_create_deck():
-    """should create shuffled deck"""
-    deck = dealer.create_deck()
+def test_create_card_deck():
+    """should create shuffled deck of card indices"""
+    deck = dealer.create_card_deck()
     assert isinstance(deck, list)
-    assert deck != dealer.BASE_DECK
-    assert set(deck) == set(dealer.BASE_DECK)
+    assert deck != list(range(len(dealer.BASE_DECK)))
+    assert sorted(deck) == list(range(len(dealer.BASE_DECK)))
+
+
+def test_create_card_deck_seeded():
+    """should shuffle the deck the same way for the same seed and game"""
+    deck = dealer.create_card_deck(dealer.get_game_random(3, seed=531))
+    assert deck == dealer.create_card_deck(dealer.get_game_random(3, seed=531))
+    assert deck != dealer.create_card_deck(dealer.get_game_random(4, seed=531))
+    assert dealer.get_game_random(3) is random
+
+
+def test_create_card_deck_same_order():
+    """should shuffle card indices exactly as shuffling the cards themselves"""
+    deck = dealer.create_card_deck(dealer.get_game_random(3, seed=531))
+    cards = dealer.BASE_DECK[:]
+    dealer.get_game_random(3, seed=531).shuffle(cards)
+    assert [dealer.BASE_DECK[card] for card in deck] == cards
 
 
 def test_build_data_object():
@@ -42,13 +73,44 @@ def test_get_match_count():
     assert dealer.get_match_count(suspects, real_suspects) == 2
 
 
+def test_base_match_counts():
+    """should count the suspects shared by every pair of cards"""
+    for card, suspects in enumerate(dealer.BASE_DECK):
+        for other_card, other_suspects in enumerate(dealer.BASE_DECK):
+            assert dealer.BASE_MATCH_COUNTS[card][other_card] == (
+                dealer.get_match_count(suspects, other_suspects)
+            )
+
+
+def test_encode_data():
+    """should encode the data object of a game exactly as json.dumps would"""
+    game = dealer.create_game(4)
+    turns = dealer.play_game(game, PLAYERS, seed=531)
+    guesses = [frozenset({"pto", "nnn", "jco"}), frozenset({"pto", "nnn", "xyz"})]
+    turn = next(turns)
+    for guess in guesses * 3:
+        _, data, encoded_data = turn
+        assert dealer.encode_data(data, encoded_data) == json.dumps(
+            data, separators=(",", ":")
+        )
+        turn = dealer.send_player_guess(turns, guess)
+    assert len(data["previous_guesses"]) == len(guesses * 3)
+    assert data["previous_guesses"][1] == list(guesses[1])
+
+
 @patch(
     "subprocess.Popen",
     return_value=Mock(communicate=Mock(return_value=(b'["hbu", "lel", "pto"]', None))),
 )
 def test_get_player_guess(popen):
     """should ask user to guess correct suspects and store their guess"""
-    player = {"id": "P1", "program": "./p1", "wins": 0}
+    player = {
+        "id": "P1",
+        "program": "./p1",
+        "wins": 0,
+        "plugin": False,
+        "fork_server": False,
+    }
     data = {"base_suspects": [], "match_length": 3, "cards": [], "previous_guesses": []}
     guessed_suspects = dealer.get_player_guess(player, data)
     popen.assert_called_once_with(
@@ -60,6 +122,141 @@ def test_get_player_guess(popen):
     assert guessed_suspects == {"hbu", "lel", "pto"}
 
 
+def test_is_player_plugin():
+    """should distinguish Python players from executable player programs"""
+    entry_points = {"toac": Mock()}
+    with patch("toac.dealer.get_player_entry_points", return_value=entry_points):
+        assert dealer.is_player_plugin("toac.player:guess")
+        assert dealer.is_player_plugin("toac")
+        assert not dealer.is_player_plugin("./p1")
+        assert not dealer.is_player_plugin("missing")
+        assert not dealer.is_player_plugin(dealer.__file__)
+
+
+def test_get_player_entry_points():
+    """should retrieve players registered under the toac.players group"""
+    entry_point = importlib.metadata.EntryPoint(
+        "toac", "toac.player:guess", dealer.PLAYER_ENTRY_POINT_GROUP
+    )
+    other_entry_point = importlib.metadata.EntryPoint(
+        "toac", "toac.dealer:main", "console_scripts"
+    )
+    entry_points = [entry_point, other_entry_point]
+    if hasattr(importlib.metadata, "EntryPoints"):
+        entry_points = importlib.metadata.EntryPoints(entry_points)
+    else:
+        entry_points = {
+            dealer.PLAYER_ENTRY_POINT_GROUP: [entry_point],
+            "console_scripts": [other_entry_point],
+        }
+    with patch("importlib.metadata.entry_points", return_value=entry_points):
+        assert dealer.get_player_entry_points() == {"toac": entry_point}
+
+
+def test_load_player_plugin():
+    """should import module:callable references and entry points"""
+    assert dealer.load_player_plugin("toac.player:guess") == toac.player.guess
+    assert dealer.load_player_plugin("toac.solver:Solver.from_data") == (
+        toac.solver.Solver.from_data
+    )
+    entry_point = Mock()
+    entry_points = {"toac-test-entry-point": entry_point}
+    with patch("toac.dealer.get_player_entry_points", return_value=entry_points):
+        plugin = dealer.load_player_plugin("toac-test-entry-point")
+    assert plugin == entry_point.load.return_value
+
+
+def test_get_player_guess_plugin():
+    """should call Python players in-process with the data object itself"""
+    player = {"id": "P1", "program": "toac.player:guess", "wins": 0, "plugin": True}
+    data = dealer.build_data_object()
+    dealer.add_card_to_data(data, ("pto", "lsl", "jco"), 1)
+    dealer.add_card_to_data(data, ("nnn", "pto", "hbu"), 2)
+    dealer.add_card_to_data(data, ("kca", "pto", "lel"), 2)
+    dealer.add_card_to_data(data, ("kca", "nnn", "lsl"), 0)
+    old_data = copy.deepcopy(data)
+    with patch("subprocess.Popen") as popen:
+        guessed_suspects = dealer.get_player_guess(player, data)
+    popen.assert_not_called()
+    assert guessed_suspects == {"lel", "pto", "hbu"}
+    assert data == old_data
+
+
+def test_start_player_sessions():
+    """should only start session processes for players using the protocol"""
+    players = [
+        {"id": "P1", "program": "./p1", "wins": 0, "session": True},
+        {"id": "P2", "program": "./p2", "wins": 0, "session": False},
+    ]
+    with patch("subprocess.Popen") as popen:
+        sessions = dealer.start_player_sessions(players)
+    popen.assert_called_once_with(
+        ["./p1", "--session"], stdin=subprocess.PIPE, stdout=subprocess.PIPE
+    )
+    assert list(sessions.keys()) == ["P1"]
+    assert sessions["P1"]["process"] == popen.return_value
+
+
+def test_build_session_message():
+    """should only send setup once and only send unseen cards and guesses"""
+    session = {"process": None, "num_cards": 0, "num_guesses": 0}
+    data = {
+        "base_suspects": ["pto", "nnn", "jco"],
+        "match_length": 3,
+        "cards": [{"suspects": ("pto", "lsl", "jco"), "match_count": 1}],
+        "previous_guesses": [],
+    }
+    assert dealer.build_session_message(session, data) == data
+    data["previous_guesses"].append(["lsl", "lel", "nnn"])
+    data["cards"].append({"suspects": ("nnn", "pto", "hbu"), "match_count": 2})
+    assert dealer.build_session_message(session, data) == {
+        "cards": [{"suspects": ("nnn", "pto", "hbu"), "match_count": 2}],
+        "previous_guesses": [["lsl", "lel", "nnn"]],
+    }
+    assert session["num_cards"] == 2
+    assert session["num_guesses"] == 1
+
+
+def test_get_player_guess_session():
+    """should exchange one line of JSON with a session player per turn"""
+    process = Mock()
+    process.stdout.readline.return_value = b'["hbu", "lel", "pto"]\n'
+    session = {"process": process, "num_cards": 0, "num_guesses": 0}
+    player = {
+        "id": "P1",
+        "program": "./p1",
+        "wins": 0,
+        "session": True,
+        "plugin": False,
+    }
+    data = {"base_suspects": [], "match_length": 3, "cards": [], "previous_guesses": []}
+    with patch("subprocess.Popen") as popen:
+        guessed_suspects = dealer.get_player_guess(player, data, session)
+    popen.assert_not_called()
+    process.stdin.write.assert_any_call(b"\n")
+    process.stdin.flush.assert_called_once_with()
+    assert guessed_suspects == {"hbu", "lel", "pto"}
+
+
+def test_get_player_guess_session_closed():
+    """should treat a session player which exited early as invalid JSON"""
+    process = Mock()
+    process.stdin.write.side_effect = BrokenPipeError
+    session = {"process": process, "num_cards": 0, "num_guesses": 0}
+    data = {"base_suspects": [], "match_length": 3, "cards": [], "previous_guesses": []}
+    with pytest.raises(ValueError):
+        dealer.get_session_player_guess(session, data)
+
+
+def test_end_player_sessions():
+    """should close the input of every session and wait for it to exit"""
+    sessions = {"P1": {"process": Mock()}, "P2": {"process": Mock()}}
+    dealer.end_player_sessions(sessions)
+    for session in sessions.values():
+        session["process"].stdin.close.assert_called_once_with()
+        session["process"].wait.assert_called_once_with()
+
+
 def test_add_card_to_data():
     data = {"cards": []}
     suspects = {"lel", "pto", "nnn"}
@@ -69,29 +266,70 @@ def test_add_card_to_data():
     assert data["cards"] == [{"suspects": tuple(suspects), "match_count": match_count}]
 
 
-@patch("toac.dealer.print")
-def test_print_game_stats(print):
-    """should print statistics for each game"""
-    game = {"id": 1, "winner": 2, "rounds": 3}
-    lock = NonCallableMagicMock()
-    dealer.print_game_stats(game, lock)
-    lock.__enter__.assert_called_once_with()
-    lock.__exit__.assert_called_once_with(None, None, None)
+def test_format_game_stats():
+    """should format statistics for each game as text or as JSON"""
+    game = {"id": 1, "winner": 2, "rounds": 3, "error": None}
+    assert dealer.format_game_stats(game, "text") == (
+        "Game #1\n  Winner: 2\n  Rounds: 3\n"
+    )
+    assert json.loads(dealer.format_game_stats(game, "jsonl")) == game
+
+
+def test_format_game_stats_error():
+    """should include any error which ended the game"""
+    game = {"id": 1, "winner": None, "rounds": 1, "error": "Oops."}
+    assert dealer.format_game_stats(game, "text").endswith("  Oops.\n")
+
+
+def test_write_game_stats():
+    """should write statistics for every game passing through"""
+    games = [
+        {"id": 1, "winner": 2, "rounds": 3, "error": None},
+        {"id": 2, "winner": 1, "rounds": 5, "error": None},
+    ]
+    with redirect_stdout(StringIO()) as out:
+        assert list(dealer.write_game_stats(games, "jsonl")) == games
+    assert [json.loads(line) for line in out.getvalue().splitlines()] == games
+
+
+@patch("toac.dealer.OUTPUT_BUFFER_SIZE", 40)
+def test_write_game_stats_buffered():
+    """should only write once enough output has been buffered"""
+    games = [{"id": g, "winner": 1, "rounds": 3, "error": None} for g in range(4)]
+    with redirect_stdout(StringIO()) as out:
+        game_stats = dealer.write_game_stats(games, "text")
+        next(game_stats)
+        assert out.getvalue() == ""
+        next(game_stats)
+        assert out.getvalue().count("Game #") == 2
+        list(game_stats)
+    assert out.getvalue().count("Game #") == 4
+
+
+def test_write_game_stats_quiet():
+    """should write nothing in quiet mode"""
+    games = [{"id": 1, "winner": 2, "rounds": 3, "error": None}]
+    with redirect_stdout(StringIO()) as out:
+        assert list(dealer.write_game_stats(games, "quiet")) == games
+    assert out.getvalue() == ""
 
 
 # Constants for run_game tests
 PLAYERS = [
-    {"id": 1, "wins": 0, "program": "./p1"},
-    {"id": 2, "wins": 0, "program": "./p2"},
-    {"id": 3, "wins": 0, "program": "./p3"},
+    {"id": 1, "wins": 0, "program": "./p1", "session": False, "plugin": False},
+    {"id": 2, "wins": 0, "program": "./p2", "session": False, "plugin": False},
+    {"id": 3, "wins": 0, "program": "./p3", "session": False, "plugin": False},
 ]
-GAME = {"id": 1, "winner": None, "rounds": 0}
+GAME = {"id": 1, "winner": None, "rounds": 0, "error": None}
 DECK = [
-    {"pto", "lsl", "jco"},
-    {"nnn", "pto", "hbu"},
-    {"kca", "pto", "lel"},
-    {"kca", "nnn", "lsl"},
-    {"lel", "pto", "hbu"},
+    dealer.BASE_CARD_INDICES[frozenset(card)]
+    for card in (
+        {"pto", "lsl", "jco"},
+        {"nnn", "pto", "hbu"},
+        {"kca", "pto", "lel"},
+        {"kca", "nnn", "lsl"},
+        {"lel", "pto", "hbu"},
+    )
 ]
 DATA = {"base_suspects": [], "match_length": 3, "cards": [], "previous_guesses": []}
 GUESSES = [
@@ -103,16 +341,15 @@ def test_print_game_stats(print):
 
 
 @patch("toac.dealer.create_game", return_value=copy.deepcopy(GAME))
-@patch("toac.dealer.create_deck", return_value=copy.deepcopy(DECK))
+@patch("toac.dealer.create_card_deck", return_value=copy.deepcopy(DECK))
 @patch("toac.dealer.build_data_object", return_value=copy.deepcopy(DATA))
 @patch("toac.dealer.get_player_guess", side_effect=copy.deepcopy(GUESSES))
-def test_run_game(get_player_guess, build_data_object, create_deck, create_game):
+def test_run_game(get_player_guess, build_data_object, create_card_deck, create_game):
     """should run game with given players, taking turns as necessary"""
-    lock = NonCallableMagicMock()
     game = create_game.return_value
     data = build_data_object.return_value
     with redirect_stdout(StringIO()):
-        dealer.run_game(1, PLAYERS, lock)
+        dealer.run_game(1, PLAYERS)
     assert game["winner"] == 1
     assert game["rounds"] == 4
     assert len(data["cards"]) == 4
@@ -120,16 +357,17 @@ def test_run_game(get_player_guess, build_data_object, create_deck, create_game)
 
 
 @patch("toac.dealer.create_game", return_value=copy.deepcopy(GAME))
-@patch("toac.dealer.create_deck", return_value=copy.deepcopy(DECK))
+@patch("toac.dealer.create_card_deck", return_value=copy.deepcopy(DECK))
 @patch("toac.dealer.build_data_object", return_value=copy.deepcopy(DATA))
-@patch("toac.dealer.get_player_guess", return_value=[GUESSES[1]])
-def test_exhaust_deck(get_player_guess, build_data_object, create_deck, create_game):
+@patch("toac.dealer.get_player_guess", return_value=GUESSES[1])
+def test_exhaust_deck(
+    get_player_guess, build_data_object, create_card_deck, create_game
+):
     """should fail gracefully if deck is exhausted during gameplay"""
-    lock = NonCallableMagicMock()
     game = create_game.return_value
     data = build_data_object.return_value
     with redirect_stdout(StringIO()):
-        dealer.run_game(1, PLAYERS, lock)
+        dealer.run_game(1, PLAYERS)
     assert game["winner"] is None
     assert game["rounds"] == 4
     assert len(data["cards"]) == 4
@@ -137,28 +375,237 @@ def test_exhaust_deck(get_player_guess, build_data_object, create_deck, create_g
 
 
 @patch("toac.dealer.create_game", return_value=copy.deepcopy(GAME))
-@patch("toac.dealer.create_deck", return_value=copy.deepcopy(DECK))
+@patch("toac.dealer.create_card_deck", return_value=copy.deepcopy(DECK))
+@patch("toac.dealer.build_data_object", return_value=copy.deepcopy(DATA))
+@patch("toac.dealer.get_player_guess", return_value={"pto", "nnn", "xyz"})
+def test_guess_not_a_card(
+    get_player_guess, build_data_object, create_card_deck, create_game
+):
+    """should pass on guesses which are not cards, tracing them as no card"""
+    data = build_data_object.return_value
+    trace = dealer.create_trace()
+    with redirect_stdout(StringIO()):
+        dealer.run_game(1, PLAYERS, trace=trace)
+    assert len(data["previous_guesses"]) == 3
+    assert all(
+        set(guess) == {"pto", "nnn", "xyz"} for guess in data["previous_guesses"]
+    )
+    assert list(trace["guesses"]) == [dealer.NO_TRACE_CARD] * 4
+
+
+@patch("toac.dealer.create_game", return_value=copy.deepcopy(GAME))
+@patch("toac.dealer.create_card_deck", return_value=copy.deepcopy(DECK))
 @patch("toac.dealer.build_data_object", return_value=copy.deepcopy(DATA))
 @patch("toac.dealer.get_player_guess", side_effect=ValueError)
-def test_invalid_json(get_player_guess, build_data_object, create_deck, create_game):
+def test_invalid_json(
+    get_player_guess, build_data_object, create_card_deck, create_game
+):
     """should silently fail when invalid JSON produces ValueError"""
-    lock = NonCallableMagicMock()
     game = create_game.return_value
     data = build_data_object.return_value
     with redirect_stdout(StringIO()):
-        dealer.run_game(1, PLAYERS, lock)
+        dealer.run_game(1, PLAYERS)
     assert game["winner"] is None
     assert game["rounds"] == 1
+    assert game["error"] == "Returned JSON is invalid."
     assert len(data["cards"]) == 1
     assert len(data["previous_guesses"]) == 0
 
 
-def test_get_finished_games():
-    """should yield game when joining respective process"""
-    processes = [Mock(), Mock(), Mock()]
-    games = dealer.get_finished_games(processes)
-    for game, process in zip(games, processes):
-        assert process.get.call_count == 1
+# Write an executable player program which runs the given Python code
+def write_player_program(path, code):
+    path.write_text("#!{}\n{}\n".format(sys.executable, code))
+    path.chmod(0o755)
+    return str(path)
+
+
+def test_get_player_guess_async(tmp_path):
+    """should run player programs without blocking the event loop"""
+    program = write_player_program(
+        tmp_path / "p1", 'import sys; sys.stdin.read(); print(\'["hbu","lel","pto"]\')'
+    )
+    player = dealer.create_players([program])[0]
+    guessed_suspects = asyncio.run(
+        dealer.get_player_guess_async(player, dealer.build_data_object())
+    )
+    assert guessed_suspects == {"hbu", "lel", "pto"}
+
+
+def test_run_game_async():
+    """should play exactly the same game as run_game"""
+    players = dealer.create_players(["toac.player:guess"] * 3)
+    game = asyncio.run(dealer.run_game_async(3, players, seed=531))
+    assert game == dealer.run_game(3, players, seed=531)
+
+
+def test_run_game_async_session():
+    """should play games with session players without blocking"""
+    program = os.path.join(os.path.dirname(toac.player.__file__), "player.py")
+    players = dealer.create_players([program] * 2, session=[program])
+    games = dealer.run_game_chunk_async(range(1, 5), players, seed=531, concurrency=4)
+    plugin_players = dealer.create_players(["toac.player:guess"] * 2)
+    assert games == dealer.run_game_chunk(range(1, 5), plugin_players, seed=531)
+
+
+def test_run_game_async_timeout(tmp_path):
+    """should end the game with an error when a player takes too long"""
+    program = write_player_program(tmp_path / "p1", "import time; time.sleep(10)")
+    players = dealer.create_players([program])
+    game = asyncio.run(dealer.run_game_async(1, players, timeout=0.1))
+    assert game["error"] == "Player timed out."
+    assert game["rounds"] == 1
+
+
+@patch("toac.dealer.run_game_async")
+def test_run_game_chunk_async(run_game_async):
+    """should interleave no more games than the concurrency allows"""
+    num_running = 0
+    max_running = 0
+
+    async def run_game(game_id, players, seed, timeout, metrics, trace):
+        nonlocal num_running, max_running
+        num_running += 1
+        max_running = max(max_running, num_running)
+        await asyncio.sleep(0.01)
+        num_running -= 1
+        return game_id
+
+    run_game_async.side_effect = run_game
+    games = dealer.run_game_chunk_async(range(1, 11), PLAYERS, concurrency=3)
+    assert games == list(range(1, 11))
+    assert max_running == 3
+
+
+def test_histogram():
+    """should bucket measurements so that percentiles stay accurate"""
+    histogram = dealer.create_histogram()
+    for value in range(1, 101):
+        dealer.add_to_histogram(histogram, value / 1000)
+    summary = dealer.summarize_histogram(histogram)
+    assert summary["count"] == 100
+    assert summary["mean"] == pytest.approx(0.0505)
+    assert summary["p50"] == pytest.approx(0.05, rel=0.1)
+    assert summary["p95"] == pytest.approx(0.095, rel=0.1)
+    assert summary["p99"] == pytest.approx(0.099, rel=0.1)
+    assert summary["max"] == 0.1
+
+
+def test_merge_player_metrics():
+    """should merge the metrics gathered by several workers"""
+    metrics = {}
+    other_metrics = {}
+    dealer.record_player_metric(metrics, "P1", "wall", 0.5)
+    dealer.record_player_metric(other_metrics, "P1", "wall", 2.0)
+    dealer.record_player_metric(other_metrics, "P2", "rss", 1024)
+    dealer.merge_player_metrics(metrics, other_metrics)
+    assert dealer.summarize_histogram(metrics["P1"]["wall"])["count"] == 2
+    assert metrics["P1"]["wall"]["max"] == 2.0
+    assert metrics["P2"]["rss"]["count"] == 1
+
+
+def test_get_player_guess_metrics(tmp_path):
+    """should measure the wall time, CPU time and memory of player programs"""
+    program = write_player_program(
+        tmp_path / "p1", 'import sys; sys.stdin.read(); print(\'["hbu","lel","pto"]\')'
+    )
+    player = dealer.create_players([program])[0]
+    metrics = {}
+    guessed_suspects = dealer.get_player_guess(
+        player, dealer.build_data_object(), metrics=metrics
+    )
+    assert guessed_suspects == {"hbu", "lel", "pto"}
+    assert sorted(metrics["P1"]) == ["cpu", "rss", "wall"]
+    assert metrics["P1"]["rss"]["max"] > 1024 * 1024
+
+
+def test_run_game_metrics():
+    """should measure every call of every player during a game"""
+    players = dealer.create_players(["toac.player:guess"] * 2)
+    metrics = {}
+    game = dealer.run_game(1, players, seed=531, metrics=metrics)
+    assert game == dealer.run_game(1, players, seed=531)
+    num_calls = sum(metrics[p]["wall"]["count"] for p in ("P1", "P2"))
+    assert num_calls == game["rounds"]
+    assert metrics["P1"]["cpu"]["count"] == metrics["P1"]["wall"]["count"]
+
+
+def test_run_game_trace():
+    """should record every card drawn and every guess made in the trace"""
+    players = dealer.create_players(["toac.player:guess"] * 2)
+    trace = dealer.create_trace()
+    game = dealer.run_game(4, players, seed=531, trace=trace)
+    deck = dealer.create_card_deck(dealer.get_game_random(4, seed=531))
+    assert trace["eyewitness"] == deck[-1]
+    assert list(trace["cards"]) == deck[::-1][1 : game["rounds"] + 1]
+    assert len(trace["guesses"]) == game["rounds"]
+    assert trace["guesses"][-1] == trace["eyewitness"]
+    assert "P{}".format(trace["winner"] + 1) == game["winner"]
+
+
+@patch("toac.dealer.create_game", return_value=copy.deepcopy(GAME))
+@patch("toac.dealer.get_player_guess", side_effect=ValueError)
+def test_pack_trace_invalid_json(get_player_guess, create_game):
+    """should pack a trace of fixed width, even for games ending in error"""
+    trace = dealer.create_trace()
+    game = dealer.run_game(1, PLAYERS, trace=trace)
+    record = dealer.pack_trace(game, trace)
+    assert len(record) == dealer.TRACE_RECORD.size
+    fields = dealer.TRACE_RECORD.unpack(record)
+    assert fields[:4] == (game["id"], -1, 1, 1)
+    assert fields[-1] == bytes([dealer.NO_TRACE_CARD] * 34)
+
+
+def test_get_game_chunks():
+    """should split game IDs into chunks of consecutive games"""
+    chunks = list(dealer.get_game_chunks(7, 3))
+    assert chunks == [range(1, 4), range(4, 7), range(7, 8)]
+
+
+def test_get_chunk_size():
+    """should give every job several chunks, within the chunk size limit"""
+    assert dealer.get_chunk_size(5, 4) == 1
+    assert dealer.get_chunk_size(160, 4) == 10
+    assert dealer.get_chunk_size(10**9, 4) == dealer.MAX_GAMES_PER_CHUNK
+    assert dealer.get_chunk_size(10**9, 4, 8) == dealer.MAX_GAMES_PER_CHUNK * 8
+
+
+@patch("toac.dealer.run_game", side_effect=lambda game_id, players, seed: game_id)
+def test_run_game_chunk(run_game):
+    """should run every game in a chunk"""
+    assert dealer.run_game_chunk(range(3, 6), PLAYERS) == [3, 4, 5]
+    assert run_game.call_count == 3
+
+
+# A stand-in for multiprocessing.Pool which runs every task as soon as it is
+# submitted, in the current process
+def run_task_immediately(func, args, callback, error_callback):
+    try:
+        result = func(*args)
+    except Exception as error:
+        error_callback(error)
+    else:
+        callback(result)
+
+
+@patch("toac.dealer.run_game", side_effect=lambda game_id, players, seed: game_id)
+def test_get_finished_games(run_game):
+    """should yield every game while bounding the chunks in flight"""
+    pool = Mock(apply_async=Mock(side_effect=run_task_immediately))
+    chunks = dealer.get_game_chunks(10, 2)
+    games = dealer.get_finished_games(pool, chunks, PLAYERS, 2)
+    assert next(games) == 1
+    assert pool.apply_async.call_count == 2
+    assert list(games) == list(range(2, 11))
+    assert pool.apply_async.call_count == 5
+
+
+@patch("toac.dealer.run_game", side_effect=OSError)
+def test_get_finished_games_error(run_game):
+    """should re-raise errors raised while running a chunk of games"""
+    pool = Mock(apply_async=Mock(side_effect=run_task_immediately))
+    chunks = dealer.get_game_chunks(4, 2)
+    with pytest.raises(OSError):
+        list(dealer.get_finished_games(pool, chunks, PLAYERS, 2))
 
 
 def test_get_sorted_player_wins():
@@ -192,16 +639,203 @@ def test_print_player_wins(print):
     print.assert_any_call("P1 Wins: 1")
 
 
-@patch("multiprocessing.pool.Pool.apply_async")
-def test_run_games_mock_pool(apply_async):
-    """should run every game asynchronously in separate (mocked) pool"""
+@patch("toac.dealer.print")
+def test_print_player_wins_jsonl(print):
+    """should print player wins as a single line of JSON"""
+    games = [
+        {"id": 1, "winner": "P2", "rounds": 4},
+        {"id": 2, "winner": "P2", "rounds": 3},
+        {"id": 3, "winner": None, "rounds": 34},
+    ]
+    dealer.print_player_wins(games, "jsonl")
+    print.assert_called_once_with('{"wins":{"P2":2}}')
+
+
+@patch("multiprocessing.pool.Pool.apply_async", side_effect=run_task_immediately)
+@patch(
+    "toac.dealer.run_game",
+    side_effect=lambda game_id, players, seed: {
+        "id": game_id,
+        "winner": "P1",
+        "rounds": 1,
+        "error": None,
+    },
+)
+def test_run_games_mock_pool(run_game, apply_async):
+    """should run games in chunks in a separate (mocked) pool"""
     players = [{"id": 1, "wins": 0, "program": "./toac/player.py"}]
-    num_games = 5
+    num_games = 10
+    with redirect_stdout(StringIO()) as out:
+        dealer.run_games(num_games, players, jobs=2)
+    assert run_game.call_count == num_games
+    assert apply_async.call_count == 10
+    apply_async.assert_any_call(
+        dealer.run_game_chunk,
+        args=(range(1, 2), players, None),
+        callback=ANY,
+        error_callback=ANY,
+    )
+    assert out.getvalue().count("Game #") == 10
+    assert out.getvalue().endswith("Rounds: 1\nP1 Wins: 10\n")
+
+
+@patch("multiprocessing.pool.Pool.apply_async", side_effect=run_task_immediately)
+@patch(
+    "toac.dealer.run_game",
+    side_effect=lambda game_id, players, seed: {
+        "id": game_id,
+        "winner": "P1",
+        "rounds": 1,
+        "error": None,
+    },
+)
+def test_run_games_quiet(run_game, apply_async):
+    """should only output the total wins in quiet mode"""
+    players = [{"id": 1, "wins": 0, "program": "./toac/player.py"}]
+    with redirect_stdout(StringIO()) as out:
+        dealer.run_games(10, players, jobs=2, output_format="quiet")
+    assert out.getvalue() == "P1 Wins: 10\n"
+
+
+@patch("multiprocessing.pool.Pool.apply_async", side_effect=run_task_immediately)
+def test_run_games_metrics(apply_async, tmp_path):
+    """should report metrics for every player and write them as JSON"""
+    players = dealer.create_players(["toac.player:guess"] * 2)
+    metrics_path = str(tmp_path / "metrics.json")
+    with redirect_stdout(StringIO()) as out:
+        dealer.run_games(
+            10,
+            players,
+            jobs=2,
+            output_format="quiet",
+            seed=1,
+            metrics_path=metrics_path,
+        )
+    assert "P1 wall (ms): count " in out.getvalue()
+    assert "P2 cpu (ms): count " in out.getvalue()
+    with open(metrics_path) as metrics_file:
+        metrics = json.load(metrics_file)
+    num_calls = sum(metrics["summaries"][p]["wall"]["count"] for p in ("P1", "P2"))
+    assert num_calls >= 10
+    assert metrics["histograms"]["P1"]["wall"]["count"] > 0
+
+
+# Retrieve the names of every function profiled in a pstats file
+def get_profiled_functions(profile_path):
+    return {function for _, _, function in pstats.Stats(profile_path).stats}
+
+
+def test_run_games_profile(tmp_path):
+    """should merge the profiles of every worker into one pstats file"""
+    players = dealer.create_players(["toac.player:guess"] * 2)
+    profile_path = str(tmp_path / "toac.prof")
+    with redirect_stdout(StringIO()):
+        dealer.run_games(10, players, jobs=2, profile_path=profile_path)
+    functions = get_profiled_functions(profile_path)
+    assert "run_game" in functions
+    assert "get_matches" in functions
+
+
+def test_run_games_profile_players(tmp_path):
+    """should merge the profiles of player programs in too"""
+    program = os.path.join(os.path.dirname(toac.player.__file__), "player.py")
+    players = dealer.create_players([program] * 2)
+    profile_path = str(tmp_path / "toac.prof")
     with redirect_stdout(StringIO()):
-        dealer.run_games(num_games, players)
-    assert apply_async.call_count == num_games
-    apply_async.assert_any_call(dealer.run_game, args=(1, players, ANY))
-    assert apply_async.return_value.get.call_count == 5
+        dealer.run_games(
+            1, players, jobs=1, profile_path=profile_path, profile_players=True
+        )
+    functions = get_profiled_functions(profile_path)
+    assert "run_game" in functions
+    assert "transform_data" in functions
+    assert dealer.PROFILE_DIR_ENV_VAR not in os.environ
+
+
+@patch("multiprocessing.pool.Pool.apply_async", side_effect=run_task_immediately)
+def test_run_games_trace(apply_async, tmp_path):
+    """should write the trace of every game after a header"""
+    players = dealer.create_players(["toac.player:guess"] * 2)
+    trace_path = tmp_path / "games.trace"
+    with redirect_stdout(StringIO()):
+        dealer.run_games(10, players, jobs=2, seed=1, trace_path=str(trace_path))
+    trace_bytes = trace_path.read_bytes()
+    assert trace_bytes.startswith(dealer.TRACE_MAGIC)
+    records_size = 10 * dealer.TRACE_RECORD.size
+    records = trace_bytes[len(trace_bytes) - records_size :]
+    game_ids = [fields[0] for fields in dealer.TRACE_RECORD.iter_unpack(records)]
+    assert sorted(game_ids) == list(range(1, 11))
+
+
+@patch(
+    "toac.dealer.BASE_DECK",
+    list(map(frozenset, itertools.combinations(range(11), r=4))),
+)
+def test_run_games_trace_large_deck(tmp_path):
+    """should refuse to trace decks whose cards do not fit in a byte"""
+    players = dealer.create_players(["toac.player:guess"] * 2)
+    trace_path = tmp_path / "games.trace"
+    with pytest.raises(ValueError, match="at most 255 cards"):
+        dealer.run_games(10, players, trace_path=str(trace_path))
+    assert not trace_path.exists()
+    argv = ["toac", "10", "./p1", "./p2", "--trace", str(trace_path)]
+    with patch.object(sys, "argv", argv), redirect_stderr(StringIO()) as err:
+        with pytest.raises(SystemExit):
+            dealer.parse_cli_args()
+    assert "--trace supports decks of at most 255 cards" in err.getvalue()
+
+
+# Create the state of a sequential test between two players
+def create_sequential_test(confidence=0.95):
+    players = dealer.create_players(["./p1", "./p2"])
+    return dealer.create_sequential_test(players, confidence)
+
+
+def test_update_sequential_test():
+    """should decide once the first player clearly wins more often"""
+    test = create_sequential_test()
+    num_games = 0
+    while not dealer.update_sequential_test(test, {"winner": "P1"}):
+        num_games += 1
+        assert num_games < 100
+    assert test["winner"] == "P1"
+    low, high = dealer.get_sequential_test_interval(test)
+    assert 0 < low < high == 1
+
+
+def test_update_sequential_test_undecided():
+    """should not decide while both players win equally often"""
+    test = create_sequential_test()
+    for game_id in range(1000):
+        winner = ("P1", "P2", None)[game_id % 3]
+        assert not dealer.update_sequential_test(test, {"winner": winner})
+    low, high = dealer.get_sequential_test_interval(test)
+    assert -0.2 < low < 0 < high < 0.2
+    summary = dealer.summarize_sequential_test(test)
+    assert summary["games"] == 1000
+    assert summary["winner"] is None
+
+
+@patch("multiprocessing.pool.Pool.apply_async", side_effect=run_task_immediately)
+@patch(
+    "toac.dealer.run_game",
+    side_effect=lambda game_id, players, seed: {
+        "id": game_id,
+        "winner": "P2",
+        "rounds": 1,
+        "error": None,
+    },
+)
+def test_run_games_confidence(run_game, apply_async):
+    """should stop playing games once the sequential test decides"""
+    players = dealer.create_players(["./p1", "./p2"])
+    with redirect_stdout(StringIO()) as out:
+        dealer.run_games(10000, players, jobs=2, output_format="jsonl", confidence=0.95)
+    lines = out.getvalue().splitlines()
+    summary = json.loads(lines[-1])["sequential_test"]
+    assert summary["winner"] == "P2"
+    assert summary["games"] < 100
+    assert len(lines) == summary["games"] + 2
+    assert run_game.call_count < 10000
 
 
 def test_create_players():
@@ -209,7 +843,41 @@ def test_create_players():
     programs = ["./p1", "./p2", "./p3"]
     players = dealer.create_players(programs)
     for p, (program, player) in enumerate(zip(programs, players)):
-        assert player == {"program": program, "wins": 0, "id": "P{}".format(p + 1)}
+        assert player == {
+            "program": program,
+            "wins": 0,
+            "id": "P{}".format(p + 1),
+            "session": False,
+            "plugin": False,
+            "fork_server": False,
+        }
+
+
+def test_create_players_plugin():
+    """should recognize Python players among the player programs"""
+    programs = ["./p1", "toac.player:guess"]
+    players = dealer.create_players(programs, session=programs)
+    assert players[0]["plugin"] is False
+    assert players[0]["session"] is True
+    assert players[1]["plugin"] is True
+    assert players[1]["session"] is False
+
+
+def test_create_players_fork_server():
+    """should only run Python scripts not using sessions from fork servers"""
+    program = os.path.join(os.path.dirname(toac.player.__file__), "player.py")
+    players = dealer.create_players(
+        [program, "./p1", "toac.player:guess"], fork_server=True
+    )
+    assert [player["fork_server"] for player in players] == [True, False, False]
+    players = dealer.create_players([program], session=[program], fork_server=True)
+    assert players[0]["fork_server"] is False
+
+
+def test_create_players_session():
+    """should only mark the given programs as using the session protocol"""
+    players = dealer.create_players(["./p1", "./p2"], session=["./p2"])
+    assert [player["session"] for player in players] == [False, True]
 
 
 @patch("sys.argv", ["./toac/dealer.py", "10", "./p1", "./p2", "./p3"])
@@ -220,4 +888,89 @@ def test_main(run_games):
     players = dealer.create_players(programs)
     with redirect_stdout(StringIO()):
         dealer.main()
-    run_games.assert_called_once_with(10, players)
+    run_games.assert_called_once_with(
+        10,
+        players,
+        jobs=None,
+        output_format="text",
+        seed=None,
+        concurrency=None,
+        timeout=None,
+        measure=False,
+        metrics_path=None,
+        profile_path=None,
+        profile_players=False,
+        trace_path=None,
+        confidence=None,
+    )
+
+
+@patch(
+    "sys.argv",
+    [
+        "./toac/dealer.py",
+        "--session",
+        "./p1",
+        "-j",
+        "2",
+        "--format",
+        "jsonl",
+        "--seed",
+        "5",
+        "--concurrency",
+        "8",
+        "--timeout",
+        "2.5",
+        "--metrics",
+        "--metrics-output",
+        "metrics.json",
+        "--profile",
+        "toac.prof",
+        "--profile-players",
+        "--trace",
+        "games.trace",
+        "--confidence",
+        "0.95",
+        "10",
+        "./p1",
+        "./p2",
+    ],
+)
+@patch("toac.dealer.run_games")
+def test_main_session(run_games):
+    """should run session players when requested from the CLI"""
+    players = dealer.create_players(["./p1", "./p2"], session=["./p1"])
+    with redirect_stdout(StringIO()):
+        dealer.main()
+    run_games.assert_called_once_with(
+        10,
+        players,
+        jobs=2,
+        output_format="jsonl",
+        seed=5,
+        concurrency=8,
+        timeout=2.5,
+        measure=True,
+        metrics_path="metrics.json",
+        profile_path="toac.prof",
+        profile_players=True,
+        trace_path="games.trace",
+        confidence=0.95,
+    )
+
+
+def test_parse_cli_args_invalid_combinations():
+    """should refuse options which do nothing with the other options given"""
+    for options, message in (
+        (["--timeout", "2"], "--timeout only applies with --concurrency"),
+        (
+            ["--fork-server", "--concurrency", "4"],
+            "--fork-server cannot be used with --concurrency",
+        ),
+        (["--profile-players"], "--profile-players only applies with --profile"),
+    ):
+        argv = ["toac", "10", "./p1", "./p2", *options]
+        with patch.object(sys, "argv", argv), redirect_stderr(StringIO()) as err:
+            with pytest.raises(SystemExit):
+                dealer.parse_cli_args()
+        assert message in err.getvalue()
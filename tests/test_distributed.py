@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+import multiprocessing
+import multiprocessing.connection
+import time
+from contextlib import redirect_stdout
+from io import StringIO
+from unittest.mock import patch
+
+import pytest
+
+import toac.dealer as dealer
+import toac.distributed as distributed
+
+AUTHKEY = b"toac-test"
+PROGRAMS = ["toac.player:guess", "toac.player:guess"]
+
+
+def create_coordinator(num_games=10, chunk_size=4, lease_timeout=None):
+    players = dealer.create_players(PROGRAMS)
+    return distributed.Coordinator(num_games, players, 531, chunk_size, lease_timeout)
+
+
+def test_parse_address():
+    """should parse a host and port, defaulting to localhost"""
+    assert distributed.parse_address("example.com:1234") == ("example.com", 1234)
+    assert distributed.parse_address(":1234") == ("127.0.0.1", 1234)
+
+
+def test_lease_chunk():
+    """should lease every chunk once, then nothing until a chunk is released"""
+    coordinator = create_coordinator()
+    leases = [coordinator.lease_chunk(1) for _ in range(3)]
+    assert [lease[1:] for lease in leases] == [(1, 5), (5, 9), (9, 11)]
+    assert coordinator.lease_chunk(2) is None
+    coordinator.release_worker(1)
+    assert coordinator.lease_chunk(2)[1:] == (1, 5)
+
+
+def test_lease_chunk_expired():
+    """should lease a chunk again once its lease expires"""
+    coordinator = create_coordinator(lease_timeout=0.01)
+    first_lease_id, start, stop = coordinator.lease_chunk(1)
+    coordinator.lease_chunk(1)
+    coordinator.lease_chunk(1)
+    time.sleep(0.02)
+    second_lease_id, *chunk = coordinator.lease_chunk(2)
+    assert chunk == [start, stop]
+    assert second_lease_id != first_lease_id
+
+
+def test_finish_chunk_duplicate():
+    """should only keep the first result for every chunk"""
+    coordinator = create_coordinator(num_games=4)
+    lease_id, start, stop = coordinator.lease_chunk(1)
+    games = dealer.run_game_chunk(range(start, stop), coordinator.settings["players"])
+    coordinator.finish_chunk(lease_id, games)
+    coordinator.finish_chunk(lease_id, games)
+    assert coordinator.is_finished()
+    assert list(coordinator.get_finished_games()) == games
+
+
+def test_finish_chunk_expired():
+    """should keep the result of a chunk whose lease expired"""
+    coordinator = create_coordinator(num_games=4, lease_timeout=0.01)
+    lease_id, start, stop = coordinator.lease_chunk(1)
+    time.sleep(0.02)
+    with coordinator.lock:
+        coordinator.expire_leases()
+    games = dealer.run_game_chunk(range(start, stop), coordinator.settings["players"])
+    coordinator.finish_chunk(lease_id, games)
+    assert coordinator.is_finished()
+    assert coordinator.lease_chunk(2) is None
+
+
+def test_run_workers():
+    """should play every game on workers, exactly as the dealer would"""
+    coordinator = create_coordinator(num_games=20)
+    listener = distributed.start_coordinator_server(
+        coordinator, ("127.0.0.1", 0), AUTHKEY
+    )
+    try:
+        workers = [
+            multiprocessing.Process(
+                target=distributed.run_worker, args=(listener.address, AUTHKEY)
+            )
+            for _ in range(2)
+        ]
+        for worker in workers:
+            worker.start()
+        games = sorted(coordinator.get_finished_games(), key=lambda game: game["id"])
+        for worker in workers:
+            worker.join(timeout=10)
+            assert worker.exitcode == 0
+    finally:
+        distributed.stop_coordinator_server(listener)
+    players = coordinator.settings["players"]
+    assert games == dealer.run_game_chunk(range(1, 21), players, 531)
+
+
+def test_run_workers_lost_worker():
+    """should hand out the chunk of a worker which disconnects to another"""
+    coordinator = create_coordinator(num_games=8)
+    listener = distributed.start_coordinator_server(
+        coordinator, ("127.0.0.1", 0), AUTHKEY
+    )
+    try:
+        # A worker which leases a chunk and disconnects without finishing it
+        with multiprocessing.connection.Client(
+            listener.address, authkey=AUTHKEY
+        ) as connection:
+            connection.send({"type": "lease"})
+            assert connection.recv()["lease"][1:] == (1, 5)
+        worker = multiprocessing.Process(
+            target=distributed.run_worker, args=(listener.address, AUTHKEY)
+        )
+        worker.start()
+        games = sorted(coordinator.get_finished_games(), key=lambda game: game["id"])
+        worker.join(timeout=10)
+    finally:
+        distributed.stop_coordinator_server(listener)
+    assert [game["id"] for game in games] == list(range(1, 9))
+
+
+def test_run_workers_wrong_authkey():
+    """should refuse workers which do not know the authkey"""
+    coordinator = create_coordinator(num_games=4)
+    listener = distributed.start_coordinator_server(
+        coordinator, ("127.0.0.1", 0), AUTHKEY
+    )
+    try:
+        with pytest.raises(multiprocessing.AuthenticationError):
+            distributed.run_worker(listener.address, b"wrong")
+        assert coordinator.lease_chunk(1)[1:] == (1, 5)
+    finally:
+        distributed.stop_coordinator_server(listener)
+
+
+@patch("toac.distributed.run_workers")
+def test_main_worker(run_workers):
+    """should run workers against the given coordinator"""
+    distributed.main(["--authkey", "secret", "worker", "example.com:1234", "-j", "3"])
+    run_workers.assert_called_once_with(("example.com", 1234), b"secret", jobs=3)
+
+
+@patch("toac.distributed.run_coordinator")
+def test_main_coordinator(run_coordinator):
+    """should run a coordinator for the given games"""
+    with patch.dict("os.environ", {distributed.AUTHKEY_ENV_VAR: "secret"}):
+        distributed.main(
+            ["coordinator", "10", *PROGRAMS, "--seed", "531", "--chunk-size", "5"]
+        )
+    run_coordinator.assert_called_once_with(
+        10,
+        dealer.create_players(PROGRAMS),
+        ("127.0.0.1", distributed.DEFAULT_PORT),
+        b"secret",
+        output_format="text",
+        seed=531,
+        chunk_size=5,
+        lease_timeout=distributed.DEFAULT_LEASE_TIMEOUT,
+    )
+
+
+def test_run_coordinator():
+    """should print statistics once every game has been played"""
+    players = dealer.create_players(PROGRAMS)
+    address = ("127.0.0.1", 0)
+    out = StringIO()
+    real_start = distributed.start_coordinator_server
+
+    # Start a worker as soon as the coordinator is listening
+    def start_server(coordinator, address, authkey):
+        listener = real_start(coordinator, address, authkey)
+        worker = multiprocessing.Process(
+            target=distributed.run_worker, args=(listener.address, authkey)
+        )
+        worker.start()
+        return listener
+
+    with patch("toac.distributed.start_coordinator_server", start_server):
+        with redirect_stdout(out):
+            distributed.run_coordinator(
+                6, players, address, AUTHKEY, output_format="quiet", seed=531
+            )
+    assert "Win" in out.getvalue()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import subprocess
+import sys
+
+import toac.dealer as dealer
+import toac.forkserver as forkserver
+import toac.player
+
+PLAYER_PATH = os.path.join(os.path.dirname(toac.player.__file__), "player.py")
+
+
+# Send a single request to a fork server, retrieving its response
+def send_request(server, request):
+    server.stdin.write(forkserver.FRAME_HEADER.pack(len(request)) + request)
+    server.stdin.flush()
+    header = server.stdout.read(forkserver.RESPONSE_HEADER.size)
+    response_size, _, _ = forkserver.RESPONSE_HEADER.unpack(header)
+    return server.stdout.read(response_size)
+
+
+# Start a fork server for the given player script
+def start_server(script_path):
+    return subprocess.Popen(
+        [sys.executable, "-m", "toac.forkserver", script_path],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+    )
+
+
+def test_serve():
+    """should answer every request with the output of a forked player"""
+    with open(os.path.join(os.path.dirname(PLAYER_PATH), "example.json"), "rb") as f:
+        request = f.read()
+    server = start_server(PLAYER_PATH)
+    try:
+        for _ in range(3):
+            response = send_request(server, request)
+            assert set(json.loads(response)) == {"lel", "pto", "hbu"}
+    finally:
+        server.stdin.close()
+        assert server.wait(timeout=10) == 0
+        server.stdout.close()
+
+
+def test_serve_without_main(tmp_path):
+    """should run scripts without a main function as __main__"""
+    script_path = tmp_path / "p1"
+    script_path.write_text(
+        "import json, sys\n"
+        "if __name__ == '__main__':\n"
+        "    print(json.dumps(sorted(json.load(sys.stdin)['base_suspects'])))\n"
+    )
+    server = start_server(str(script_path))
+    try:
+        response = send_request(server, b'{"base_suspects": ["b", "a"]}')
+        assert json.loads(response) == ["a", "b"]
+    finally:
+        server.stdin.close()
+        server.wait(timeout=10)
+        server.stdout.close()
+
+
+def test_serve_unguarded(tmp_path):
+    """should run scripts which read their input at the top level per request"""
+    script_path = tmp_path / "p1"
+    script_path.write_text(
+        "import json, sys\n"
+        "data = json.loads(sys.stdin.read())\n"
+        "print(json.dumps(sorted(data['base_suspects'])))\n"
+    )
+    server = start_server(str(script_path))
+    try:
+        for suspects in (["b", "a"], ["d", "c"]):
+            request = json.dumps({"base_suspects": suspects}).encode("utf-8")
+            response = send_request(server, request)
+            assert json.loads(response) == sorted(suspects)
+    finally:
+        server.stdin.close()
+        assert server.wait(timeout=10) == 0
+        server.stdout.close()
+
+
+def test_run_game_fork_server():
+    """should play exactly the same games as when running the script itself"""
+    players = dealer.create_players([PLAYER_PATH] * 2, fork_server=True)
+    plugin_players = dealer.create_players(["toac.player:guess"] * 2)
+    try:
+        for game_id in range(1, 4):
+            game = dealer.run_game(game_id, players, seed=531)
+            assert game == dealer.run_game(game_id, plugin_players, seed=531)
+        assert list(dealer.FORK_SERVERS) == [PLAYER_PATH]
+    finally:
+        dealer.close_fork_servers()
+
+
+def test_run_game_fork_server_metrics():
+    """should record the CPU time and peak memory of every forked player"""
+    players = dealer.create_players([PLAYER_PATH] * 2, fork_server=True)
+    metrics = {}
+    try:
+        dealer.run_game(1, players, seed=531, metrics=metrics)
+    finally:
+        dealer.close_fork_servers()
+    for player in players:
+        player_metrics = metrics[player["id"]]
+        assert sorted(player_metrics) == ["cpu", "rss", "wall"]
+        assert player_metrics["cpu"]["count"] == player_metrics["wall"]["count"]
+        assert player_metrics["rss"]["max"] > 1024 * 1024
+
+
+def test_close_fork_servers():
+    """should stop every fork server once it is no longer needed"""
+    server = dealer.get_fork_server(PLAYER_PATH)
+    assert dealer.get_fork_server(PLAYER_PATH) is server
+    dealer.close_fork_servers()
+    assert server.returncode == 0
+    assert not dealer.FORK_SERVERS
+
+
+def test_run_game_fork_server_died():
+    """should replace a fork server which has died, losing no guesses"""
+    players = dealer.create_players([PLAYER_PATH] * 2, fork_server=True)
+    plugin_players = dealer.create_players(["toac.player:guess"] * 2)
+    server = dealer.get_fork_server(PLAYER_PATH)
+    server.kill()
+    server.wait()
+    try:
+        game = dealer.run_game(1, players, seed=531)
+        assert game == dealer.run_game(1, plugin_players, seed=531)
+        assert dealer.FORK_SERVERS[PLAYER_PATH] is not server
+    finally:
+        dealer.close_fork_servers()
+
+
+def test_close_fork_servers_died():
+    """should stop fork servers quietly even if they have died"""
+    server = dealer.get_fork_server(PLAYER_PATH)
+    server.kill()
+    server.wait()
+    server.stdin.write(b"\0")
+    dealer.close_fork_servers()
+    assert not dealer.FORK_SERVERS
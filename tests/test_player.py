@@ -1,11 +1,14 @@
 #!/usr/bin/env python3
 
 import json
-from contextlib import redirect_stdout
+import os
+import pstats
+from contextlib import redirect_stderr, redirect_stdout
 from io import StringIO
 from unittest.mock import Mock, NonCallableMock, patch
 
 import toac.player as player
+import toac.solver as solver
 
 BASE_SUSPECTS = {"pto", "nnn", "jco", "lel", "lsl", "kca", "hbu"}
 MAX_COMPLEXITY = 5
@@ -109,10 +112,120 @@ def test_get_matches():
     assert matches == {frozenset({"lel", "pto", "hbu"})}
 
 
+def test_iter_matches():
+    """should yield the possible matches one at a time in deck order"""
+    with open(os.path.join(os.path.dirname(player.__file__), "example.json")) as f:
+        data = json.load(f)
+    player.transform_data(data)
+    data["cards"] = data["cards"][:2]
+    matches = list(player.iter_matches(**data))
+    assert set(matches) == player.get_matches(**data)
+    assert [sorted(match) for match in matches] == sorted(map(sorted, matches))
+    assert sorted(matches[0]) == player.choose_match(set(matches))
+
+
+def test_choose_match():
+    """should choose the match which comes first in deck order"""
+    matches = {frozenset({"pto", "lsl"}), frozenset({"jco", "lel"})}
+    assert player.choose_match(matches) == ["jco", "lel"]
+    assert player.get_first_match(Mock(return_value=matches), {}) == ["jco", "lel"]
+
+
+def test_get_first_match():
+    """should only take the first match from engines yielding matches lazily"""
+    engine = Mock(return_value=iter([{"pto"}, {"lsl"}]))
+    assert player.get_first_match(engine, {"cards": []}) == ["pto"]
+    engine.assert_called_once_with(cards=[])
+
+
+def test_guess_cached():
+    """should guess the same as guess, solving every game state only once"""
+    with open(os.path.join(os.path.dirname(player.__file__), "example.json")) as f:
+        data = json.load(f)
+    solver.get_shared_cache.cache_clear()
+    assert player.guess_cached(data) == player.guess(data)
+    assert player.guess_cached(data) == player.guess(data)
+    assert solver.get_cache_stats(solver.get_shared_cache())["hits"] == 1
+
+
+def test_update_session_data():
+    """should merge session setup and per-turn deltas into game data"""
+    data = player.build_session_data()
+    player.update_session_data(
+        data,
+        {
+            "base_suspects": list(BASE_SUSPECTS),
+            "match_length": 3,
+            "cards": [{"suspects": ["pto", "lsl", "jco"], "match_count": 1}],
+            "previous_guesses": [],
+        },
+    )
+    player.update_session_data(
+        data,
+        {
+            "cards": [{"suspects": ["nnn", "pto", "hbu"], "match_count": 2}],
+            "previous_guesses": [["lsl", "lel", "nnn"]],
+        },
+    )
+    assert data["base_suspects"] == BASE_SUSPECTS
+    assert data["match_length"] == 3
+    assert data["cards"] == [
+        {"suspects": frozenset({"pto", "lsl", "jco"}), "match_count": 1},
+        {"suspects": frozenset({"nnn", "pto", "hbu"}), "match_count": 2},
+    ]
+    assert data["previous_guesses"] == {frozenset({"lsl", "lel", "nnn"})}
+
+
+@patch("sys.argv", ["./toac/player.py", "--session"])
+def test_main_session():
+    """should answer one guess per line for every line of session input"""
+    with open(os.path.join(os.path.dirname(player.__file__), "example.json")) as f:
+        example = json.load(f)
+    first_message = dict(example, cards=example["cards"][:2], previous_guesses=[])
+    second_message = {
+        "cards": example["cards"][2:],
+        "previous_guesses": example["previous_guesses"],
+    }
+    stdin = StringIO(json.dumps(first_message) + "\n" + json.dumps(second_message))
+    with patch("sys.stdin", stdin), redirect_stdout(StringIO()) as out:
+        player.main()
+    lines = out.getvalue().splitlines()
+    assert len(lines) == 2
+    assert set(json.loads(lines[1])) == {"lel", "pto", "hbu"}
+
+
+@patch("sys.argv", ["./toac/player.py", "--session", "--engine", "incremental"])
+def test_main_incremental_session():
+    """should keep one solver for the whole session when requested"""
+    with open(os.path.join(os.path.dirname(player.__file__), "example.json")) as f:
+        example = json.load(f)
+    first_message = dict(example, cards=example["cards"][:2], previous_guesses=[])
+    second_message = {
+        "cards": example["cards"][2:],
+        "previous_guesses": example["previous_guesses"],
+    }
+    stdin = StringIO(json.dumps(first_message) + "\n" + json.dumps(second_message))
+    with patch("sys.stdin", stdin), redirect_stdout(StringIO()) as out:
+        with patch("toac.solver.Solver", wraps=solver.Solver) as solver_class:
+            player.main()
+    assert solver_class.call_count == 1
+    lines = out.getvalue().splitlines()
+    assert len(lines) == 2
+    # With many possible matches left, the first guess is the first in deck order
+    player.transform_data(first_message)
+    assert json.loads(lines[0]) == player.choose_match(
+        player.get_matches(**first_message)
+    )
+    assert set(json.loads(lines[1])) == {"lel", "pto", "hbu"}
+
+
+@patch("sys.argv", ["./toac/player.py"])
 @patch("sys.stdin", NonCallableMock(read=Mock(return_value='{"cards": []}')))
 @patch("toac.player.transform_data", return_value={"cards": set()})
-@patch("toac.player.get_matches", return_value={frozenset({"hbu", "kca", "pto"})})
-def test_main(get_matches, transform_data):
+@patch(
+    "toac.player.iter_matches", return_value=iter([frozenset({"hbu", "kca", "pto"})])
+)
+def test_main(iter_matches, transform_data):
     """should accept input and produce correct output when run from CLI"""
     with redirect_stdout(StringIO()) as out:
         player.main()
@@ -120,3 +233,67 @@ def test_main(get_matches, transform_data):
         output = out.getvalue()
         match = set(json.loads(output))
         assert match == {"hbu", "kca", "pto"}
+
+
+@patch("sys.argv", ["./toac/player.py", "--engine", "bitmask"])
+@patch("toac.solver.get_matches_bitmask", return_value={frozenset({"hbu", "kca"})})
+def test_main_engine(get_matches_bitmask):
+    """should solve with the engine chosen on the command line"""
+    with open(os.path.join(os.path.dirname(player.__file__), "example.json")) as f:
+        stdin = StringIO(f.read())
+    with patch("sys.stdin", stdin), redirect_stdout(StringIO()) as out:
+        player.main()
+    assert get_matches_bitmask.call_count == 1
+    assert set(json.loads(out.getvalue())) == {"hbu", "kca"}
+
+
+@patch("sys.argv", ["./toac/player.py", "--engine", "lazy"])
+def test_main_lazy():
+    """should guess the first match the lazy engine yields"""
+    with open(os.path.join(os.path.dirname(player.__file__), "example.json")) as f:
+        stdin = StringIO(f.read())
+    with patch("sys.stdin", stdin), redirect_stdout(StringIO()) as out:
+        with patch("toac.player.get_matches") as get_matches:
+            player.main()
+    assert not get_matches.called
+    assert set(json.loads(out.getvalue())) == {"lel", "pto", "hbu"}
+
+
+@patch("sys.argv", ["./toac/player.py", "--count"])
+def test_main_count():
+    """should write the number of possible matches when asked to count"""
+    with open(os.path.join(os.path.dirname(player.__file__), "example.json")) as f:
+        stdin = StringIO(f.read())
+    with patch("sys.stdin", stdin), redirect_stdout(StringIO()) as out:
+        player.main()
+    assert json.loads(out.getvalue()) == 1
+
+
+@patch("sys.argv", ["./toac/player.py"])
+def test_main_profile(tmp_path):
+    """should profile itself when the profile directory is set"""
+    with open(os.path.join(os.path.dirname(player.__file__), "example.json")) as f:
+        stdin = StringIO(f.read())
+    environ = {player.PROFILE_DIR_ENV_VAR: str(tmp_path)}
+    with patch.dict(os.environ, environ), patch("sys.stdin", stdin):
+        with redirect_stdout(StringIO()) as out:
+            player.main()
+    assert set(json.loads(out.getvalue())) == {"lel", "pto", "hbu"}
+    (profile_name,) = os.listdir(str(tmp_path))
+    stats = pstats.Stats(str(tmp_path / profile_name))
+    assert "transform_data" in {function for _, _, function in stats.stats}
+
+
+def test_main_cache_file(tmp_path):
+    """should save the cache to the cache file and report its statistics"""
+    with open(os.path.join(os.path.dirname(player.__file__), "example.json")) as f:
+        example = f.read()
+    cache_path = str(tmp_path / "cache.json")
+    argv = ["./toac/player.py", "--cache-file", cache_path, "--cache-stats"]
+    for num_hits in (0, 1):
+        with patch("sys.argv", argv), patch("sys.stdin", StringIO(example)):
+            with redirect_stdout(StringIO()) as out, redirect_stderr(StringIO()) as err:
+                player.main()
+        assert set(json.loads(out.getvalue())) == {"lel", "pto", "hbu"}
+        assert json.loads(err.getvalue())["hits"] == num_hits
+    assert len(solver.load_cache(cache_path)["entries"]) == 1
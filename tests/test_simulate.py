@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import sys
+from contextlib import redirect_stdout
+from io import StringIO
+from unittest.mock import patch
+
+import pytest
+
+import toac.dealer as dealer
+import toac.simulate as simulate
+
+np = pytest.importorskip("numpy")
+
+
+def test_get_match_matrix():
+    """should count the suspects shared by every pair of cards"""
+    deck = [frozenset({"a", "b"}), frozenset({"a", "c"}), frozenset({"b", "c"})]
+    assert simulate.get_match_matrix(deck).tolist() == [
+        [2, 1, 1],
+        [1, 2, 1],
+        [1, 1, 2],
+    ]
+
+
+def test_create_decks():
+    """should shuffle seeded decks exactly as the dealer would"""
+    decks = simulate.create_decks(range(1, 4), seed=531)
+    for game_id, deck in zip(range(1, 4), decks):
+        assert deck.tolist() == dealer.create_card_deck(
+            dealer.get_game_random(game_id, 531)
+        )
+
+
+def test_create_decks_unseeded():
+    """should shuffle every deck at once without a seed"""
+    decks = simulate.create_decks(range(10))
+    assert decks.shape == (10, len(dealer.BASE_DECK))
+    assert all(sorted(deck) == list(range(len(dealer.BASE_DECK))) for deck in decks)
+
+
+@pytest.mark.parametrize("num_players", [2, 3])
+def test_simulate_batch(num_players):
+    """should produce exactly the same games as the dealer for the same seed"""
+    players = dealer.create_players(["toac.player:guess"] * num_players)
+    game_ids = range(1, 101)
+    assert simulate.simulate_batch(game_ids, num_players, seed=531) == [
+        dealer.run_game(game_id, players, 531) for game_id in game_ids
+    ]
+
+
+def test_simulate_games():
+    """should simulate every game across batches in order"""
+    games = list(simulate.simulate_games(25, 2, seed=531, jobs=2, batch_size=10))
+    assert [game["id"] for game in games] == list(range(1, 26))
+    assert games == simulate.simulate_batch(range(1, 26), 2, seed=531)
+
+
+def test_main():
+    """should print the wins of every player"""
+    argv = ["toac-simulate", "20", "--players", "3", "--jobs", "1"]
+    with patch.object(sys, "argv", argv), redirect_stdout(StringIO()) as out:
+        simulate.main()
+    lines = out.getvalue().splitlines()
+    assert all(line.startswith(("P1 ", "P2 ", "P3 ")) for line in lines)
+    assert sum(int(line.split()[-1]) for line in lines) <= 20
+
+
+@patch("toac.numeric.np", None)
+def test_simulate_games_without_numpy():
+    """should explain how to install NumPy when it is missing"""
+    with pytest.raises(ImportError, match=r"three-of-a-crime\[numpy\]"):
+        list(simulate.simulate_games(1, 2))
@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+
+import itertools
+import json
+import os
+import random
+
+import toac.player as player
+import toac.solver as solver
+
+BASE_SUSPECTS = {"pto", "nnn", "jco", "lel", "lsl", "kca", "hbu"}
+
+
+def test_suspects_mask_round_trip():
+    """should convert sets of suspects to bitmasks and back again"""
+    suspect_bits = solver.get_suspect_bits(BASE_SUSPECTS)
+    assert sorted(suspect_bits.values()) == [1 << s for s in range(7)]
+    suspects = {"pto", "lsl", "jco"}
+    mask = solver.get_suspects_mask(suspects, suspect_bits)
+    assert solver.count_bits(mask) == 3
+    suspects_by_bit = {bit: suspect for suspect, bit in suspect_bits.items()}
+    assert solver.get_mask_suspects(mask, suspects_by_bit) == suspects
+
+
+def test_suspects_mask_unknown_suspects():
+    """should ignore suspects which have not been assigned a bit"""
+    suspect_bits = solver.get_suspect_bits({"pto", "lsl"})
+    assert (
+        solver.get_suspects_mask({"pto", "kca"}, suspect_bits) == (suspect_bits["pto"])
+    )
+
+
+def test_get_matches_bitmask():
+    """should find the same matches as the set-based engine"""
+    data = {
+        "base_suspects": frozenset(BASE_SUSPECTS),
+        "match_length": 3,
+        "cards": [
+            {"suspects": {"pto", "lsl", "jco"}, "match_count": 1},
+            {"suspects": {"nnn", "pto", "hbu"}, "match_count": 2},
+        ],
+        "previous_guesses": {frozenset({"pto", "hbu", "lsl"})},
+    }
+    matches = solver.get_matches_bitmask(**data)
+    assert matches == player.get_matches(**data)
+    assert frozenset({"pto", "hbu", "lsl"}) not in matches
+
+
+def test_get_matches_bitmask_random_states():
+    """should agree with the set-based engine for random game states"""
+    rng = random.Random(531)
+    deck = list(map(frozenset, itertools.combinations(sorted(BASE_SUSPECTS), r=3)))
+    for _ in range(50):
+        rng.shuffle(deck)
+        real_suspects, drawn = deck[0], deck[1 : rng.randint(1, 10)]
+        data = {
+            "base_suspects": frozenset(BASE_SUSPECTS),
+            "match_length": 3,
+            "cards": [
+                {"suspects": card, "match_count": len(card & real_suspects)}
+                for card in drawn
+            ],
+            "previous_guesses": frozenset(deck[10 : rng.randint(10, 13)]),
+        }
+        assert solver.get_matches_bitmask(**data) == player.get_matches(**data)
+
+
+def test_solver_incremental():
+    """should narrow its candidates one card or guess at a time"""
+    game_solver = solver.Solver(BASE_SUSPECTS, 3)
+    assert len(game_solver.candidates) == 35
+    game_solver.add_card({"pto", "lsl", "jco"}, 1)
+    game_solver.add_card({"nnn", "pto", "hbu"}, 2)
+    game_solver.add_card({"kca", "pto", "lel"}, 2)
+    assert frozenset({"lel", "pto", "nnn"}) in game_solver.get_matches()
+    assert len(game_solver.candidates) == 4
+    game_solver.add_guess({"lel", "pto", "nnn"})
+    game_solver.add_guess({"lel", "pto", "xyz"})
+    game_solver.add_card({"kca", "nnn", "lsl"}, 0)
+    assert game_solver.get_matches() == {frozenset({"lel", "pto", "hbu"})}
+
+
+def test_solver_from_data():
+    """should rebuild a solver from a full data payload"""
+    with open(os.path.join(os.path.dirname(player.__file__), "example.json")) as f:
+        data = json.load(f)
+    player.transform_data(data)
+    game_solver = solver.Solver.from_data(data)
+    assert game_solver.get_matches() == player.get_matches(**data)
+
+
+def test_solver_random_states():
+    """should agree with get_matches when fed one card at a time"""
+    rng = random.Random(531)
+    deck = list(map(frozenset, itertools.combinations(sorted(BASE_SUSPECTS), r=3)))
+    for _ in range(20):
+        rng.shuffle(deck)
+        real_suspects = deck[0]
+        game_solver = solver.Solver(BASE_SUSPECTS, 3)
+        cards = []
+        guesses = set()
+        for card in deck[1:12]:
+            cards.append({"suspects": card, "match_count": len(card & real_suspects)})
+            game_solver.add_card(card, len(card & real_suspects))
+            guess = rng.choice(deck)
+            guesses.add(guess)
+            game_solver.add_guess(guess)
+            assert game_solver.get_matches() == player.get_matches(
+                cards, BASE_SUSPECTS, 3, guesses
+            )
+
+
+def test_propagate_constraints():
+    """should force suspects in or out when a constraint leaves no choice"""
+    constraints = [([0, 1, 2], 0), ([2, 3, 4], 2), ([0, 1, 2, 3, 4], 2)]
+    assignment = solver.propagate_constraints(constraints, [None] * 5)
+    assert assignment == [False, False, False, True, True]
+
+
+def test_propagate_constraints_conflict():
+    """should retrieve None when the constraints cannot all be met"""
+    constraints = [([0, 1], 2), ([1, 2], 0)]
+    assert solver.propagate_constraints(constraints, [None] * 3) is None
+
+
+def test_choose_branch_suspect():
+    """should branch on the card with the fewest undecided suspects"""
+    constraints = [([0, 1, 2], 1), ([3, 4], 1), ([5], 0)]
+    assert solver.choose_branch_suspect(constraints, [None] * 5 + [False]) == 3
+    assert solver.choose_branch_suspect(constraints, [False] * 6) is None
+
+
+def test_iter_matches_constraints():
+    """should find the same matches as get_matches"""
+    with open(os.path.join(os.path.dirname(player.__file__), "example.json")) as f:
+        data = json.load(f)
+    player.transform_data(data)
+    matches = solver.iter_matches_constraints(**data)
+    assert set(matches) == player.get_matches(**data)
+
+
+def test_iter_matches_constraints_random_states():
+    """should agree with get_matches for random states of small games"""
+    rng = random.Random(531)
+    for num_suspects, match_length in ((7, 3), (9, 4), (8, 2)):
+        base_suspects = {"s{}".format(s) for s in range(num_suspects)}
+        deck = solver.get_deck(base_suspects, match_length)
+        for _ in range(20):
+            rng.shuffle(deck)
+            real_suspects = deck[0]
+            data = {
+                "base_suspects": frozenset(base_suspects),
+                "match_length": match_length,
+                "cards": [
+                    {"suspects": card, "match_count": len(card & real_suspects)}
+                    for card in deck[1 : rng.randint(1, 12)]
+                ],
+                "previous_guesses": frozenset(deck[-3:]),
+            }
+            matches = set(solver.iter_matches_constraints(**data))
+            assert matches == player.get_matches(**data)
+
+
+def test_iter_matches_constraints_large_game():
+    """should quickly find a consistent match for games with many suspects"""
+    rng = random.Random(531)
+    base_suspects = ["s{:03}".format(s) for s in range(100)]
+    real_suspects = frozenset(rng.sample(base_suspects, 8))
+    cards = []
+    for _ in range(50):
+        suspects = frozenset(rng.sample(base_suspects, 8))
+        cards.append(
+            {"suspects": suspects, "match_count": len(suspects & real_suspects)}
+        )
+    matches = solver.iter_matches_constraints(cards, base_suspects, 8, frozenset())
+    match = next(matches)
+    assert len(match) == 8
+    assert player.combination_matches(match, cards)
+
+
+def test_unrank_combination():
+    """should find the combination with every index in combinations order"""
+    for num_items, length in ((7, 3), (6, 6), (5, 0)):
+        combinations = itertools.combinations(range(num_items), length)
+        for index, combination in enumerate(combinations):
+            unranked = solver.unrank_combination(index, num_items, length)
+            assert tuple(unranked) == combination
+
+
+def test_iter_combinations_from():
+    """should yield every combination from the given one onwards"""
+    items = list("abcdefg")
+    combinations = list(itertools.combinations(items, 3))
+    for index, combination in enumerate(combinations):
+        indices = [items.index(item) for item in combination]
+        rest = solver.iter_combinations_from(items, indices)
+        assert list(itertools.islice(rest, len(combinations))) == combinations[index:]
+
+
+def test_iter_matches():
+    """should lazily yield the same matches as get_matches in deck order"""
+    rng = random.Random(531)
+    suspects = {"s{}".format(s) for s in range(9)}
+    states = [build_game_state(BASE_SUSPECTS, 3, rng) for _ in range(50)]
+    states += [build_game_state(suspects, 4, rng) for _ in range(50)]
+    for state in states:
+        matches = list(solver.iter_matches(**state))
+        assert len(matches) == len(set(matches))
+        assert set(matches) == player.get_matches(**state)
+        assert matches == sorted(matches, key=sorted)
+        assert solver.count_matches(**state) == len(matches)
+
+
+def test_iter_matches_lists():
+    """should accept suspects and guesses given as lists, as parsed from JSON"""
+    with open(os.path.join(os.path.dirname(player.__file__), "example.json")) as f:
+        data = json.load(f)
+    assert [sorted(match) for match in solver.iter_matches(**data)] == [
+        ["hbu", "lel", "pto"]
+    ]
+    assert solver.count_matches(**data) == 1
+
+
+def test_iter_matches_shards():
+    """should yield the same matches when split into shards of candidates"""
+    rng = random.Random(531)
+    for _ in range(20):
+        state = build_game_state(BASE_SUSPECTS, 3, rng)
+        shards = solver.get_candidate_shards(
+            state["cards"], state["base_suspects"], 3, 4
+        )
+        assert shards[0].start == 0
+        assert shards[-1].stop == solver.count_candidates(
+            state["cards"], state["base_suspects"], 3
+        )
+        matches = [
+            match
+            for shard in shards
+            for match in solver.get_shard_matches(state, shard)
+        ]
+        assert matches == list(solver.iter_matches(**state))
+        counts = [solver.count_shard_matches(state, shard) for shard in shards]
+        assert sum(counts) == len(matches)
+
+
+def test_iter_matches_large_game():
+    """should find the first match without checking every candidate"""
+    base_suspects = ["s{:02}".format(s) for s in range(40)]
+    cards = [
+        {"suspects": frozenset(base_suspects[6:14]), "match_count": 0},
+        {"suspects": frozenset({"s00", "s20"}), "match_count": 1},
+    ]
+    match = next(solver.iter_matches(cards, base_suspects, 8, frozenset()))
+    assert sorted(match) == base_suspects[:6] + base_suspects[14:16]
+
+
+def test_iter_matches_parallel():
+    """should check shards of candidates in parallel, in deck order"""
+    rng = random.Random(531)
+    suspects = {"s{}".format(s) for s in range(9)}
+    state = build_game_state(suspects, 4, rng)
+    matches = solver.iter_matches_parallel(**state, jobs=2, shard_size=10)
+    assert list(matches) == list(solver.iter_matches(**state))
+    count = solver.count_matches_parallel(**state, jobs=2, shard_size=10)
+    assert count == solver.count_matches(**state)
+
+
+def test_get_engine():
+    """should retrieve the solver function for every engine name"""
+    assert solver.get_engine("sets") == player.get_matches
+    assert solver.get_engine("bitmask") == solver.get_matches_bitmask
+    assert solver.get_engine("incremental") == solver.get_matches_incremental
+    assert solver.get_engine("constraints") == solver.iter_matches_constraints
+    assert solver.get_engine("lazy") == solver.iter_matches
+    lazy_engine = solver.get_engine("lazy", jobs=2)
+    assert lazy_engine.func == solver.iter_matches_parallel
+    assert lazy_engine.keywords == {"jobs": 2}
+    table_engine = solver.get_engine("table", table_path="missing.bin")
+    assert table_engine.func == solver.get_matches_table
+    assert table_engine.keywords == {"table": None}
+
+
+# Generate a random game state, as transform_data would produce, for the
+# given suspects and match length
+def build_game_state(base_suspects, match_length, rng):
+    deck = solver.get_deck(base_suspects, match_length)
+    rng.shuffle(deck)
+    real_suspects = deck[0]
+    return {
+        "cards": [
+            {"suspects": card, "match_count": len(card & real_suspects)}
+            for card in deck[1 : rng.randint(1, 8)]
+        ],
+        "base_suspects": frozenset(base_suspects),
+        "match_length": match_length,
+        "previous_guesses": frozenset(deck[-rng.randint(0, 2) :][:2]),
+    }
+
+
+# Relabel the suspects of a game state (and shuffle its cards)
+def relabel_game_state(state, relabeling, rng):
+    cards = [
+        {
+            "suspects": frozenset(relabeling[s] for s in card["suspects"]),
+            "match_count": card["match_count"],
+        }
+        for card in state["cards"]
+    ]
+    rng.shuffle(cards)
+    return {
+        "cards": cards,
+        "base_suspects": frozenset(relabeling[s] for s in state["base_suspects"]),
+        "match_length": state["match_length"],
+        "previous_guesses": frozenset(
+            frozenset(relabeling[s] for s in guess)
+            for guess in state["previous_guesses"]
+        ),
+    }
+
+
+def test_get_first_match_engines():
+    """should guess the same match whichever engine finds the matches"""
+    rng = random.Random(531)
+    suspects = {"s{}".format(s) for s in range(9)}
+    states = [build_game_state(BASE_SUSPECTS, 3, rng) for _ in range(100)]
+    states += [build_game_state(suspects, 4, rng) for _ in range(100)]
+    engine_names = ("bitmask", "incremental", "table", "constraints", "lazy")
+    engines = [
+        solver.get_engine(name, table_path="missing.bin") for name in engine_names
+    ]
+    for state in filter(lambda state: player.get_matches(**state), states):
+        match = player.get_first_match(player.get_matches, state)
+        for engine in engines:
+            assert sorted(player.get_first_match(engine, state)) == match
+
+
+def test_iter_matches_constraints_order():
+    """should yield matches in deck order"""
+    rng = random.Random(531)
+    for _ in range(50):
+        state = build_game_state(BASE_SUSPECTS, 3, rng)
+        matches = list(solver.iter_matches_constraints(**state))
+        assert matches == list(solver.iter_matches(**state))
+
+
+def test_get_canonical_state():
+    """should give the same key to game states equal up to a relabeling"""
+    rng = random.Random(531)
+    suspects = sorted(BASE_SUSPECTS)
+    for _ in range(50):
+        state = build_game_state(BASE_SUSPECTS, 3, rng)
+        relabeling = dict(zip(suspects, rng.sample(suspects, len(suspects))))
+        relabeled_state = relabel_game_state(state, relabeling, rng)
+        key, _ = solver.get_canonical_state(**state)
+        assert solver.get_canonical_state(**relabeled_state)[0] == key
+
+
+def test_get_canonical_state_different():
+    """should give different keys to game states which are not equal"""
+    cards = [{"suspects": {"pto", "nnn", "jco"}, "match_count": 1}]
+    key, _ = solver.get_canonical_state(cards, BASE_SUSPECTS, 3, frozenset())
+    cards = [{"suspects": {"pto", "nnn", "jco"}, "match_count": 2}]
+    assert solver.get_canonical_state(cards, BASE_SUSPECTS, 3, frozenset())[0] != key
+
+
+def test_get_cached_matches():
+    """should find the same matches as get_matches, whether cached or not"""
+    rng = random.Random(531)
+    suspects = {"s{}".format(s) for s in range(9)}
+    states = [build_game_state(BASE_SUSPECTS, 3, rng) for _ in range(50)]
+    states += [build_game_state(suspects, 4, rng) for _ in range(50)]
+    cache = solver.create_cache()
+    for _ in range(2):
+        for state in states:
+            matches = solver.get_cached_matches(**state, cache=cache)
+            assert matches == player.get_matches(**state)
+    stats = solver.get_cache_stats(cache)
+    assert stats["misses"] == stats["entries"] <= len(states)
+    assert stats["hits"] >= len(states)
+
+
+def test_get_cached_matches_relabeled():
+    """should reuse the matches of a game state for its relabelings"""
+    rng = random.Random(531)
+    state = build_game_state(BASE_SUSPECTS, 3, rng)
+    suspects = sorted(BASE_SUSPECTS)
+    relabeling = dict(zip(suspects, reversed(suspects)))
+    relabeled_state = relabel_game_state(state, relabeling, rng)
+    cache = solver.create_cache()
+    solver.get_cached_matches(**state, cache=cache)
+    matches = solver.get_cached_matches(**relabeled_state, cache=cache)
+    assert matches == player.get_matches(**relabeled_state)
+    assert solver.get_cache_stats(cache)["hits"] == 1
+
+
+def test_add_to_cache_evict():
+    """should evict the least recently used entries once the cache is full"""
+    rng = random.Random(531)
+    cache = solver.create_cache(max_bytes=4000)
+    for _ in range(50):
+        solver.get_cached_matches(
+            **build_game_state(BASE_SUSPECTS, 3, rng), cache=cache
+        )
+    stats = solver.get_cache_stats(cache)
+    assert stats["evictions"] > 0
+    assert 0 < stats["bytes"] <= 4000
+    assert stats["entries"] + stats["evictions"] == stats["misses"]
+
+
+def test_save_cache(tmp_path):
+    """should load a saved cache with the same entries in the same order"""
+    rng = random.Random(531)
+    cache = solver.create_cache()
+    for _ in range(20):
+        solver.get_cached_matches(
+            **build_game_state(BASE_SUSPECTS, 3, rng), cache=cache
+        )
+    cache_path = str(tmp_path / "cache.json")
+    solver.save_cache(cache, cache_path)
+    loaded_cache = solver.load_cache(cache_path)
+    assert loaded_cache["entries"] == cache["entries"]
+    assert list(loaded_cache["entries"]) == list(cache["entries"])
+    assert loaded_cache["num_bytes"] == cache["num_bytes"]
+
+
+def test_load_cache_missing(tmp_path):
+    """should start with an empty cache if none was saved in this version"""
+    cache_path = tmp_path / "cache.json"
+    assert not solver.load_cache(str(cache_path))["entries"]
+    cache_path.write_text(json.dumps({"version": 0, "entries": [[[7, 3, []], []]]}))
+    assert not solver.load_cache(str(cache_path))["entries"]
+
+
+def test_get_engine_cache():
+    """should wrap any engine with a cache when given one"""
+    cache = solver.create_cache()
+    engine = solver.get_engine("constraints", cache=cache)
+    assert engine.func == solver.get_cached_matches
+    assert engine.keywords == {
+        "cache": cache,
+        "engine": solver.iter_matches_constraints,
+    }
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+import itertools
+import os
+import random
+import sys
+from contextlib import redirect_stdout
+from io import StringIO
+from unittest.mock import patch
+
+import pytest
+
+import toac.player as player
+import toac.solver as solver
+import toac.table as table
+
+BASE_SUSPECTS = {"pto", "nnn", "jco", "lel", "lsl", "kca", "hbu"}
+
+
+@pytest.fixture(scope="module")
+def default_table(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("table") / "table.bin")
+    table.write_table(table.build_table(BASE_SUSPECTS, 3), path)
+    return solver.load_table(path)
+
+
+def test_get_level_masks():
+    """should group the deck by number of suspects shared with each card"""
+    deck = solver.get_deck({"a", "b", "c"}, 2)
+    level_masks = table.get_level_masks(deck, 2)
+    assert deck == [frozenset("ab"), frozenset("ac"), frozenset("bc")]
+    assert level_masks[0] == [0b000, 0b110, 0b001]
+
+
+def test_build_table():
+    """should number every reachable state, starting with the full deck"""
+    built_table = table.build_table({"a", "b", "c", "d"}, 2)
+    assert built_table["num_cards"] == 6
+    assert built_table["masks"][0] == 0b111111
+    assert len(built_table["transitions"]) == len(built_table["masks"]) * 6 * 3
+    assert solver.NO_TABLE_STATE in built_table["transitions"]
+
+
+def test_build_table_too_many_cards():
+    """should refuse to build tables for decks which do not fit in a mask"""
+    with pytest.raises(ValueError):
+        table.build_table({str(s) for s in range(10)}, 3)
+
+
+def test_load_table(default_table):
+    """should memory-map a written table and describe its game"""
+    assert default_table["base_suspects"] == BASE_SUSPECTS
+    assert default_table["match_length"] == 3
+    assert len(default_table["deck"]) == 35
+    assert default_table["masks"][0] == (1 << 35) - 1
+
+
+def test_load_table_missing(tmp_path):
+    """should not load tables which are missing or of another version"""
+    assert solver.load_table(str(tmp_path / "missing.bin")) is None
+    path = tmp_path / "old.bin"
+    path.write_bytes(solver.TABLE_HEADER.pack(solver.TABLE_MAGIC, 0, 3, 35, 1, 0))
+    assert solver.load_table(str(path)) is None
+
+
+def test_get_matches_table(default_table):
+    """should look up the same matches as get_matches for random games"""
+    rng = random.Random(531)
+    deck = list(map(frozenset, itertools.combinations(sorted(BASE_SUSPECTS), r=3)))
+    for _ in range(50):
+        rng.shuffle(deck)
+        real_suspects = deck[0]
+        data = {
+            "base_suspects": frozenset(BASE_SUSPECTS),
+            "match_length": 3,
+            "cards": [
+                {"suspects": card, "match_count": len(card & real_suspects)}
+                for card in deck[1 : rng.randint(1, 34)]
+            ],
+            "previous_guesses": frozenset(deck[5:8]),
+        }
+        matches = solver.get_matches_table(table=default_table, **data)
+        assert matches == player.get_matches(**data)
+
+
+@patch("toac.player.get_matches", return_value=set())
+def test_get_matches_table_fallback(get_matches, default_table):
+    """should solve live for games or states the table does not cover"""
+    cards = [{"suspects": frozenset({"pto", "lsl", "jco"}), "match_count": 4}]
+    solver.get_matches_table(cards, BASE_SUSPECTS, 3, frozenset(), None)
+    solver.get_matches_table(cards, BASE_SUSPECTS, 3, frozenset(), default_table)
+    solver.get_matches_table([], {"pto", "nnn"}, 1, frozenset(), default_table)
+    assert get_matches.call_count == 3
+
+
+def test_main(tmp_path):
+    """should build the table for the dealer's game constants"""
+    path = str(tmp_path / "table.bin")
+    with patch.object(sys, "argv", ["./toac/table.py", path]):
+        with redirect_stdout(StringIO()) as out:
+            table.main()
+    assert os.path.exists(path)
+    assert "35 cards" in out.getvalue()
+    assert solver.load_table(path)["base_suspects"] == BASE_SUSPECTS
+
+
+def test_main_default_path(tmp_path):
+    """should build the table in the user's cache directory by default"""
+    with patch.dict(os.environ, {"XDG_CACHE_HOME": str(tmp_path)}):
+        with patch.object(sys, "argv", ["./toac/table.py"]):
+            with redirect_stdout(StringIO()):
+                table.main()
+        path = solver.get_default_table_path()
+    assert path == str(tmp_path / "toac" / "table.bin")
+    assert solver.load_table(path)["base_suspects"] == BASE_SUSPECTS
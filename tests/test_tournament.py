@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+import json
+import sys
+from contextlib import redirect_stdout
+from io import StringIO
+from unittest.mock import patch
+
+import pytest
+
+import toac.dealer as dealer
+import toac.tournament as tournament
+
+PROGRAMS = ["toac.player:guess", "toac.benchmark:stub_player", "toac"]
+
+
+def create_tournament(programs=PROGRAMS, players=2, games=10, chunk_size=4):
+    return tournament.create_tournament(programs, players, games, chunk_size, 531)
+
+
+def test_get_seatings():
+    """should seat every group of programs in every rotation"""
+    assert list(tournament.get_seatings(3, 2)) == [
+        (0, 1),
+        (1, 0),
+        (0, 2),
+        (2, 0),
+        (1, 2),
+        (2, 1),
+    ]
+    assert list(tournament.get_seatings(3, 3)) == [(0, 1, 2), (1, 2, 0), (2, 0, 1)]
+
+
+def test_get_tournament_tasks():
+    """should split the games of every seating into chunks"""
+    tasks = list(tournament.get_tournament_tasks(create_tournament()))
+    assert len(tasks) == 6 * 3
+    assert tasks[:3] == [((0, 1), 1, 5), ((0, 1), 5, 9), ((0, 1), 9, 11)]
+
+
+def test_play_task():
+    """should tally the wins of every seat for a range of games"""
+    result = tournament.play_task(((1, 0), 1, 11), create_tournament())
+    assert result["seating"] == [1, 0]
+    # The stand-in player never guesses correctly
+    assert result["wins"] == [0, 10]
+    players = dealer.create_players([PROGRAMS[1], PROGRAMS[0]])
+    games = dealer.run_game_chunk(range(1, 11), players, 531)
+    assert result["rounds"] == sum(game["rounds"] for game in games)
+
+
+def test_get_standings():
+    """should tally wins for every program and every seat"""
+    results = [
+        {"seating": [0, 1], "start": 1, "stop": 3, "wins": [2, 0]},
+        {"seating": [1, 0], "start": 1, "stop": 3, "wins": [1, 1]},
+    ]
+    standings = tournament.get_standings(create_tournament(PROGRAMS[:2]), results)
+    assert standings["standings"] == [
+        {"program": PROGRAMS[0], "games": 4, "wins": 3},
+        {"program": PROGRAMS[1], "games": 4, "wins": 1},
+    ]
+    assert standings["seats"] == [
+        {"seat": "P1", "games": 4, "wins": 3},
+        {"seat": "P2", "games": 4, "wins": 1},
+    ]
+
+
+# A stand-in for Pool.imap_unordered which plays every task in the current
+# process
+def play_immediately(pool, func, tasks):
+    return map(func, tasks)
+
+
+def test_run_tournament_resume(tmp_path):
+    """should only play the tasks missing from the checkpoint when resuming"""
+    checkpoint_path = str(tmp_path / "checkpoint.jsonl")
+    settings = create_tournament()
+    results = tournament.run_tournament(settings, checkpoint_path, jobs=2)
+    assert len(results) == 18
+
+    # Forget some finished tasks (cutting the last line short, as if the run
+    # had been interrupted while writing it)
+    with open(checkpoint_path) as checkpoint_file:
+        lines = checkpoint_file.readlines()
+    with open(checkpoint_path, "w") as checkpoint_file:
+        checkpoint_file.writelines(lines[:10])
+        checkpoint_file.write(lines[10][:5])
+    with patch("multiprocessing.pool.Pool.imap_unordered", new=play_immediately):
+        with patch("toac.tournament.play_task", wraps=tournament.play_task) as play:
+            resumed_results = tournament.run_tournament(settings, checkpoint_path)
+    assert play.call_count == 18 - 9
+    assert tournament.get_standings(settings, resumed_results) == (
+        tournament.get_standings(settings, results)
+    )
+
+    # Resuming again finds every task recorded, on a line of its own
+    with open(checkpoint_path) as checkpoint_file:
+        assert len([json.loads(line) for line in checkpoint_file]) == 19
+    with patch("multiprocessing.pool.Pool.imap_unordered", new=play_immediately):
+        with patch("toac.tournament.play_task", wraps=tournament.play_task) as play:
+            resumed_results = tournament.run_tournament(settings, checkpoint_path)
+    assert play.call_count == 0
+    assert len(resumed_results) == 18
+
+
+def test_run_tournament_different_checkpoint(tmp_path):
+    """should refuse to resume a different tournament"""
+    checkpoint_path = str(tmp_path / "checkpoint.jsonl")
+    tournament.run_tournament(create_tournament(games=2), checkpoint_path, jobs=1)
+    with pytest.raises(ValueError):
+        tournament.run_tournament(create_tournament(games=3), checkpoint_path, jobs=1)
+
+
+def test_main_different_checkpoint(tmp_path):
+    """should exit with a message when resuming a different tournament"""
+    checkpoint_path = str(tmp_path / "checkpoint.jsonl")
+    tournament.run_tournament(create_tournament(games=2), checkpoint_path, jobs=1)
+    argv = ["toac", "tournament", *PROGRAMS, "-n", "3", "--chunk-size", "4"]
+    argv += ["--seed", "531"]
+    argv += ["--checkpoint", checkpoint_path]
+    with patch.object(sys, "argv", argv):
+        with pytest.raises(SystemExit, match="belongs to a different tournament"):
+            dealer.main()
+
+
+def test_main(tmp_path):
+    """should print the standings via toac tournament, reusing the seed"""
+    checkpoint_path = str(tmp_path / "checkpoint.jsonl")
+    argv = ["toac", "tournament", *PROGRAMS[:2], "-n", "4", "-j", "1"]
+    argv += ["--checkpoint", checkpoint_path, "--format", "jsonl"]
+    with patch.object(sys, "argv", argv), redirect_stdout(StringIO()) as out:
+        dealer.main()
+    standings = json.loads(out.getvalue())
+    assert standings["standings"][0] == {
+        "program": PROGRAMS[0],
+        "games": 8,
+        "wins": 8,
+    }
+    with patch.object(sys, "argv", argv), redirect_stdout(StringIO()) as out:
+        dealer.main()
+    assert json.loads(out.getvalue()) == standings
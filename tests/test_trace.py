@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+from contextlib import redirect_stdout
+from io import StringIO
+from unittest.mock import patch
+
+import pytest
+
+import toac.dealer as dealer
+import toac.trace as trace
+
+
+# Play games between bundled players, recording their traces to a file
+def write_traces(trace_path, num_games, concurrency=None):
+    players = dealer.create_players(["toac.player:guess"] * 3)
+    with redirect_stdout(StringIO()):
+        dealer.run_games(
+            num_games,
+            players,
+            jobs=2,
+            seed=531,
+            concurrency=concurrency,
+            trace_path=trace_path,
+        )
+    return [
+        dealer.run_game(game_id, players, 531) for game_id in range(1, num_games + 1)
+    ]
+
+
+def test_iter_traces(tmp_path):
+    """should read back the trace of every game as it was played"""
+    trace_path = str(tmp_path / "games.trace")
+    games = write_traces(trace_path, 20)
+    traces = sorted(trace.iter_traces(trace_path), key=lambda t: t["id"])
+    assert len(traces) == 20
+    for game, game_trace in zip(games, traces):
+        assert game_trace["id"] == game["id"]
+        assert game_trace["rounds"] == game["rounds"]
+        assert "P{}".format(game_trace["winner"] + 1) == game["winner"]
+        assert not game_trace["error"]
+        deck = dealer.create_card_deck(dealer.get_game_random(game["id"], 531))
+        drawn_cards = deck[::-1]
+        assert game_trace["eyewitness"] == drawn_cards[0]
+        assert game_trace["cards"] == drawn_cards[1 : game["rounds"] + 1]
+        eyewitness = dealer.BASE_DECK[game_trace["eyewitness"]]
+        assert game_trace["match_counts"] == [
+            len(dealer.BASE_DECK[c] & eyewitness) for c in game_trace["cards"]
+        ]
+
+
+def test_load_traces(tmp_path):
+    """should memory-map traces as arrays matching the traces read one by one"""
+    np = pytest.importorskip("numpy")
+    trace_path = str(tmp_path / "games.trace")
+    write_traces(trace_path, 20, concurrency=4)
+    deck, traces = trace.load_traces(trace_path)
+    assert deck == dealer.BASE_DECK
+    assert isinstance(traces, np.memmap)
+    assert sorted(traces["id"].tolist()) == list(range(1, 21))
+    for array_trace, game_trace in zip(traces, trace.iter_traces(trace_path)):
+        rounds = game_trace["rounds"]
+        assert array_trace["id"] == game_trace["id"]
+        assert array_trace["guesses"][:rounds].tolist() == game_trace["guesses"]
+        assert (array_trace["cards"][rounds:] == dealer.NO_TRACE_CARD).all()
+
+
+def test_read_trace_header_invalid():
+    """should refuse to read files which are not game traces"""
+    with pytest.raises(ValueError):
+        trace.read_trace_header(b"\0" * 64)
+
+
+@patch("toac.numeric.np", None)
+def test_load_traces_without_numpy():
+    """should explain how to install NumPy when it is missing"""
+    with pytest.raises(ImportError, match=r"three-of-a-crime\[numpy\]"):
+        trace.load_traces("games.trace")
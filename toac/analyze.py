@@ -0,0 +1,209 @@
+import argparse
+import collections
+import functools
+import itertools
+import json
+import multiprocessing
+import os
+
+import toac.dealer as dealer
+
+ANALYSIS_FORMATS = ("text", "json")
+
+
+# Parse command-line arguments passed to analysis program (as "toac analyze")
+def parse_cli_args(args=None):
+    parser = argparse.ArgumentParser(
+        prog="toac analyze",
+        description="Compute exact statistics for games in which every player "
+        "uses the same guessing strategy, without sampling any games.",
+    )
+
+    parser.add_argument(
+        "--strategy",
+        choices=STRATEGIES,
+        default="first",
+        help="first: guess the first possible match in deck order (as "
+        "toac.player:guess does); random: guess any possible match at random",
+    )
+    parser.add_argument(
+        "-p",
+        "--players",
+        type=int,
+        default=dealer.DEFAULT_NUM_PLAYERS,
+        help="the number of players in every game",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="the number of eyewitness cards to analyze at once "
+        "(default: the number of CPUs)",
+    )
+    parser.add_argument(
+        "--format",
+        choices=ANALYSIS_FORMATS,
+        default="text",
+        help="how to output the statistics",
+    )
+
+    return parser.parse_args(args)
+
+
+# Retrieves the indices of the cards in the given mask of cards
+def get_mask_cards(mask):
+    cards = []
+    while mask:
+        low_bit = mask & -mask
+        cards.append(low_bit.bit_length() - 1)
+        mask ^= low_bit
+    return cards
+
+
+# Guess the first possible match in deck order, as toac.player:guess does;
+# strategies retrieve every card they may guess along with its probability
+def guess_first(candidates):
+    return [(1.0, get_mask_cards(candidates & -candidates)[0])]
+
+
+# Guess any of the possible matches, each with the same probability
+def guess_random(candidates):
+    cards = get_mask_cards(candidates)
+    return [(1.0 / len(cards), card) for card in cards]
+
+
+STRATEGIES = {"first": guess_first, "random": guess_random}
+# Strategies which treat every suspect alike; since any card of a full deck
+# becomes any other card by renaming suspects, every eyewitness card then
+# gives the same results, and only one needs to be analyzed
+SYMMETRIC_STRATEGIES = {"random"}
+
+
+# Retrieves (as masks over the deck) the cards which would still be possible
+# matches after drawing each card of the deck, for the given eyewitness card
+def get_consistent_masks(deck, eyewitness):
+    consistent_masks = []
+    for card in deck:
+        match_count = dealer.get_match_count(card, deck[eyewitness])
+        consistent_masks.append(
+            sum(
+                1 << c
+                for c, other_card in enumerate(deck)
+                if dealer.get_match_count(card, other_card) == match_count
+            )
+        )
+    return consistent_masks
+
+
+# Compute the probability that the game is won on each turn (from the first),
+# for one eyewitness card, along with how many distinct states were analyzed.
+# Rather than enumerating draw orders, the search memoizes on the information
+# state: the mask of possible matches (with wrong guesses removed) and the
+# number of cards left to draw. That state is enough, because every drawn
+# card is consistent with every possible match, so the cards left in the deck
+# which can still rule out a possible match are exactly the informative cards
+# of the whole deck (other than the eyewitness card); every other card left
+# to draw leaves the possible matches unchanged, so draws of those are merged
+# into one outcome
+def get_win_probabilities(deck, eyewitness, strategy_name):
+    strategy = STRATEGIES[strategy_name]
+    consistent_masks = get_consistent_masks(deck, eyewitness)
+    other_masks = [mask for c, mask in enumerate(consistent_masks) if c != eyewitness]
+    memo = {}
+
+    def get_state_probabilities(candidates, num_remaining):
+        state = (candidates, num_remaining)
+        if state in memo:
+            return memo[state]
+
+        # Group the cards which could be drawn by the possible matches left
+        # after drawing them
+        outcomes = collections.Counter(
+            candidates & mask for mask in other_masks if candidates & ~mask
+        )
+        outcomes[candidates] += num_remaining - sum(outcomes.values())
+
+        probabilities = [0.0] * num_remaining
+        for next_candidates, num_cards in outcomes.items():
+            if not num_cards:
+                continue
+            draw_probability = num_cards / num_remaining
+            for guess_probability, guess in strategy(next_candidates):
+                probability = draw_probability * guess_probability
+                if guess == eyewitness:
+                    probabilities[0] += probability
+                elif num_remaining > 1:
+                    later_probabilities = get_state_probabilities(
+                        next_candidates & ~(1 << guess), num_remaining - 1
+                    )
+                    for turn, later_probability in enumerate(later_probabilities):
+                        probabilities[turn + 1] += probability * later_probability
+
+        memo[state] = probabilities
+        return probabilities
+
+    probabilities = get_state_probabilities((1 << len(deck)) - 1, len(deck) - 1)
+    return probabilities, len(memo)
+
+
+# Compute the probability that the game is won on each turn, averaged over
+# every (equally likely) eyewitness card, along with the total number of
+# distinct states analyzed
+def analyze_game(deck, strategy_name, jobs=None):
+    get_probabilities = functools.partial(get_win_probabilities, deck)
+    if strategy_name in SYMMETRIC_STRATEGIES:
+        eyewitnesses = [0]
+    else:
+        eyewitnesses = range(len(deck))
+    args = [(eyewitness, strategy_name) for eyewitness in eyewitnesses]
+    if jobs == 1:
+        results = list(itertools.starmap(get_probabilities, args))
+    else:
+        with multiprocessing.Pool(processes=jobs or os.cpu_count() or 1) as pool:
+            results = pool.starmap(get_probabilities, args)
+    win_probabilities = [
+        sum(turn_probabilities) / len(results)
+        for turn_probabilities in zip(*(probabilities for probabilities, _ in results))
+    ]
+    return win_probabilities, sum(num_states for _, num_states in results)
+
+
+# Summarize the probabilities of winning on each turn as the statistics the
+# dealer would report (in the limit) for the given number of players
+def get_game_stats(win_probabilities, num_players):
+    seat_wins = [
+        sum(win_probabilities[seat::num_players]) for seat in range(num_players)
+    ]
+    no_winner = max(0.0, 1.0 - sum(win_probabilities))
+    # As in dealer.run_game, a game without a winner lasts for every turn
+    expected_rounds = sum(
+        (turn + 1) * probability for turn, probability in enumerate(win_probabilities)
+    )
+    expected_rounds += len(win_probabilities) * no_winner
+    return {
+        "expected_rounds": expected_rounds,
+        "wins": {"P{}".format(seat + 1): wins for seat, wins in enumerate(seat_wins)},
+        "no_winner": no_winner,
+    }
+
+
+# Print the statistics of an analysis in the given format
+def print_game_stats(stats, output_format="text"):
+    if output_format == "json":
+        print(json.dumps(stats, indent=2))
+        return
+    print("Expected rounds: {:.6f}".format(stats["expected_rounds"]))
+    for player_id, wins in stats["wins"].items():
+        print("{} Win probability: {:.6f}".format(player_id, wins))
+    print("No winner probability: {:.6f}".format(stats["no_winner"]))
+    print("States analyzed: {}".format(stats["num_states"]))
+
+
+def main(args=None):
+    cli_args = parse_cli_args(args)
+    win_probabilities, num_states = analyze_game(
+        dealer.BASE_DECK, cli_args.strategy, jobs=cli_args.jobs
+    )
+    stats = get_game_stats(win_probabilities, cli_args.players)
+    stats["num_states"] = num_states
+    print_game_stats(stats, cli_args.format)
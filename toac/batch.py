@@ -0,0 +1,93 @@
+import toac.numeric as numeric
+import toac.solver as solver
+from toac.numeric import np
+
+
+# Encodes every combination of suspects (numbered as in solver.get_deck) as a
+# row of a 0/1 matrix with one column per (sorted) suspect
+def get_combination_matrix(deck, suspect_indices):
+    matrix = np.zeros((len(deck), len(suspect_indices)), dtype=np.float32)
+    for c, combination in enumerate(deck):
+        matrix[c, [suspect_indices[suspect] for suspect in combination]] = 1
+    return matrix
+
+
+# Solves a batch of payloads which all share the same suspects and match
+# length: every card of every payload becomes a row of one 0/1 matrix, so a
+# single matrix multiply counts the matches between every card and every
+# combination; retrieves one boolean candidate mask (over the deck) per payload
+def solve_payloads(payloads, deck, combination_matrix, suspect_indices):
+    num_cards = sum(len(payload["cards"]) for payload in payloads)
+    card_matrix = np.zeros((num_cards, len(suspect_indices)), dtype=np.float32)
+    match_counts = np.zeros((num_cards, 1), dtype=np.float32)
+    card_offsets = []
+    card_index = 0
+    for payload in payloads:
+        card_offsets.append(card_index)
+        for card in payload["cards"]:
+            suspects = [
+                suspect_indices[s] for s in card["suspects"] if s in suspect_indices
+            ]
+            card_matrix[card_index, suspects] = 1
+            match_counts[card_index] = card["match_count"]
+            card_index += 1
+
+    card_agreements = card_matrix @ combination_matrix.T == match_counts
+    masks = np.ones((len(payloads), len(deck)), dtype=bool)
+    # reduceat cannot reduce empty segments, so payloads without cards (which
+    # agree with every combination) are skipped
+    with_cards = [p for p, payload in enumerate(payloads) if payload["cards"]]
+    if with_cards:
+        offsets = [card_offsets[p] for p in with_cards]
+        masks[with_cards] = np.logical_and.reduceat(card_agreements, offsets, axis=0)
+
+    card_indices = {combination: c for c, combination in enumerate(deck)}
+    for mask, payload in zip(masks, payloads):
+        for guess in payload["previous_guesses"]:
+            guess_index = card_indices.get(frozenset(guess))
+            if guess_index is not None:
+                mask[guess_index] = False
+    return masks
+
+
+# Retrieves one boolean candidate mask per payload (over the combinations in
+# solver.get_deck order for the payload's suspects and match length), solving
+# payloads in batches of up to batch_size at a time
+def get_candidate_masks(payloads, batch_size=numeric.DEFAULT_BATCH_SIZE):
+    numeric.require_numpy("batch solving")
+    payloads = list(payloads)
+    masks = [None] * len(payloads)
+
+    # Payloads of the same game variant share their combination matrix
+    variants = {}
+    for p, payload in enumerate(payloads):
+        variant = (frozenset(payload["base_suspects"]), payload["match_length"])
+        variants.setdefault(variant, []).append(p)
+
+    for (base_suspects, match_length), payload_indices in variants.items():
+        deck = solver.get_deck(base_suspects, match_length)
+        suspect_indices = {s: i for i, s in enumerate(sorted(base_suspects))}
+        combination_matrix = get_combination_matrix(deck, suspect_indices)
+        for start in range(0, len(payload_indices), batch_size):
+            batch_indices = payload_indices[start : start + batch_size]
+            batch_masks = solve_payloads(
+                [payloads[p] for p in batch_indices],
+                deck,
+                combination_matrix,
+                suspect_indices,
+            )
+            for p, mask in zip(batch_indices, batch_masks):
+                masks[p] = mask
+
+    return masks
+
+
+# Retrieves the set of all possible matches for every payload, exactly as
+# player.get_matches would for each payload on its own
+def get_matches_batch(payloads, batch_size=numeric.DEFAULT_BATCH_SIZE):
+    payloads = list(payloads)
+    matches = []
+    for payload, mask in zip(payloads, get_candidate_masks(payloads, batch_size)):
+        deck = solver.get_deck(payload["base_suspects"], payload["match_length"])
+        matches.append({deck[c] for c in np.flatnonzero(mask)})
+    return matches
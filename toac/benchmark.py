@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import random
+import sys
+import time
+
+import toac.dealer as dealer
+import toac.solver as solver
+
+BENCHMARK_VERSION = 1
+BENCHMARK_GROUPS = ("solver", "dealer", "games")
+SUSPECT_COUNTS = (7, 9, 11)
+GAME_PHASES = {"early": 1, "middle": 4, "late": 8}
+ENGINES = ("sets", "bitmask", "incremental", "constraints", "lazy")
+JOB_COUNTS = (1, 2, 4)
+NUM_GAME_STATES = 20
+NUM_DEALER_GAMES = 20
+NUM_GAMES_PER_JOB = 200
+DEFAULT_SEED = 531
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 0.2
+
+
+# Parse command-line arguments passed to benchmark program
+def parse_cli_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--only",
+        choices=BENCHMARK_GROUPS,
+        action="append",
+        help="only run this group of benchmarks (may be given more than once)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=DEFAULT_SEED,
+        help="the seed used to generate game states and decks",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=DEFAULT_REPEAT,
+        help="how many times to time each benchmark, keeping the fastest",
+    )
+    parser.add_argument(
+        "--output", help="write the results as JSON to this file instead of stdout"
+    )
+    parser.add_argument(
+        "--baseline", help="compare the results against those in this JSON file"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="how much slower than the baseline (as a fraction) a benchmark "
+        "may get before it is flagged as a regression",
+    )
+
+    return parser.parse_args()
+
+
+# Time how long a single call of the given function takes, keeping the
+# fastest of several runs to filter out noise from the rest of the system
+def time_function(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start_time)
+    return min(timings)
+
+
+# Create a result for one benchmark, measured in seconds per operation
+def create_result(name, seconds, unit):
+    return {"name": name, "seconds": seconds, "unit": unit}
+
+
+# Generate game states (as passed to get_matches) for a game with the given
+# number of suspects, after the given number of cards have been drawn
+def build_game_states(num_suspects, num_cards, num_states, rng):
+    base_suspects = frozenset("s{:02}".format(s) for s in range(num_suspects))
+    deck = solver.get_deck(base_suspects, dealer.MATCH_LENGTH)
+    states = []
+    for _ in range(num_states):
+        rng.shuffle(deck)
+        real_suspects = deck[0]
+        cards = [
+            {"suspects": card, "match_count": len(card & real_suspects)}
+            for card in deck[1 : num_cards + 1]
+        ]
+        states.append(
+            {
+                "base_suspects": base_suspects,
+                "match_length": dealer.MATCH_LENGTH,
+                "cards": cards,
+                "previous_guesses": frozenset(deck[-2:]),
+            }
+        )
+    return states
+
+
+# Time every solver engine across game phases and suspect-set sizes
+def benchmark_solver(rng, repeat):
+    results = []
+    for num_suspects in SUSPECT_COUNTS:
+        for phase, num_cards in GAME_PHASES.items():
+            states = build_game_states(num_suspects, num_cards, NUM_GAME_STATES, rng)
+            for engine_name in ENGINES:
+                engine = solver.get_engine(engine_name)
+
+                # Engines may find matches lazily, so every match is consumed
+                def solve_states():
+                    for state in states:
+                        set(engine(**state))
+
+                seconds = time_function(solve_states, repeat) / len(states)
+                name = "get_matches[engine={},suspects={},phase={}]".format(
+                    engine_name, num_suspects, phase
+                )
+                results.append(create_result(name, seconds, "call"))
+    return results
+
+
+# A stand-in player which always guesses wrong, so that timing whole games
+# with it measures the dealer's own overhead for every turn of the game
+def stub_player(data):
+    return ()
+
+
+# Time the dealer's overhead for every turn of a game, using stand-in players
+def benchmark_dealer(seed, repeat):
+    players = dealer.create_players(["toac.benchmark:stub_player"] * 2)
+    num_turns = 0
+
+    def run_games():
+        nonlocal num_turns
+        num_turns = 0
+        for game_id in range(1, NUM_DEALER_GAMES + 1):
+            num_turns += dealer.run_game(game_id, players, seed)["rounds"]
+
+    seconds = time_function(run_games, repeat) / num_turns
+    return [create_result("run_game[players=stub]", seconds, "turn")]
+
+
+# Time whole simulations of games between bundled players for various numbers
+# of jobs, including the time taken to start the pool
+def benchmark_games(seed, repeat):
+    players = dealer.create_players(["toac.player:guess"] * 2)
+    results = []
+    for jobs in JOB_COUNTS:
+        num_games = NUM_GAMES_PER_JOB * jobs
+
+        def run_games():
+            with contextlib.redirect_stdout(io.StringIO()):
+                dealer.run_games(
+                    num_games, players, jobs=jobs, output_format="quiet", seed=seed
+                )
+
+        seconds = time_function(run_games, repeat) / num_games
+        name = "run_games[players=toac.player:guess,jobs={}]".format(jobs)
+        results.append(create_result(name, seconds, "game"))
+    return results
+
+
+# Run the chosen groups of benchmarks, using the same seed every time so that
+# every run measures exactly the same work
+def run_benchmarks(groups, seed, repeat):
+    results = []
+    if "solver" in groups:
+        results.extend(benchmark_solver(random.Random(seed), repeat))
+    if "dealer" in groups:
+        results.extend(benchmark_dealer(seed, repeat))
+    if "games" in groups:
+        results.extend(benchmark_games(seed, repeat))
+    return {
+        "version": BENCHMARK_VERSION,
+        "python": platform.python_version(),
+        "seed": seed,
+        "results": results,
+    }
+
+
+# Compare results against a baseline, retrieving every benchmark which has
+# become slower than the baseline by more than the given threshold, along
+# with how many times slower it has become
+def get_regressions(report, baseline, threshold):
+    baseline_seconds = {
+        result["name"]: result["seconds"] for result in baseline["results"]
+    }
+    regressions = []
+    for result in report["results"]:
+        if result["name"] not in baseline_seconds:
+            continue
+        slowdown = result["seconds"] / baseline_seconds[result["name"]]
+        if slowdown > 1 + threshold:
+            regressions.append((result["name"], slowdown))
+    return regressions
+
+
+def main():
+    cli_args = parse_cli_args()
+    report = run_benchmarks(
+        cli_args.only or BENCHMARK_GROUPS, cli_args.seed, cli_args.repeat
+    )
+
+    report_str = json.dumps(report, indent=2)
+    if cli_args.output:
+        with open(cli_args.output, "w") as output_file:
+            output_file.write(report_str + "\n")
+    else:
+        print(report_str)
+
+    if cli_args.baseline:
+        with open(cli_args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = get_regressions(report, baseline, cli_args.threshold)
+        for name, slowdown in regressions:
+            print(
+                "Regression: {} is {:.2f}x slower".format(name, slowdown),
+                file=sys.stderr,
+            )
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
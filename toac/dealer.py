@@ -1,18 +1,114 @@
 #!/usr/bin/env python3
 
 import argparse
+import asyncio
 import collections
+import contextlib
+import cProfile
+import functools
+import importlib
+import importlib.metadata
 import itertools
 import json
+import math
 import multiprocessing
+import multiprocessing.util
 import operator
+import os
+import pstats
+import queue
 import random
+import re
+import struct
 import subprocess
+import sys
+import tempfile
+import time
+
+import toac.forkserver as forkserver
 
 MATCH_LENGTH = 3
 BASE_SUSPECTS = {"pto", "nnn", "jco", "lel", "lsl", "kca", "hbu"}
-BASE_DECK = list(map(frozenset, itertools.combinations(BASE_SUSPECTS, r=MATCH_LENGTH)))
-MAX_NUM_CONCURRENT_GAMES = 4
+# Suspects are sorted so that the deck (and so any seeded shuffle of it) is in
+# the same order in every run
+BASE_DECK = list(
+    map(frozenset, itertools.combinations(sorted(BASE_SUSPECTS), r=MATCH_LENGTH))
+)
+# The position of every card in BASE_DECK, by which games are played and game
+# traces refer to cards
+BASE_CARD_INDICES = {card: c for c, card in enumerate(BASE_DECK)}
+# The suspects of every card, in the order they are passed to players
+BASE_CARD_SUSPECTS = [tuple(card) for card in BASE_DECK]
+# The number of suspects every card shares with every other card
+BASE_MATCH_COUNTS = [
+    [len(card & other_card) for other_card in BASE_DECK] for card in BASE_DECK
+]
+# The JSON encoding of every card with every possible match count, and of
+# every card as a guess, so that the data object passed to player programs can
+# be encoded by joining these fragments (rather than encoding it all again on
+# every turn)
+BASE_CARD_JSON = [
+    [
+        json.dumps(
+            {"suspects": suspects, "match_count": match_count}, separators=(",", ":")
+        )
+        for match_count in range(MATCH_LENGTH + 1)
+    ]
+    for suspects in BASE_CARD_SUSPECTS
+]
+BASE_GUESS_JSON = [
+    json.dumps(list(suspects), separators=(",", ":")) for suspects in BASE_CARD_SUSPECTS
+]
+# The JSON encoding of the part of the data object which never changes during
+# a game, up to the start of its list of cards
+BASE_DATA_JSON = '{{"base_suspects":{},"match_length":{},"cards":['.format(
+    json.dumps(list(BASE_SUSPECTS), separators=(",", ":")), MATCH_LENGTH
+)
+MAX_GAMES_PER_CHUNK = 100
+CHUNKS_IN_FLIGHT_PER_JOB = 2
+OUTPUT_BUFFER_SIZE = 1 << 16
+OUTPUT_FORMATS = ("text", "jsonl", "quiet")
+# The number of players in analyzed and simulated games, unless given
+DEFAULT_NUM_PLAYERS = 2
+SUBCOMMAND_MODULES = {
+    "analyze": "toac.analyze",
+    "distributed": "toac.distributed",
+    "tournament": "toac.tournament",
+}
+PLAYER_ENTRY_POINT_GROUP = "toac.players"
+PLAYER_PLUGIN_PATTERN = re.compile(r"^[A-Za-z_][\w.]*:[A-Za-z_][\w.]*$")
+# Measurements of player programs are bucketed on a log scale, so that
+# histograms stay small and can be merged across processes, while percentiles
+# remain accurate to within a bucket (about 9%)
+HISTOGRAM_BUCKETS_PER_DOUBLING = 8
+MIN_HISTOGRAM_VALUE = 1e-9
+PLAYER_METRIC_UNITS = {"wall": ("ms", 1e3), "cpu": ("ms", 1e3), "rss": ("MiB", 2**-20)}
+# Layout of game trace files (as read by toac/trace.py): a header (magic,
+# format version, match length, number of cards in the deck, size of each
+# record and size of the newline-separated suspect names), the suspect names
+# padded to a multiple of 8 bytes, then one fixed-width record per game: its
+# ID, the winning seat (or -1), rounds, whether it ended in error, the
+# eyewitness card, then the card drawn, its match count and the card guessed
+# on every turn (as indices into BASE_DECK, padded with NO_TRACE_CARD), all
+# little-endian; as every card index is a single byte, decks of more than
+# MAX_TRACE_CARDS cards cannot be traced
+TRACE_MAGIC = b"TOAC-TRC"
+TRACE_VERSION = 1
+TRACE_HEADER = struct.Struct("<8sHHHHI")
+TRACE_RECORD = struct.Struct("<QbBBB{0}s{0}s{0}s".format(len(BASE_DECK) - 1))
+NO_TRACE_CARD = 0xFF
+MAX_TRACE_CARDS = NO_TRACE_CARD
+# The fork servers started by this process, by player program
+FORK_SERVERS = {}
+# Player programs (such as toac/player.py) which see this environment variable
+# profile themselves, writing their stats to the directory it names
+PROFILE_DIR_ENV_VAR = "TOAC_PROFILE_DIR"
+# ru_maxrss is measured in kilobytes, except on macOS (where it is in bytes)
+MAX_RSS_SCALE = 1 if sys.platform == "darwin" else 1024
+# With early stopping, the number of games around which the confidence
+# interval on the win rate difference is tightest (larger differences are
+# detected sooner with a smaller number, smaller differences later)
+SEQUENTIAL_TEST_SCALE = 100
 
 
 # Parse command-line arguments passed to dealer program
@@ -26,21 +122,131 @@ def parse_cli_args():
         "programs",
         metavar="program",
         nargs="+",
-        help="one or more player programs to execute",
+        help="one or more player programs to execute, or Python players given "
+        "as module:callable or as the name of a toac.players entry point",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="the number of games to play at once (default: the number of CPUs)",
+    )
+    parser.add_argument(
+        "--format",
+        choices=OUTPUT_FORMATS,
+        default="text",
+        help="how to output statistics for each game: as text, as JSON lines, "
+        "or not at all (only printing the total wins)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="shuffle the deck of every game reproducibly, based on this seed",
+    )
+    parser.add_argument(
+        "--session",
+        action="append",
+        default=[],
+        metavar="PROGRAM",
+        help="start this player program once per game and speak the session "
+        "protocol with it (newline-delimited JSON); give this once for every "
+        "program which supports the protocol",
+    )
+    parser.add_argument(
+        "--fork-server",
+        action="store_true",
+        help="run player programs which are Python scripts from a fork server, "
+        "which imports each script once and forks a warmed-up copy of it for "
+        "every guess (not used for session players, nor with --concurrency)",
+    )
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="measure the wall time, CPU time and peak memory of every player "
+        "call, and output a report for each player after the total wins",
+    )
+    parser.add_argument(
+        "--metrics-output",
+        help="also write the measurements of every player as JSON to this file "
+        "(implies --metrics)",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="record every card drawn and every guess made in every game to "
+        "this file, in a compact binary format (see toac.trace)",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="profile every job with cProfile, writing the merged stats to this "
+        "file (which pstats or snakeviz can read)",
+    )
+    parser.add_argument(
+        "--profile-players",
+        action="store_true",
+        help="with --profile, also profile player programs which support it "
+        "(such as toac/player.py), merging their stats in too",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        help="interleave up to this many games at once within each job, using "
+        "asyncio, so that jobs keep busy while player programs run",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        help="with --concurrency, end a game with an error when a player takes "
+        "longer than this many seconds to guess",
+    )
+    parser.add_argument(
+        "--confidence",
+        type=float,
+        help="stop as soon as a sequential test decides, at this confidence "
+        "(such as 0.95), which of two players wins more often; ngames becomes "
+        "the most games to play",
     )
 
-    return parser.parse_args()
+    cli_args = parser.parse_args()
+    if cli_args.confidence is not None:
+        if len(cli_args.programs) != 2:
+            parser.error("--confidence compares exactly two player programs")
+        if not 0 < cli_args.confidence < 1:
+            parser.error("--confidence must be between 0 and 1")
+    if cli_args.timeout is not None and not cli_args.concurrency:
+        parser.error("--timeout only applies with --concurrency")
+    if cli_args.fork_server and cli_args.concurrency:
+        parser.error("--fork-server cannot be used with --concurrency")
+    if cli_args.profile_players and not cli_args.profile:
+        parser.error("--profile-players only applies with --profile")
+    if cli_args.trace and len(BASE_DECK) > MAX_TRACE_CARDS:
+        parser.error(
+            "--trace supports decks of at most {} cards".format(MAX_TRACE_CARDS)
+        )
+    return cli_args
 
 
 # Create a game object for storing the current state of the game
 def create_game(game_id):
-    return {"winner": None, "rounds": 0, "id": game_id}
+    return {"winner": None, "rounds": 0, "id": game_id, "error": None}
 
 
-# Create a new deck by shallow copying the base deck and shuffling it
-def create_deck():
-    deck = BASE_DECK[:]
-    random.shuffle(deck)
+# Retrieve the random number generator for a game, which is seeded by both
+# the given seed and the game's ID if a seed is given
+def get_game_random(game_id, seed=None):
+    if seed is None:
+        return random
+    return random.Random("{}:{}".format(seed, game_id))
+
+
+# Create a new deck of card indices (into BASE_DECK) and shuffle it; since a
+# shuffle only depends on the length of the list, a seeded deck has the same
+# cards in the same order as it did when decks were shuffled copies of
+# BASE_DECK itself
+def create_card_deck(rng=random):
+    deck = list(range(len(BASE_DECK)))
+    rng.shuffle(deck)
     return deck
 
 
@@ -59,9 +265,248 @@ def get_match_count(suspects, real_suspects):
     return len(suspects & real_suspects)
 
 
-# Pass data object to player program and parse guessed suspects from JSON
-def get_player_guess(player, data):
-    data_str = json.dumps(data, separators=(",", ":"))
+# Create the JSON encoding of a data object, as the (unterminated) encoding
+# of everything up to the end of its cards and of its guesses, which each
+# pre-encoded fragment is appended to as the game is played
+def create_encoded_data():
+    return {"cards": BASE_DATA_JSON, "previous_guesses": "["}
+
+
+# Append a pre-encoded fragment to the unterminated encoding of a list
+def append_encoded_item(encoded_list, fragment):
+    if encoded_list.endswith("["):
+        return encoded_list + fragment
+    return encoded_list + "," + fragment
+
+
+# Encode a guess which is not a card of the deck; players which guess wrong
+# tend to make the same guesses over and over, so encodings are reused
+@functools.lru_cache(maxsize=1024)
+def encode_other_guess(guessed_suspects):
+    return json.dumps(list(guessed_suspects), separators=(",", ":"))
+
+
+# Encode a data object as JSON; given its encoding (as kept up to date while
+# playing), its encoded cards and guesses are terminated instead
+def encode_data(data, encoded_data=None):
+    if encoded_data is None:
+        return json.dumps(data, separators=(",", ":"))
+    return "".join(
+        (
+            encoded_data["cards"],
+            '],"previous_guesses":',
+            encoded_data["previous_guesses"],
+            "]}",
+        )
+    )
+
+
+# Retrieve every player registered under the toac.players entry point group
+def get_player_entry_points():
+    entry_points = importlib.metadata.entry_points()
+    # EntryPoints.select() is unavailable before Python 3.10
+    if hasattr(entry_points, "select"):
+        entry_points = entry_points.select(group=PLAYER_ENTRY_POINT_GROUP)
+    else:
+        entry_points = entry_points.get(PLAYER_ENTRY_POINT_GROUP, [])
+    return {entry_point.name: entry_point for entry_point in entry_points}
+
+
+# Determine if a player program refers to a Python player which is called
+# in-process, rather than an executable; existing files are always treated as
+# executables
+def is_player_plugin(program):
+    if os.path.isfile(program):
+        return False
+    if PLAYER_PLUGIN_PATTERN.match(program):
+        return True
+    return program in get_player_entry_points()
+
+
+# Determine if a player program is a Python script (by its extension or its
+# shebang line), which a fork server can run without starting Python anew
+def is_python_script(program):
+    if program.endswith(".py"):
+        return True
+    try:
+        with open(program, "rb") as program_file:
+            first_line = program_file.readline(256)
+    except OSError:
+        return False
+    return first_line.startswith(b"#!") and b"python" in first_line
+
+
+# Start a fork server for a Python player script, which loads the script
+# once; this only happens once per process (unless the server dies), after
+# which the same server serves every turn of every game until
+# close_fork_servers is called (which also happens when the process exits)
+def get_fork_server(program):
+    if program not in FORK_SERVERS:
+        if not FORK_SERVERS:
+            multiprocessing.util.Finalize(None, close_fork_servers, exitpriority=20)
+        FORK_SERVERS[program] = subprocess.Popen(
+            [sys.executable, "-m", "toac.forkserver", program],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+    return FORK_SERVERS[program]
+
+
+# Stop a fork server: it exits once its stdin is closed (unless it has died
+# already), and is then waited for so that it is not left behind
+def close_fork_server(server):
+    try:
+        server.stdin.close()
+    except BrokenPipeError:
+        pass
+    server.wait()
+    server.stdout.close()
+
+
+# Stop every fork server started by this process
+def close_fork_servers():
+    while FORK_SERVERS:
+        _, server = FORK_SERVERS.popitem()
+        close_fork_server(server)
+
+
+# Pass data object to a Python player script via its fork server, which runs
+# a forked copy of the script with the data on its stdin, and parse guessed
+# suspects from the JSON the script writes to its stdout; given metrics, the
+# CPU time and peak memory which the server measured for the copy are recorded
+def get_fork_server_player_guess(player, data, encoded_data=None, metrics=None):
+    server = get_fork_server(player["program"])
+    data_bytes = encode_data(data, encoded_data).encode("utf-8")
+    try:
+        server.stdin.write(forkserver.FRAME_HEADER.pack(len(data_bytes)))
+        server.stdin.write(data_bytes)
+        server.stdin.flush()
+        header = server.stdout.read(forkserver.RESPONSE_HEADER.size)
+    except BrokenPipeError:
+        header = b""
+    if len(header) != forkserver.RESPONSE_HEADER.size:
+        # The server has died, so the script is run by itself for this guess,
+        # and a new server is started for the next one
+        close_fork_server(FORK_SERVERS.pop(player["program"]))
+        return get_program_player_guess(player, data, metrics, encoded_data)
+    output_size, cpu_time, max_rss = forkserver.RESPONSE_HEADER.unpack(header)
+    output = server.stdout.read(output_size)
+    if metrics is not None:
+        record_player_metric(metrics, player["id"], "cpu", cpu_time)
+        record_player_metric(metrics, player["id"], "rss", max_rss * MAX_RSS_SCALE)
+    guessed_suspects = frozenset(json.loads(output.decode("utf-8")))
+    return guessed_suspects
+
+
+# Import the callable for a Python player; this only happens once per process,
+# after which the same callable is reused for every turn of every game
+@functools.lru_cache(maxsize=None)
+def load_player_plugin(program):
+    if ":" not in program:
+        return get_player_entry_points()[program].load()
+    module_name, attribute_path = program.split(":")
+    plugin = importlib.import_module(module_name)
+    for attribute in attribute_path.split("."):
+        plugin = getattr(plugin, attribute)
+    return plugin
+
+
+# Create an empty histogram of measurements
+def create_histogram():
+    return {"count": 0, "total": 0.0, "max": 0.0, "buckets": {}}
+
+
+# Add a measurement to a histogram
+def add_to_histogram(histogram, value):
+    value = max(value, MIN_HISTOGRAM_VALUE)
+    bucket = math.floor(math.log2(value) * HISTOGRAM_BUCKETS_PER_DOUBLING)
+    histogram["count"] += 1
+    histogram["total"] += value
+    histogram["max"] = max(histogram["max"], value)
+    histogram["buckets"][bucket] = histogram["buckets"].get(bucket, 0) + 1
+
+
+# Merge the measurements of one histogram into another
+def merge_histograms(histogram, other_histogram):
+    histogram["count"] += other_histogram["count"]
+    histogram["total"] += other_histogram["total"]
+    histogram["max"] = max(histogram["max"], other_histogram["max"])
+    for bucket, count in other_histogram["buckets"].items():
+        histogram["buckets"][bucket] = histogram["buckets"].get(bucket, 0) + count
+
+
+# Estimate the given percentile of a histogram's measurements as the upper
+# bound of the bucket it falls in
+def get_histogram_percentile(histogram, percentile):
+    rank = histogram["count"] * percentile / 100
+    num_measurements = 0
+    for bucket in sorted(histogram["buckets"]):
+        num_measurements += histogram["buckets"][bucket]
+        if num_measurements >= rank:
+            upper_bound = 2 ** ((bucket + 1) / HISTOGRAM_BUCKETS_PER_DOUBLING)
+            return min(upper_bound, histogram["max"])
+    return histogram["max"]
+
+
+# Summarize a histogram by its count, mean, percentiles and maximum
+def summarize_histogram(histogram):
+    return {
+        "count": histogram["count"],
+        "mean": histogram["total"] / histogram["count"],
+        "p50": get_histogram_percentile(histogram, 50),
+        "p95": get_histogram_percentile(histogram, 95),
+        "p99": get_histogram_percentile(histogram, 99),
+        "max": histogram["max"],
+    }
+
+
+# Record a measurement (in seconds or bytes) of a player's wall time, CPU
+# time or peak memory (RSS) in the given per-player metrics
+def record_player_metric(metrics, player_id, metric, value):
+    player_metrics = metrics.setdefault(player_id, {})
+    if metric not in player_metrics:
+        player_metrics[metric] = create_histogram()
+    add_to_histogram(player_metrics[metric], value)
+
+
+# Merge per-player metrics (as gathered by a worker) into other metrics
+def merge_player_metrics(metrics, other_metrics):
+    for player_id, player_metrics in other_metrics.items():
+        for metric, histogram in player_metrics.items():
+            merged_metrics = metrics.setdefault(player_id, {})
+            if metric not in merged_metrics:
+                merged_metrics[metric] = create_histogram()
+            merge_histograms(merged_metrics[metric], histogram)
+
+
+# Wait for a player process to exit; given metrics, the process is reaped with
+# os.wait4 (where available) so that its CPU time and peak memory are recorded
+def wait_for_player_process(program, player_id=None, metrics=None):
+    if metrics is None or not hasattr(os, "wait4"):
+        program.wait()
+        return
+    _, status, usage = os.wait4(program.pid, 0)
+    program.returncode = os.waitstatus_to_exitcode(status)
+    record_player_metric(metrics, player_id, "cpu", usage.ru_utime + usage.ru_stime)
+    record_player_metric(metrics, player_id, "rss", usage.ru_maxrss * MAX_RSS_SCALE)
+
+
+# Pass data object to player program and parse guessed suspects from JSON;
+# given metrics, every call of the player is measured, and given the encoding
+# of the data object, it is passed to player programs without encoding the
+# data object again
+def get_player_guess(player, data, session=None, metrics=None, encoded_data=None):
+    if metrics is not None:
+        return get_measured_player_guess(player, data, session, metrics, encoded_data)
+    if player["plugin"]:
+        # Python players are handed the data object itself, so that no
+        # process is started and no JSON is encoded or decoded
+        return frozenset(load_player_plugin(player["program"])(data))
+    if session is not None:
+        return get_session_player_guess(session, data)
+    if player["fork_server"]:
+        return get_fork_server_player_guess(player, data, encoded_data)
+    data_str = encode_data(data, encoded_data)
     program = subprocess.Popen(
         player["program"], stdin=subprocess.PIPE, stdout=subprocess.PIPE
     )
@@ -71,67 +516,564 @@ def get_player_guess(player, data):
     return guessed_suspects
 
 
+# Pass data object to player program and parse guessed suspects from JSON,
+# recording the wall time of the call; Python players' CPU time is recorded
+# for every call, while player programs' CPU time and peak memory are recorded
+# whenever their process exits (after every call, or after every session; fork
+# servers report them for every forked copy, since only they can reap it)
+def get_measured_player_guess(player, data, session, metrics, encoded_data=None):
+    start_time = time.perf_counter()
+    try:
+        if player["plugin"]:
+            start_cpu_time = time.process_time()
+            guessed_suspects = get_player_guess(player, data)
+            cpu_time = time.process_time() - start_cpu_time
+            record_player_metric(metrics, player["id"], "cpu", cpu_time)
+        elif session is not None:
+            guessed_suspects = get_session_player_guess(session, data)
+        elif player["fork_server"]:
+            guessed_suspects = get_fork_server_player_guess(
+                player, data, encoded_data, metrics
+            )
+        else:
+            guessed_suspects = get_program_player_guess(
+                player, data, metrics, encoded_data
+            )
+    finally:
+        wall_time = time.perf_counter() - start_time
+        record_player_metric(metrics, player["id"], "wall", wall_time)
+    return guessed_suspects
+
+
+# Run a player program for a single guess, reaping it with os.wait4 (rather
+# than Popen.communicate) so that its resource usage can be recorded
+def get_program_player_guess(player, data, metrics, encoded_data=None):
+    data_str = encode_data(data, encoded_data)
+    program = subprocess.Popen(
+        player["program"], stdin=subprocess.PIPE, stdout=subprocess.PIPE
+    )
+    try:
+        program.stdin.write(data_str.encode("utf-8"))
+        program.stdin.close()
+    except BrokenPipeError:
+        pass
+    output = program.stdout.read()
+    program.stdout.close()
+    wait_for_player_process(program, player["id"], metrics)
+    guessed_suspects = frozenset(json.loads(output.decode("utf-8")))
+    return guessed_suspects
+
+
+# Start a long-lived player process which speaks the session protocol
+def start_player_session(player):
+    program = subprocess.Popen(
+        [player["program"], "--session"], stdin=subprocess.PIPE, stdout=subprocess.PIPE
+    )
+    return {"process": program, "num_cards": 0, "num_guesses": 0}
+
+
+# Start a session for every player which has opted into the session protocol
+def start_player_sessions(players):
+    sessions = {}
+    for player in players:
+        if player["session"]:
+            sessions[player["id"]] = start_player_session(player)
+    return sessions
+
+
+# Build the next message for a session player; only the first message carries
+# the game setup, and every message carries just the cards and guesses which
+# the player has not been sent yet
+def build_session_message(session, data):
+    message = {
+        "cards": data["cards"][session["num_cards"] :],
+        "previous_guesses": data["previous_guesses"][session["num_guesses"] :],
+    }
+    # A card is always drawn before a guess is requested, so no cards having
+    # been sent means this is the first message of the session
+    if session["num_cards"] == 0:
+        message["base_suspects"] = data["base_suspects"]
+        message["match_length"] = data["match_length"]
+    session["num_cards"] = len(data["cards"])
+    session["num_guesses"] = len(data["previous_guesses"])
+    return message
+
+
+# Send the latest game state to a session player and parse its guess from the
+# single line of JSON it writes back
+def get_session_player_guess(session, data):
+    message = build_session_message(session, data)
+    program = session["process"]
+    try:
+        program.stdin.write(json.dumps(message, separators=(",", ":")).encode("utf-8"))
+        program.stdin.write(b"\n")
+        program.stdin.flush()
+    except BrokenPipeError:
+        # A player which exited early is treated like one returning bad JSON
+        raise ValueError("player session closed unexpectedly")
+    output = program.stdout.readline()
+    guessed_suspects = frozenset(json.loads(output.decode("utf-8")))
+    return guessed_suspects
+
+
+# Close every player session, letting each player exit once its input ends;
+# given metrics, the resource usage of every session is recorded
+def end_player_sessions(sessions, metrics=None):
+    for player_id, session in sessions.items():
+        program = session["process"]
+        try:
+            program.stdin.close()
+        except BrokenPipeError:
+            pass
+        program.stdout.close()
+        wait_for_player_process(program, player_id, metrics)
+
+
 # Add card data to data object that is to be passed to player program
 def add_card_to_data(data, suspects, match_count):
     data["cards"].append({"suspects": tuple(suspects), "match_count": match_count})
 
 
-# Always record number of rounds that have elapsed by the end of the game
-def end_game(game, lock):
-    print_game_stats(game, lock)
+# Format statistics for this game in the given output format
+def format_game_stats(game, output_format):
+    if output_format == "jsonl":
+        return json.dumps(game, separators=(",", ":")) + "\n"
+    lines = [
+        "Game #{}".format(game["id"]),
+        "  Winner: {}".format(game["winner"]),
+        "  Rounds: {}".format(game["rounds"]),
+    ]
+    if game["error"]:
+        lines.append("  {}".format(game["error"]))
+    return "\n".join(lines) + "\n"
 
 
-# Write to stdout statistics for this game
-def print_game_stats(game, lock):
-    # "Lock" this logic so that multiple processes can't run it concurrently
-    with lock:
-        print("Game #{}".format(game["id"]))
-        print("  Winner: {}".format(game["winner"]))
-        print("  Rounds: {}".format(game["rounds"]))
+# A generator which writes statistics for every game passing through it to
+# stdout; writes are buffered so that output stays cheap at high game counts,
+# and only this (parent) process ever writes, so no locking is needed
+def write_game_stats(games, output_format):
+    buffer = []
+    buffer_size = 0
+    for game in games:
+        if output_format != "quiet":
+            game_stats = format_game_stats(game, output_format)
+            buffer.append(game_stats)
+            buffer_size += len(game_stats)
+            if buffer_size >= OUTPUT_BUFFER_SIZE:
+                sys.stdout.write("".join(buffer))
+                buffer.clear()
+                buffer_size = 0
+        yield game
+    sys.stdout.write("".join(buffer))
 
 
-# Run game, record data, and output statistics
-def run_game(game_id, players, lock):
-    game = create_game(game_id)
-    deck = create_deck()
+# A generator which plays a game by the rules, "yielding" every player whose
+# turn it is (along with the data object to pass to them, and its encoding)
+# and expecting to be sent each player's guess in return; the game object (and
+# the trace, if given) is updated as the game is played, and the generator
+# stops once the game is over. Cards are played by their indices into
+# BASE_DECK, so that every turn costs the same few table lookups
+def play_game(game, players, seed=None, trace=None):
+    deck = create_card_deck(get_game_random(game["id"], seed))
     data = build_data_object()
-    real_suspects = deck.pop()
+    encoded_data = create_encoded_data()
+    eyewitness = deck.pop()
+    eyewitness_match_counts = BASE_MATCH_COUNTS[eyewitness]
+    if trace is not None:
+        trace["eyewitness"] = eyewitness
 
     # Continue taking turns until correct guess is made
-    guessed_correctly = False
-    while not guessed_correctly and len(deck) != 0:
-        for player in players:
-            suspects = deck.pop()
-            match_count = get_match_count(suspects, real_suspects)
-            add_card_to_data(data, suspects, match_count)
+    while len(deck) != 0:
+        for seat, player in enumerate(players):
+            card = deck.pop()
+            match_count = eyewitness_match_counts[card]
+            add_card_to_data(data, BASE_CARD_SUSPECTS[card], match_count)
+            encoded_data["cards"] = append_encoded_item(
+                encoded_data["cards"], BASE_CARD_JSON[card][match_count]
+            )
             game["rounds"] += 1
+            if trace is not None:
+                add_card_to_trace(trace, card, match_count)
             # Ask player to guess correct suspects and store its response
-            try:
-                guessed_suspects = get_player_guess(player, data)
-            except ValueError:
-                end_game(game, lock)
-                print("  Returned JSON is invalid.")
-                return
-            if guessed_suspects == real_suspects:
+            guessed_suspects = frozenset((yield player, data, encoded_data))
+            # Guesses which are not cards of the deck have no card index
+            guess = BASE_CARD_INDICES.get(guessed_suspects)
+            if trace is not None:
+                add_guess_to_trace(trace, guess)
+            if guess == eyewitness:
                 # If guess is correct, record winner and end game
-                guessed_correctly = True
                 game["winner"] = player["id"]
-                break
+                if trace is not None:
+                    trace["winner"] = seat
+                return
             elif len(deck) == 0:
-                break
+                return
             else:
                 # If guess is incorrect, record guess and keep playing
-                data["previous_guesses"].append(list(guessed_suspects))
+                if guess is None:
+                    data["previous_guesses"].append(list(guessed_suspects))
+                    encoded_guess = encode_other_guess(guessed_suspects)
+                else:
+                    data["previous_guesses"].append(list(BASE_CARD_SUSPECTS[guess]))
+                    encoded_guess = BASE_GUESS_JSON[guess]
+                encoded_data["previous_guesses"] = append_encoded_item(
+                    encoded_data["previous_guesses"], encoded_guess
+                )
+
+
+# Create an empty trace of a game, to be filled in as the game is played
+def create_trace():
+    return {
+        "eyewitness": NO_TRACE_CARD,
+        "cards": bytearray(),
+        "match_counts": bytearray(),
+        "guesses": bytearray(),
+        "winner": -1,
+    }
+
+
+# Record a card (by its index) drawn during a game in its trace
+def add_card_to_trace(trace, card, match_count):
+    trace["cards"].append(card)
+    trace["match_counts"].append(match_count)
+
+
+# Record a guess (by its card index) made during a game in its trace; guesses
+# which are not cards of the deck (whose index is None) are recorded as
+# NO_TRACE_CARD
+def add_guess_to_trace(trace, guess):
+    trace["guesses"].append(NO_TRACE_CARD if guess is None else guess)
+
+
+# Pack the trace of a finished game into a fixed-width record
+def pack_trace(game, trace):
+    num_turns = len(BASE_DECK) - 1
+    return TRACE_RECORD.pack(
+        game["id"],
+        trace["winner"],
+        game["rounds"],
+        game["error"] is not None,
+        trace["eyewitness"],
+        bytes(trace["cards"]).ljust(num_turns, bytes([NO_TRACE_CARD])),
+        bytes(trace["match_counts"]).ljust(num_turns, bytes([NO_TRACE_CARD])),
+        bytes(trace["guesses"]).ljust(num_turns, bytes([NO_TRACE_CARD])),
+    )
+
+
+# Write the header of a game trace file, which describes the deck that every
+# record's card indices refer to
+def write_trace_header(trace_file):
+    names = "\n".join(sorted(BASE_SUSPECTS)).encode("utf-8")
+    trace_file.write(
+        TRACE_HEADER.pack(
+            TRACE_MAGIC,
+            TRACE_VERSION,
+            MATCH_LENGTH,
+            len(BASE_DECK),
+            TRACE_RECORD.size,
+            len(names),
+        )
+    )
+    trace_file.write(names.ljust(-(-len(names) // 8) * 8, b"\0"))
+
+
+# Send a player's guess to a game being played, retrieving the next player
+# whose turn it is (and the data object), or None once the game is over
+def send_player_guess(turns, guessed_suspects):
+    try:
+        return turns.send(guessed_suspects)
+    except StopIteration:
+        return None
+
+
+# Run game and record data, returning the finished game; given metrics, every
+# player call is measured, and given a trace, every turn is recorded in it
+def run_game(game_id, players, seed=None, metrics=None, trace=None):
+    game = create_game(game_id)
+    turns = play_game(game, players, seed, trace)
+    sessions = start_player_sessions(players)
+
+    try:
+        turn = next(turns, None)
+        while turn is not None:
+            player, data, encoded_data = turn
+            try:
+                guessed_suspects = get_player_guess(
+                    player, data, sessions.get(player["id"]), metrics, encoded_data
+                )
+            except ValueError:
+                game["error"] = "Returned JSON is invalid."
+                return game
+            turn = send_player_guess(turns, guessed_suspects)
+    finally:
+        end_player_sessions(sessions, metrics)
 
-    end_game(game, lock)
     return game
 
 
-# A generator which waits for each process to finish
-# then "yields" the finished game object
-def get_finished_games(processes):
-    for process in processes:
-        yield process.get()
+# Pass data object to player program and parse guessed suspects from JSON,
+# without blocking the event loop while the player program runs; player
+# programs are killed if they take longer than the timeout (in seconds); given
+# metrics, the wall time of every call is recorded (as the event loop reaps
+# player processes itself, their resource usage is not)
+async def get_player_guess_async(
+    player, data, session=None, timeout=None, metrics=None, encoded_data=None
+):
+    if metrics is not None:
+        start_time = time.perf_counter()
+        try:
+            return await get_player_guess_async(
+                player, data, session, timeout, encoded_data=encoded_data
+            )
+        finally:
+            wall_time = time.perf_counter() - start_time
+            record_player_metric(metrics, player["id"], "wall", wall_time)
+    if player["plugin"]:
+        return frozenset(load_player_plugin(player["program"])(data))
+    if session is not None:
+        return await get_session_player_guess_async(session, data, timeout)
+    data_str = encode_data(data, encoded_data)
+    program = await asyncio.create_subprocess_exec(
+        player["program"], stdin=subprocess.PIPE, stdout=subprocess.PIPE
+    )
+    try:
+        output, error = await asyncio.wait_for(
+            program.communicate(input=data_str.encode("utf-8")), timeout
+        )
+    except asyncio.TimeoutError:
+        program.kill()
+        await program.wait()
+        raise
+    guessed_suspects = frozenset(json.loads(output.decode("utf-8")))
+    return guessed_suspects
+
+
+# Start a long-lived player process which speaks the session protocol,
+# without blocking the event loop
+async def start_player_session_async(player):
+    program = await asyncio.create_subprocess_exec(
+        player["program"], "--session", stdin=subprocess.PIPE, stdout=subprocess.PIPE
+    )
+    return {"process": program, "num_cards": 0, "num_guesses": 0}
+
+
+# Start a session for every player which has opted into the session protocol,
+# without blocking the event loop
+async def start_player_sessions_async(players):
+    sessions = {}
+    for player in players:
+        if player["session"]:
+            sessions[player["id"]] = await start_player_session_async(player)
+    return sessions
+
+
+# Send the latest game state to a session player and parse its guess from the
+# single line of JSON it writes back, giving up after the timeout (in seconds)
+async def get_session_player_guess_async(session, data, timeout=None):
+    message = build_session_message(session, data)
+    program = session["process"]
+    try:
+        program.stdin.write(json.dumps(message, separators=(",", ":")).encode("utf-8"))
+        program.stdin.write(b"\n")
+        await program.stdin.drain()
+    except ConnectionError:
+        # A player which exited early is treated like one returning bad JSON
+        raise ValueError("player session closed unexpectedly")
+    output = await asyncio.wait_for(program.stdout.readline(), timeout)
+    guessed_suspects = frozenset(json.loads(output.decode("utf-8")))
+    return guessed_suspects
+
+
+# Close every player session, letting each player exit once its input ends;
+# players which may be stuck (after timing out) are killed instead
+async def end_player_sessions_async(sessions, kill=False):
+    for session in sessions.values():
+        program = session["process"]
+        if kill and program.returncode is None:
+            program.kill()
+        program.stdin.close()
+        await program.wait()
+
+
+# Run game and record data, returning the finished game; while any player
+# program runs, the event loop is free to run turns of other games
+async def run_game_async(
+    game_id, players, seed=None, timeout=None, metrics=None, trace=None
+):
+    game = create_game(game_id)
+    turns = play_game(game, players, seed, trace)
+    sessions = await start_player_sessions_async(players)
+
+    try:
+        turn = next(turns, None)
+        while turn is not None:
+            player, data, encoded_data = turn
+            try:
+                guessed_suspects = await get_player_guess_async(
+                    player,
+                    data,
+                    sessions.get(player["id"]),
+                    timeout,
+                    metrics,
+                    encoded_data,
+                )
+            except ValueError:
+                game["error"] = "Returned JSON is invalid."
+                return game
+            except asyncio.TimeoutError:
+                game["error"] = "Player timed out."
+                return game
+            turn = send_player_guess(turns, guessed_suspects)
+    finally:
+        await end_player_sessions_async(sessions, kill=game["error"] is not None)
+
+    return game
+
+
+# Split the games to play into chunks of consecutive game IDs
+def get_game_chunks(num_games, chunk_size):
+    for start in range(1, num_games + 1, chunk_size):
+        yield range(start, min(start + chunk_size, num_games + 1))
+
+
+# Run a chunk of games as a single task, so that the overhead of handing work
+# to the pool is only paid once per chunk
+def run_game_chunk(game_ids, players, seed=None):
+    return [run_game(game_id, players, seed) for game_id in game_ids]
+
+
+# Run a chunk of games as a single task, interleaving up to concurrency games
+# at once on an event loop, so that the worker keeps playing other games while
+# player programs start up and run
+def run_game_chunk_async(
+    game_ids,
+    players,
+    seed=None,
+    concurrency=1,
+    timeout=None,
+    metrics=None,
+    traces=None,
+):
+    return asyncio.run(
+        run_games_concurrently(
+            game_ids, players, seed, concurrency, timeout, metrics, traces
+        )
+    )
+
+
+# Run every game at once, limited to concurrency games in progress at a time,
+# retrieving the finished games in the order given; given a list of traces,
+# the trace of every game is appended to it (in the same order)
+async def run_games_concurrently(
+    game_ids, players, seed, concurrency, timeout, metrics=None, traces=None
+):
+    semaphore = asyncio.Semaphore(concurrency)
+    game_traces = [None if traces is None else create_trace() for _ in game_ids]
+
+    async def run_game_when_ready(game_id, trace):
+        async with semaphore:
+            return await run_game_async(game_id, players, seed, timeout, metrics, trace)
+
+    games = await asyncio.gather(*map(run_game_when_ready, game_ids, game_traces))
+    if traces is not None:
+        traces.extend(game_traces)
+    return games
+
+
+# Run a chunk of games as a single task (interleaving games given a
+# concurrency) while measuring every player call and/or recording the trace of
+# every game, retrieving the finished games, the per-player metrics gathered
+# by this worker (or None) and the packed trace records (which the parent can
+# write in bulk)
+def run_recorded_game_chunk(
+    game_ids,
+    players,
+    seed=None,
+    concurrency=None,
+    timeout=None,
+    measure=False,
+    record_traces=False,
+):
+    metrics = {} if measure else None
+    traces = [] if record_traces else None
+    if concurrency:
+        games = run_game_chunk_async(
+            game_ids, players, seed, concurrency, timeout, metrics, traces
+        )
+    else:
+        games = []
+        for game_id in game_ids:
+            trace = create_trace() if record_traces else None
+            games.append(run_game(game_id, players, seed, metrics, trace))
+            if record_traces:
+                traces.append(trace)
+    if not record_traces:
+        return games, metrics, b""
+    return games, metrics, b"".join(map(pack_trace, games, traces))
+
+
+# A generator which keeps at most max_in_flight chunks of games running at
+# once and "yields" every game of a chunk as soon as that chunk finishes, in
+# whatever order the chunks finish; given a concurrency, every chunk is run
+# with asyncio, interleaving that many games at once, given metrics, the
+# per-player metrics measured for every chunk are merged into them, and given
+# a trace file, the trace records of every chunk are written to it
+def get_finished_games(
+    pool,
+    chunks,
+    players,
+    max_in_flight,
+    seed=None,
+    concurrency=None,
+    timeout=None,
+    metrics=None,
+    trace_file=None,
+):
+    finished_chunks = queue.Queue()
+    num_in_flight = 0
+    measure = metrics is not None
+    record_traces = trace_file is not None
+
+    for chunk in chunks:
+        if num_in_flight == max_in_flight:
+            yield from get_finished_chunk(finished_chunks, metrics, trace_file)
+            num_in_flight -= 1
+        if measure or record_traces:
+            run_chunk = run_recorded_game_chunk
+            args = (chunk, players, seed, concurrency, timeout, measure, record_traces)
+        elif concurrency:
+            run_chunk = run_game_chunk_async
+            args = (chunk, players, seed, concurrency, timeout)
+        else:
+            run_chunk = run_game_chunk
+            args = (chunk, players, seed)
+        pool.apply_async(
+            run_chunk,
+            args=args,
+            callback=finished_chunks.put,
+            error_callback=finished_chunks.put,
+        )
+        num_in_flight += 1
+
+    for _ in range(num_in_flight):
+        yield from get_finished_chunk(finished_chunks, metrics, trace_file)
+
+
+# Wait for the next chunk of games to finish, re-raising any error it raised;
+# given metrics, the chunk's own metrics are merged into them, and given a
+# trace file, the chunk's trace records are written to it
+def get_finished_chunk(finished_chunks, metrics=None, trace_file=None):
+    chunk_games = finished_chunks.get()
+    if isinstance(chunk_games, BaseException):
+        raise chunk_games
+    if metrics is None and trace_file is None:
+        return chunk_games
+    chunk_games, chunk_metrics, chunk_traces = chunk_games
+    if metrics is not None:
+        merge_player_metrics(metrics, chunk_metrics)
+    if trace_file is not None:
+        trace_file.write(chunk_traces)
+    return chunk_games
 
 
 # Calculate and sort the total wins for every player
@@ -143,41 +1085,337 @@ def get_sorted_player_wins(games):
 
 
 # Print the total number of wins for every player
-def print_player_wins(games):
-    for player_id, player_wins in get_sorted_player_wins(games):
-        if player_id:
-            print("{} Wins: {}".format(player_id, player_wins))
+def print_player_wins(games, output_format="text"):
+    sorted_player_wins = [
+        (player_id, player_wins)
+        for player_id, player_wins in get_sorted_player_wins(games)
+        if player_id
+    ]
+    if output_format == "jsonl":
+        print(json.dumps({"wins": dict(sorted_player_wins)}, separators=(",", ":")))
+        return
+    for player_id, player_wins in sorted_player_wins:
+        print("{} Wins: {}".format(player_id, player_wins))
 
 
-# Run all games
-def run_games(num_games, players):
-    processes = []
-    lock = multiprocessing.Manager().RLock()
+# Create the state of a sequential test of whether the first or the second
+# player wins more often, at the given confidence. Every game scores 1 if the
+# first player wins, -1 if the second does and 0 otherwise, so the mean score
+# is the difference between the players' win rates; the test keeps a
+# confidence sequence for that difference (Robbins' normal mixture bound for
+# scores within [-1, 1]), an interval which holds at every game at once, so
+# that it may be checked after every game without inflating the error rate
+def create_sequential_test(players, confidence):
+    return {
+        "players": (players[0]["id"], players[1]["id"]),
+        "confidence": confidence,
+        "num_games": 0,
+        "score_sum": 0,
+        "winner": None,
+    }
 
-    with multiprocessing.Pool(processes=MAX_NUM_CONCURRENT_GAMES) as pool:
-        # Run each game asynchronously as a separate process
-        for game_id in range(1, num_games + 1):
-            process = pool.apply_async(run_game, args=(game_id, players, lock))
-            processes.append(process)
 
-        games = get_finished_games(processes)
-        print_player_wins(games)
+# Retrieves the interval on the difference between the two players' win rates
+# after the games played so far
+def get_sequential_test_interval(test):
+    num_games = test["num_games"]
+    if not num_games:
+        return -1.0, 1.0
+    difference = test["score_sum"] / num_games
+    spread = num_games + SEQUENTIAL_TEST_SCALE
+    error_rate = 1 - test["confidence"]
+    half_width = (
+        math.sqrt(spread * math.log(spread / (SEQUENTIAL_TEST_SCALE * error_rate**2)))
+        / num_games
+    )
+    return max(-1.0, difference - half_width), min(1.0, difference + half_width)
 
 
-# Create list of players from the list of player program paths
-def create_players(programs):
+# Update a sequential test with the outcome of a game, retrieving whether the
+# test has decided which player wins more often (once the interval on the
+# difference between their win rates excludes zero)
+def update_sequential_test(test, game):
+    test["num_games"] += 1
+    first_player_id, second_player_id = test["players"]
+    if game["winner"] == first_player_id:
+        test["score_sum"] += 1
+    elif game["winner"] == second_player_id:
+        test["score_sum"] -= 1
+    low, high = get_sequential_test_interval(test)
+    if low > 0:
+        test["winner"] = first_player_id
+    elif high < 0:
+        test["winner"] = second_player_id
+    return test["winner"] is not None
+
+
+# A generator which passes every game through until the sequential test
+# decides, at which point it stops (so that no more games are played)
+def stop_early(games, test):
+    for game in games:
+        yield game
+        if update_sequential_test(test, game):
+            return
+
+
+# Summarize a sequential test: the games played, the player which wins more
+# often (if decided), and the difference between the two players' win rates
+# along with its interval
+def summarize_sequential_test(test):
+    num_games = test["num_games"]
+    return {
+        "games": num_games,
+        "players": list(test["players"]),
+        "winner": test["winner"],
+        "confidence": test["confidence"],
+        "difference": test["score_sum"] / num_games if num_games else 0.0,
+        "interval": list(get_sequential_test_interval(test)),
+    }
+
+
+# Print the result of a sequential test, after the total wins
+def print_sequential_test(test, output_format="text"):
+    summary = summarize_sequential_test(test)
+    if output_format == "jsonl":
+        print(json.dumps({"sequential_test": summary}, separators=(",", ":")))
+        return
+    print("Games played: {}".format(summary["games"]))
+    print(
+        "{} - {} win rate: {:+.4f} ({:.0%} CI: {:+.4f} to {:+.4f})".format(
+            *summary["players"],
+            summary["difference"],
+            summary["confidence"],
+            *summary["interval"],
+        )
+    )
+    print("Wins more often: {}".format(summary["winner"] or "undecided"))
+
+
+# Summarize every player's metrics, in the order of the players' IDs
+def summarize_player_metrics(metrics):
+    return {
+        player_id: {
+            metric: summarize_histogram(histogram)
+            for metric, histogram in sorted(metrics[player_id].items())
+        }
+        for player_id in sorted(metrics)
+    }
+
+
+# Print a report of every player's metrics, after the total wins
+def print_player_metrics(metrics, output_format="text"):
+    summaries = summarize_player_metrics(metrics)
+    if output_format == "jsonl":
+        print(json.dumps({"metrics": summaries}, separators=(",", ":")))
+        return
+    for player_id, player_summaries in summaries.items():
+        for metric, summary in player_summaries.items():
+            unit, scale = PLAYER_METRIC_UNITS[metric]
+            print(
+                "{} {} ({}): count {}, mean {:.2f}, p50 {:.2f}, p95 {:.2f}, "
+                "p99 {:.2f}, max {:.2f}".format(
+                    player_id,
+                    metric,
+                    unit,
+                    summary["count"],
+                    summary["mean"] * scale,
+                    summary["p50"] * scale,
+                    summary["p95"] * scale,
+                    summary["p99"] * scale,
+                    summary["max"] * scale,
+                )
+            )
+
+
+# Write every player's metrics as JSON, both summarized and as the raw
+# histograms (so that the measurements of several runs can be merged later)
+def write_player_metrics(metrics, metrics_path):
+    with open(metrics_path, "w") as metrics_file:
+        json.dump(
+            {"summaries": summarize_player_metrics(metrics), "histograms": metrics},
+            metrics_file,
+            indent=2,
+        )
+        metrics_file.write("\n")
+
+
+# Start profiling a pool worker; its stats are written to the profile
+# directory when the worker exits, and player programs it runs are told to
+# profile themselves too if requested
+def start_worker_profile(profile_dir, profile_players=False):
+    if profile_players:
+        os.environ[PROFILE_DIR_ENV_VAR] = profile_dir
+    profiler = cProfile.Profile()
+    profiler.enable()
+    multiprocessing.util.Finalize(
+        None, stop_worker_profile, args=(profiler, profile_dir), exitpriority=10
+    )
+
+
+# Stop profiling a pool worker and write its stats to the profile directory
+def stop_worker_profile(profiler, profile_dir):
+    profiler.disable()
+    profile_path = os.path.join(profile_dir, "worker-{}.prof".format(os.getpid()))
+    profiler.dump_stats(profile_path)
+
+
+# Merge the stats of every profile written to the profile directory (by pool
+# workers and player programs alike) into a single pstats file
+def merge_profiles(profile_dir, profile_path):
+    profile_names = sorted(os.listdir(profile_dir))
+    stats = pstats.Stats(*(os.path.join(profile_dir, name) for name in profile_names))
+    stats.dump_stats(profile_path)
+
+
+# Create the pool of workers which play the games, profiling every worker if
+# given a directory to write profiles to
+def create_pool(jobs, profile_dir=None, profile_players=False):
+    if profile_dir is None:
+        return multiprocessing.Pool(processes=jobs)
+    return multiprocessing.Pool(
+        processes=jobs,
+        initializer=start_worker_profile,
+        initargs=(profile_dir, profile_players),
+    )
+
+
+# Choose how many games each task handed to the pool should play, so that
+# there are enough chunks to keep every job busy without paying the pool's
+# overhead for every single game; chunks whose games are interleaved grow with
+# the number of games interleaved at once
+def get_chunk_size(num_games, jobs, concurrency=None):
+    max_chunk_size = MAX_GAMES_PER_CHUNK * (concurrency or 1)
+    return max(1, min(max_chunk_size, num_games // (jobs * 4)))
+
+
+# Run all games; finished games are tallied as they stream in, so memory use
+# does not grow with the number of games. Given a confidence, games stop as
+# soon as a sequential test decides which of the first two players wins more
+# often, and the games still in flight are cancelled
+def run_games(
+    num_games,
+    players,
+    jobs=None,
+    output_format="text",
+    seed=None,
+    concurrency=None,
+    timeout=None,
+    measure=False,
+    metrics_path=None,
+    profile_path=None,
+    profile_players=False,
+    trace_path=None,
+    confidence=None,
+):
+    if trace_path and len(BASE_DECK) > MAX_TRACE_CARDS:
+        raise ValueError(
+            "game traces support decks of at most {} cards".format(MAX_TRACE_CARDS)
+        )
+    jobs = jobs or os.cpu_count() or 1
+    chunk_size = get_chunk_size(num_games, jobs, concurrency)
+    chunks = get_game_chunks(num_games, chunk_size)
+    max_in_flight = jobs * CHUNKS_IN_FLIGHT_PER_JOB
+
+    metrics = {} if measure or metrics_path else None
+    sequential_test = None
+    if confidence:
+        sequential_test = create_sequential_test(players, confidence)
+
+    with contextlib.ExitStack() as stack:
+        stack.callback(close_fork_servers)
+        profile_dir = None
+        if profile_path:
+            profile_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        trace_file = None
+        if trace_path:
+            trace_file = stack.enter_context(open(trace_path, "wb"))
+            write_trace_header(trace_file)
+        pool = stack.enter_context(create_pool(jobs, profile_dir, profile_players))
+        games = get_finished_games(
+            pool,
+            chunks,
+            players,
+            max_in_flight,
+            seed,
+            concurrency,
+            timeout,
+            metrics,
+            trace_file,
+        )
+        if sequential_test:
+            games = stop_early(games, sequential_test)
+        print_player_wins(write_game_stats(games, output_format), output_format)
+        if sequential_test and sequential_test["winner"] and not profile_dir:
+            # The chunks still in flight are no longer needed
+            pool.terminate()
+        else:
+            # Let workers exit on their own (rather than terminating them), so
+            # that they have the chance to write their profiles
+            pool.close()
+        pool.join()
+        if profile_dir:
+            merge_profiles(profile_dir, profile_path)
+
+    if sequential_test:
+        print_sequential_test(sequential_test, output_format)
+    if metrics is not None:
+        print_player_metrics(metrics, output_format)
+        if metrics_path:
+            write_player_metrics(metrics, metrics_path)
+
+
+# Create list of players from the list of player program paths (or Python
+# player references); only the programs among the given session programs use
+# the session protocol (which Python players never do), and only Python
+# scripts not using the session protocol are run from fork servers
+def create_players(programs, session=(), fork_server=False):
     players = []
 
     for p, program in enumerate(programs):
-        players.append({"program": program, "wins": 0, "id": "P{}".format(p + 1)})
+        plugin = is_player_plugin(program)
+        players.append(
+            {
+                "program": program,
+                "wins": 0,
+                "id": "P{}".format(p + 1),
+                "session": program in session and not plugin,
+                "plugin": plugin,
+                "fork_server": fork_server
+                and program not in session
+                and not plugin
+                and is_python_script(program),
+            }
+        )
 
     return players
 
 
 def main():
+    # Subcommands (such as "toac analyze") are run by their own modules, which
+    # are only imported when needed
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMAND_MODULES:
+        subcommand = importlib.import_module(SUBCOMMAND_MODULES[sys.argv[1]])
+        subcommand.main(sys.argv[2:])
+        return
     cli_args = parse_cli_args()
-    players = create_players(cli_args.programs)
-    run_games(cli_args.num_games, players)
+    players = create_players(
+        cli_args.programs, session=cli_args.session, fork_server=cli_args.fork_server
+    )
+    run_games(
+        cli_args.num_games,
+        players,
+        jobs=cli_args.jobs,
+        output_format=cli_args.format,
+        seed=cli_args.seed,
+        concurrency=cli_args.concurrency,
+        timeout=cli_args.timeout,
+        measure=cli_args.metrics,
+        metrics_path=cli_args.metrics_output,
+        profile_path=cli_args.profile,
+        profile_players=cli_args.profile_players,
+        trace_path=cli_args.trace,
+        confidence=cli_args.confidence,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,366 @@
+import argparse
+import collections
+import itertools
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import socket
+import threading
+import time
+
+import toac.dealer as dealer
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 5310
+DEFAULT_CHUNK_SIZE = 50
+DEFAULT_LEASE_TIMEOUT = 300.0
+# How long workers wait before asking again when every remaining chunk is
+# leased to another worker, and how often the coordinator checks for expired
+# leases while waiting for results
+WAIT_INTERVAL = 0.5
+AUTHKEY_ENV_VAR = "TOAC_AUTHKEY"
+
+
+# Parse command-line arguments passed to distributed program (as
+# "toac distributed")
+def parse_cli_args(args=None):
+    parser = argparse.ArgumentParser(
+        prog="toac distributed",
+        description="Play games across many machines: a coordinator hands out "
+        "chunks of games to workers which connect to it over TCP.",
+    )
+    parser.add_argument(
+        "--authkey",
+        default=os.environ.get(AUTHKEY_ENV_VAR),
+        help="the secret shared by the coordinator and its workers (default: "
+        "the {} environment variable)".format(AUTHKEY_ENV_VAR),
+    )
+    subparsers = parser.add_subparsers(dest="role", required=True)
+
+    coordinator_parser = subparsers.add_parser(
+        "coordinator", help="hand out games to workers and tally their results"
+    )
+    coordinator_parser.add_argument(
+        "num_games", metavar="ngames", type=int, help="the number of games to play"
+    )
+    coordinator_parser.add_argument(
+        "programs",
+        metavar="program",
+        nargs="+",
+        help="one or more player programs (which must exist on every worker's "
+        "machine), or Python players",
+    )
+    coordinator_parser.add_argument(
+        "--address",
+        default="{}:{}".format(DEFAULT_HOST, DEFAULT_PORT),
+        help="the host and port to listen on (default: %(default)s)",
+    )
+    coordinator_parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help="the number of games leased to a worker at once",
+    )
+    coordinator_parser.add_argument(
+        "--lease-timeout",
+        type=float,
+        default=DEFAULT_LEASE_TIMEOUT,
+        help="how many seconds a worker has to finish a chunk before it is "
+        "handed to another worker",
+    )
+    coordinator_parser.add_argument(
+        "--format",
+        choices=dealer.OUTPUT_FORMATS,
+        default="text",
+        help="how to output statistics for each game (as for toac)",
+    )
+    coordinator_parser.add_argument(
+        "--seed", type=int, help="shuffle every deck based on this seed"
+    )
+    coordinator_parser.add_argument(
+        "--session",
+        action="append",
+        default=[],
+        metavar="PROGRAM",
+        help="speak the session protocol with this player program (as for toac)",
+    )
+
+    worker_parser = subparsers.add_parser(
+        "worker", help="connect to a coordinator and play the games it hands out"
+    )
+    worker_parser.add_argument(
+        "address", help="the host and port of the coordinator, as host:port"
+    )
+    worker_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="the number of chunks to play at once (default: the number of CPUs)",
+    )
+
+    cli_args = parser.parse_args(args)
+    if not cli_args.authkey:
+        parser.error("an authkey is required (--authkey or {})".format(AUTHKEY_ENV_VAR))
+    return cli_args
+
+
+# Parse an address given as host:port (or just :port, for the default host)
+def parse_address(address):
+    host, _, port = address.rpartition(":")
+    return host or DEFAULT_HOST, int(port)
+
+
+# Hands out leases on chunks of games to workers and collects the finished
+# games; the chunks leased to a worker which disconnects, or whose lease
+# expires, are queued to be handed out again, and only the first result for
+# every chunk is kept. Every method may be called from any thread
+class Coordinator:
+    def __init__(
+        self, num_games, players, seed=None, chunk_size=None, lease_timeout=None
+    ):
+        self.settings = {"players": players, "seed": seed}
+        chunks = dealer.get_game_chunks(num_games, chunk_size or DEFAULT_CHUNK_SIZE)
+        self.pending_chunks = collections.deque(chunks)
+        self.num_unfinished_chunks = len(self.pending_chunks)
+        self.lease_timeout = lease_timeout or DEFAULT_LEASE_TIMEOUT
+        # Leases by ID, as (chunk, worker ID, expiry time)
+        self.leases = {}
+        self.lease_ids = itertools.count(1)
+        self.finished_chunks = set()
+        self.finished_games = queue.Queue()
+        self.lock = threading.Lock()
+
+    # Lease the next pending chunk of games to a worker, retrieving the lease
+    # ID and the chunk's range of game IDs; retrieves None if every pending
+    # chunk is leased (and the worker should ask again later)
+    def lease_chunk(self, worker_id):
+        with self.lock:
+            self.expire_leases()
+            if not self.pending_chunks:
+                return None
+            chunk = self.pending_chunks.popleft()
+            lease_id = next(self.lease_ids)
+            expiry_time = time.monotonic() + self.lease_timeout
+            self.leases[lease_id] = (chunk, worker_id, expiry_time)
+            return lease_id, chunk.start, chunk.stop
+
+    # Record the finished games of a leased chunk; results for chunks which
+    # were already finished by another worker (after a lease expired) are
+    # ignored
+    def finish_chunk(self, lease_id, games):
+        with self.lock:
+            lease = self.leases.pop(lease_id, None)
+            chunk = (
+                range(games[0]["id"], games[-1]["id"] + 1)
+                if lease is None
+                else lease[0]
+            )
+            if chunk.start in self.finished_chunks:
+                return
+            self.finished_chunks.add(chunk.start)
+            self.num_unfinished_chunks -= 1
+            # A chunk whose expired lease was re-queued need not be played again
+            if chunk in self.pending_chunks:
+                self.pending_chunks.remove(chunk)
+        self.finished_games.put(games)
+
+    # Queue every chunk leased to a worker to be handed out again (as when
+    # the worker disconnects)
+    def release_worker(self, worker_id):
+        with self.lock:
+            self.requeue_leases(
+                lease_id
+                for lease_id, (_, lease_worker_id, _) in self.leases.items()
+                if lease_worker_id == worker_id
+            )
+
+    # Queue every chunk whose lease has expired to be handed out again; the
+    # lock must be held
+    def expire_leases(self):
+        now = time.monotonic()
+        self.requeue_leases(
+            lease_id
+            for lease_id, (_, _, expiry_time) in self.leases.items()
+            if expiry_time <= now
+        )
+
+    # Revoke the given leases, queueing their chunks to be handed out again
+    # before any other pending chunks (in order of their game IDs); the lock
+    # must be held
+    def requeue_leases(self, lease_ids):
+        chunks = [self.leases.pop(lease_id)[0] for lease_id in list(lease_ids)]
+        chunks.sort(key=lambda chunk: chunk.start, reverse=True)
+        self.pending_chunks.extendleft(chunks)
+
+    # Determine if every chunk of games has finished
+    def is_finished(self):
+        with self.lock:
+            return self.num_unfinished_chunks == 0
+
+    # Wait briefly for the next chunk of games to finish, retrieving its games
+    # (or none, after checking for expired leases)
+    def get_next_games(self):
+        try:
+            return self.finished_games.get(timeout=WAIT_INTERVAL)
+        except queue.Empty:
+            with self.lock:
+                self.expire_leases()
+            return []
+
+    # A generator which yields every finished game as its chunk finishes,
+    # until every game has finished
+    def get_finished_games(self):
+        while not self.is_finished() or not self.finished_games.empty():
+            yield from self.get_next_games()
+
+
+# Answer a connected worker's requests until it disconnects, at which point
+# any chunks still leased to it are handed out again
+def handle_worker(coordinator, connection, worker_id):
+    try:
+        while True:
+            message = connection.recv()
+            if message["type"] == "hello":
+                connection.send(coordinator.settings)
+            elif message["type"] == "lease":
+                if coordinator.is_finished():
+                    connection.send({"done": True})
+                    return
+                connection.send({"lease": coordinator.lease_chunk(worker_id)})
+            elif message["type"] == "finish":
+                coordinator.finish_chunk(message["lease"], message["games"])
+                connection.send({"ok": True})
+    except (EOFError, OSError):
+        pass
+    finally:
+        coordinator.release_worker(worker_id)
+        connection.close()
+
+
+# Accept connections from workers (each answered on its own thread) until
+# every game has finished
+def serve_workers(coordinator, listener):
+    with listener:
+        for worker_id in itertools.count(1):
+            try:
+                connection = listener.accept()
+            except (multiprocessing.AuthenticationError, EOFError, OSError):
+                if coordinator.is_finished():
+                    return
+                continue
+            if coordinator.is_finished():
+                connection.close()
+                return
+            threading.Thread(
+                target=handle_worker,
+                args=(coordinator, connection, worker_id),
+                daemon=True,
+            ).start()
+
+
+# Start listening for workers on the given address, serving them from a
+# background thread; retrieves the listener (whose address has the actual
+# port, when listening on port 0)
+def start_coordinator_server(coordinator, address, authkey):
+    listener = multiprocessing.connection.Listener(address, authkey=authkey)
+    threading.Thread(
+        target=serve_workers, args=(coordinator, listener), daemon=True
+    ).start()
+    return listener
+
+
+# Stop serving workers once every game has finished, by connecting to the
+# listener so that it stops waiting for the next worker
+def stop_coordinator_server(listener):
+    host, port = listener.address
+    if host in ("0.0.0.0", ""):
+        host = DEFAULT_HOST
+    try:
+        with socket.create_connection((host, port), timeout=WAIT_INTERVAL):
+            pass
+    except OSError:
+        pass
+
+
+# Play all games on connected workers, outputting statistics for each game as
+# its chunk finishes (as run_games does)
+def run_coordinator(
+    num_games,
+    players,
+    address,
+    authkey,
+    output_format="text",
+    seed=None,
+    chunk_size=None,
+    lease_timeout=None,
+):
+    coordinator = Coordinator(num_games, players, seed, chunk_size, lease_timeout)
+    listener = start_coordinator_server(coordinator, address, authkey)
+    try:
+        games = coordinator.get_finished_games()
+        dealer.print_player_wins(
+            dealer.write_game_stats(games, output_format), output_format
+        )
+    finally:
+        stop_coordinator_server(listener)
+
+
+# Connect to a coordinator and play every chunk of games it hands out, until
+# it has no more games to play (or goes away)
+def run_worker(address, authkey):
+    try:
+        connection = multiprocessing.connection.Client(address, authkey=authkey)
+    except ConnectionRefusedError:
+        return
+    with connection:
+        try:
+            connection.send({"type": "hello"})
+            settings = connection.recv()
+            while True:
+                connection.send({"type": "lease"})
+                reply = connection.recv()
+                if reply.get("done"):
+                    return
+                if reply["lease"] is None:
+                    time.sleep(WAIT_INTERVAL)
+                    continue
+                lease_id, start, stop = reply["lease"]
+                games = dealer.run_game_chunk(
+                    range(start, stop), settings["players"], settings["seed"]
+                )
+                connection.send({"type": "finish", "lease": lease_id, "games": games})
+                connection.recv()
+        except (EOFError, OSError):
+            pass
+
+
+# Run the given number of workers at once, each in its own process
+def run_workers(address, authkey, jobs=None):
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(address, authkey))
+        for _ in range(jobs or os.cpu_count() or 1)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+def main(args=None):
+    cli_args = parse_cli_args(args)
+    authkey = cli_args.authkey.encode("utf-8")
+    if cli_args.role == "worker":
+        run_workers(parse_address(cli_args.address), authkey, jobs=cli_args.jobs)
+        return
+    players = dealer.create_players(cli_args.programs, session=cli_args.session)
+    run_coordinator(
+        cli_args.num_games,
+        players,
+        parse_address(cli_args.address),
+        authkey,
+        output_format=cli_args.format,
+        seed=cli_args.seed,
+        chunk_size=cli_args.chunk_size,
+        lease_timeout=cli_args.lease_timeout,
+    )
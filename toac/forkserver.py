@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+import ast
+import builtins
+import os
+import struct
+import sys
+import traceback
+import types
+
+# Every request and response is a single frame: its size, then its bytes;
+# responses also carry the CPU time (in seconds) and peak memory (RSS, in the
+# units of ru_maxrss) of the forked player, which only its parent can measure
+FRAME_HEADER = struct.Struct("<I")
+RESPONSE_HEADER = struct.Struct("<Idq")
+PLAYER_MODULE_NAME = "toac_fork_server_player"
+MAIN_GUARDS = {"__name__ == '__main__'", "'__main__' == __name__"}
+
+
+# Read exactly the given number of bytes from a file descriptor, retrieving
+# None if it reaches the end of its input first
+def read_exactly(fd, size):
+    chunks = []
+    while size:
+        chunk = os.read(fd, size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+# Write all of the given bytes to a file descriptor
+def write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view) :]
+
+
+# Read every byte from a file descriptor until it reaches the end of its input
+def read_all(fd):
+    chunks = []
+    chunk = os.read(fd, 1 << 16)
+    while chunk:
+        chunks.append(chunk)
+        chunk = os.read(fd, 1 << 16)
+    return b"".join(chunks)
+
+
+# Compile a player script once, so that forked copies of it never parse it
+# again, and determine whether it only plays behind a main guard (so that its
+# top-level code can safely run before any game data arrives)
+def compile_player_script(script_path):
+    with open(script_path, "rb") as script_file:
+        source = script_file.read()
+    tree = ast.parse(source, script_path)
+    guarded = any(
+        isinstance(node, ast.If) and ast.unparse(node.test) in MAIN_GUARDS
+        for node in tree.body
+    )
+    return compile(tree, script_path, "exec"), guarded, tree
+
+
+# Import a player script as a module (whatever its file name), without
+# running it as __main__, so that its own imports only happen once
+def load_player_module(script_path, code):
+    module = types.ModuleType(PLAYER_MODULE_NAME)
+    module.__file__ = script_path
+    sys.modules[PLAYER_MODULE_NAME] = module
+    exec(code, module.__dict__)
+    return module
+
+
+# Run only the top-level imports of a player script which plays as soon as it
+# runs (such as one reading its stdin at the top level), so that forked copies
+# of it at least find its modules already imported
+def import_player_dependencies(script_path, tree):
+    imports = [
+        node for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))
+    ]
+    code = compile(ast.Module(body=imports, type_ignores=[]), script_path, "exec")
+    try:
+        exec(code, {"__name__": PLAYER_MODULE_NAME, "__file__": script_path})
+    except Exception:
+        pass
+
+
+# Load a player script for the fork server: scripts guarded by a main guard
+# are imported once, while any other script (or one which fails to import)
+# is left for every forked copy to run from its compiled code
+def prepare_player(script_path):
+    code, guarded, tree = compile_player_script(script_path)
+    if guarded:
+        try:
+            return code, load_player_module(script_path, code)
+        except Exception:
+            traceback.print_exc()
+    import_player_dependencies(script_path, tree)
+    return code, None
+
+
+# Run the player script in a forked child whose stdin and stdout have been
+# replaced, exactly as if the script had been executed: the main() of an
+# imported script is called if it has one, and otherwise the whole script is
+# run as __main__
+def run_player(code, module, script_path):
+    sys.argv = [script_path]
+    sys.stdin = open(0, "r", closefd=False)
+    sys.stdout = open(1, "w", closefd=False)
+    status = 0
+    try:
+        if module is not None and callable(getattr(module, "main", None)):
+            module.main()
+        else:
+            main_globals = {
+                "__name__": "__main__",
+                "__file__": script_path,
+                "__builtins__": builtins,
+            }
+            exec(code, main_globals)
+    except SystemExit as error:
+        if isinstance(error.code, int):
+            status = error.code
+        elif error.code is not None:
+            status = 1
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    os._exit(status)
+
+
+# Fork a warmed-up copy of the player for a single request, passing the
+# request to it on stdin and retrieving everything it writes to stdout, along
+# with the resource usage of the copy
+def fork_player(code, module, script_path, request, control_fds):
+    stdin_read_fd, stdin_write_fd = os.pipe()
+    stdout_read_fd, stdout_write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        for fd in (stdin_write_fd, stdout_read_fd, *control_fds):
+            os.close(fd)
+        os.dup2(stdin_read_fd, 0)
+        os.dup2(stdout_write_fd, 1)
+        os.close(stdin_read_fd)
+        os.close(stdout_write_fd)
+        run_player(code, module, script_path)
+    os.close(stdin_read_fd)
+    os.close(stdout_write_fd)
+    # Players read all of their input before writing their guess, so the
+    # request can be written in full before any output is read
+    try:
+        write_all(stdin_write_fd, request)
+    except BrokenPipeError:
+        pass
+    os.close(stdin_write_fd)
+    output = read_all(stdout_read_fd)
+    os.close(stdout_read_fd)
+    _, _, usage = os.wait4(pid, 0)
+    return output, usage
+
+
+# Serve requests (game data as JSON) from the dealer over stdin, answering
+# each with the output of a player forked for it, until stdin is closed
+def serve(script_path):
+    # The dealer's pipes are moved out of the way, so that nothing the player
+    # prints outside of a request can corrupt them
+    control_fds = (os.dup(0), os.dup(1))
+    devnull_fd = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull_fd, 0)
+    os.close(devnull_fd)
+    os.dup2(2, 1)
+    sys.path[0] = os.path.dirname(os.path.abspath(script_path))
+    code, module = prepare_player(script_path)
+
+    control_in_fd, control_out_fd = control_fds
+    while True:
+        header = read_exactly(control_in_fd, FRAME_HEADER.size)
+        if header is None:
+            break
+        (request_size,) = FRAME_HEADER.unpack(header)
+        request = read_exactly(control_in_fd, request_size)
+        if request is None:
+            break
+        output, usage = fork_player(code, module, script_path, request, control_fds)
+        header = RESPONSE_HEADER.pack(
+            len(output), usage.ru_utime + usage.ru_stime, usage.ru_maxrss
+        )
+        write_all(control_out_fd, header + output)
+
+
+def main():
+    serve(sys.argv[1])
+
+
+if __name__ == "__main__":
+    main()
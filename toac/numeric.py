@@ -0,0 +1,17 @@
+# NumPy is an optional dependency (installed with the "numpy" extra), so that
+# the rest of the package stays free of dependencies
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DEFAULT_BATCH_SIZE = 10000
+
+
+# Raises an error explaining how to install NumPy (which the given feature
+# requires) if it is missing
+def require_numpy(feature):
+    if np is None:
+        raise ImportError(
+            "{} requires NumPy; install three-of-a-crime[numpy]".format(feature)
+        )
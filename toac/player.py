@@ -1,9 +1,16 @@
 #!/usr/bin/env python3
 
+import functools
+import importlib
 import itertools
 import json
+import os
 import sys
 
+# When set (as by toac --profile-players), every run of the player is profiled
+# and its stats are written to this directory
+PROFILE_DIR_ENV_VAR = "TOAC_PROFILE_DIR"
+
 
 # Disregards all suspects that are definitely not matches
 def remove_impossible_suspects(cards, base_suspects):
@@ -45,6 +52,59 @@ def get_matches(cards, base_suspects, match_length, previous_guesses):
     return matches
 
 
+# Yields the possible matches for the given sets one at a time in deck order
+# (that of the combinations of the sorted suspects), so that guessing the
+# first of them stops checking combinations as soon as it is found
+def iter_matches(cards, base_suspects, match_length, previous_guesses):
+    base_suspects = set(base_suspects)
+    remove_impossible_suspects(cards, base_suspects)
+    combinations = itertools.combinations(sorted(base_suspects), r=match_length)
+    for combination in map(frozenset, combinations):
+        if combination not in previous_guesses and combination_matches(
+            combination, cards
+        ):
+            yield combination
+
+
+# Imports the module holding every solver engine besides the default one
+# (along with the solver cache and the lookup table), which is only done once
+# one of them is needed, so that a one-shot run of the default player starts
+# up quickly; when this file is run as a script, the toac package is found
+# next to it
+@functools.lru_cache(maxsize=None)
+def import_solver():
+    try:
+        return importlib.import_module("toac.solver")
+    except ImportError:
+        sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        return importlib.import_module("toac.solver")
+
+
+# Guesses the suspects on the eyewitness card when called in-process by the
+# dealer (as the toac.player:guess plugin), which passes its data object as-is
+# rather than as JSON; the data object is left unmodified
+def guess(data):
+    return choose_match(import_solver().Solver.from_data(data).get_matches())
+
+
+# Guesses like guess, but looks up the matches for every game state in a cache
+# shared by every game the process plays (as the toac.player:guess_cached
+# plugin), so that game states which recur (up to a relabeling of suspects)
+# across many games are only ever solved once
+def guess_cached(data):
+    solver = import_solver()
+    return choose_match(
+        solver.get_cached_matches(**data, cache=solver.get_shared_cache())
+    )
+
+
+# Chooses which of the possible matches to guess: the one which comes first in
+# deck order, so that the same game state always produces the same guess
+# (rather than depending on the iteration order of a set)
+def choose_match(matches):
+    return sorted(min(matches, key=sorted))
+
+
 # Transforms JSON data by converting lists (arrays) to sets as appropriate
 def transform_data(data):
     data["base_suspects"] = frozenset(data["base_suspects"])
@@ -53,14 +113,200 @@ def transform_data(data):
     data["previous_guesses"] = frozenset(map(frozenset, data["previous_guesses"]))
 
 
-def main():
+# Retrieves the match to guess from those found by an engine; engines which
+# find matches lazily (like the constraints engine) are not asked for more
+# than the first match, so that they can stop searching early
+def get_first_match(engine, data):
+    matches = engine(**data)
+    if isinstance(matches, (set, frozenset)):
+        return choose_match(matches)
+    return sorted(next(iter(matches)))
+
+
+# Parse command-line arguments passed to player program; argparse is only
+# imported when there are arguments to parse, since importing it takes about
+# as long as the rest of a one-shot run
+def parse_cli_args():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--session",
+        action="store_true",
+        help="answer every turn of a game over newline-delimited JSON",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=("sets", "bitmask", "incremental", "table", "constraints", "lazy"),
+        default="sets",
+        help="the solver engine used to find possible matches",
+    )
+    parser.add_argument(
+        "--table",
+        help="the lookup table used by the table engine (built by toac-table)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="the number of processes among which the lazy engine (and "
+        "--count) splits the candidate matches",
+    )
+    parser.add_argument(
+        "--count",
+        action="store_true",
+        help="write the number of possible matches rather than a guess",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=float,
+        help="cache the matches of game states (up to a relabeling of "
+        "suspects) in at most this many MiB, evicting the least recently used",
+    )
+    parser.add_argument(
+        "--cache-file",
+        help="load the cache from this file, and save it back when done "
+        "(implies a cache)",
+    )
+    parser.add_argument(
+        "--cache-stats",
+        action="store_true",
+        help="write the cache's hit and miss statistics to stderr when done",
+    )
+
+    return parser.parse_args()
+
+
+# Creates the game data accumulated over the course of a session
+def build_session_data():
+    return {
+        "base_suspects": frozenset(),
+        "match_length": 0,
+        "cards": [],
+        "previous_guesses": frozenset(),
+    }
+
+
+# Merges a session message (the initial setup or a per-turn delta) into the
+# game data accumulated so far
+def update_session_data(data, message):
+    if "base_suspects" in message:
+        data["base_suspects"] = frozenset(message["base_suspects"])
+        data["match_length"] = message["match_length"]
+    for card in message["cards"]:
+        data["cards"].append(
+            {
+                "suspects": frozenset(card["suspects"]),
+                "match_count": card["match_count"],
+            }
+        )
+    data["previous_guesses"] = data["previous_guesses"].union(
+        map(frozenset, message["previous_guesses"])
+    )
+
+
+# Answers every turn of a game, reading one JSON message per line and writing
+# one guess per line until the dealer closes the session
+def run_session(engine):
+    data = build_session_data()
+    for line in sys.stdin:
+        update_session_data(data, json.loads(line))
+        match = get_first_match(engine, data)
+        print(json.dumps(match), flush=True)
+
+
+# Answers every turn of a game like run_session, but keeps a single solver
+# for the whole game which each message only narrows down further
+def run_incremental_session():
+    solver = None
+    for line in sys.stdin:
+        message = json.loads(line)
+        if solver is None:
+            solver = import_solver().Solver(
+                message["base_suspects"], message["match_length"]
+            )
+        solver.update(message)
+        match = choose_match(solver.get_matches())
+        print(json.dumps(match), flush=True)
+
+
+# Counts the possible matches for a game state, in parallel across the given
+# number of processes (if any)
+def count_possible_matches(data, jobs=None):
+    solver = import_solver()
+    if jobs:
+        return solver.count_matches_parallel(**data, jobs=jobs)
+    return solver.count_matches(**data)
+
+
+# Read game data from stdin and write the suspects guessed by the given
+# engine to stdout
+def run_one_shot(engine):
     data = json.loads(sys.stdin.read())
     transform_data(data)
-
-    matches = list(get_matches(**data))
-    match = list(matches[0])
+    match = get_first_match(engine, data)
     print(json.dumps(match), end="")
 
 
+# Read game data from stdin and write the guessed suspects to stdout (or
+# speak the session protocol)
+def run_player():
+    # Without any arguments (as the dealer runs one-shot players), neither the
+    # arguments nor the other engines are worth importing anything for, and
+    # only the first match in deck order is needed
+    if len(sys.argv) <= 1:
+        run_one_shot(iter_matches)
+        return
+    cli_args = parse_cli_args()
+    if cli_args.count:
+        data = json.loads(sys.stdin.read())
+        transform_data(data)
+        print(json.dumps(count_possible_matches(data, cli_args.jobs)), end="")
+        return
+    cache = None
+    if cli_args.cache_size or cli_args.cache_file:
+        solver = import_solver()
+        max_bytes = int((cli_args.cache_size or 0) * 2**20)
+        max_bytes = max_bytes or solver.DEFAULT_CACHE_SIZE
+        if cli_args.cache_file:
+            cache = solver.load_cache(cli_args.cache_file, max_bytes)
+        else:
+            cache = solver.create_cache(max_bytes)
+    elif cli_args.session and cli_args.engine == "incremental":
+        run_incremental_session()
+        return
+    if cache is None and cli_args.engine == "sets":
+        engine = get_matches
+    else:
+        engine = import_solver().get_engine(
+            cli_args.engine, table_path=cli_args.table, cache=cache, jobs=cli_args.jobs
+        )
+    if cli_args.session:
+        run_session(engine)
+    else:
+        run_one_shot(engine)
+
+    if cache is not None and cli_args.cache_file:
+        import_solver().save_cache(cache, cli_args.cache_file)
+    if cache is not None and cli_args.cache_stats:
+        print(json.dumps(import_solver().get_cache_stats(cache)), file=sys.stderr)
+
+
+def main():
+    profile_dir = os.environ.get(PROFILE_DIR_ENV_VAR)
+    if not profile_dir:
+        run_player()
+        return
+    import cProfile
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(run_player)
+    finally:
+        profile_path = os.path.join(profile_dir, "player-{}.prof".format(os.getpid()))
+        profiler.dump_stats(profile_path)
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+import argparse
+import functools
+import multiprocessing
+import os
+
+import toac.dealer as dealer
+import toac.numeric as numeric
+from toac.numeric import np
+
+
+# Parse command-line arguments passed to simulation program
+def parse_cli_args():
+    parser = argparse.ArgumentParser(
+        description="Simulate games in which every player uses the bundled "
+        "strategy (toac.player:guess), many games at a time."
+    )
+
+    parser.add_argument(
+        "num_games", metavar="ngames", type=int, help="the number of games to play"
+    )
+    parser.add_argument(
+        "-p",
+        "--players",
+        type=int,
+        default=dealer.DEFAULT_NUM_PLAYERS,
+        help="the number of players in every game",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="the number of batches to play at once (default: the number of CPUs)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=numeric.DEFAULT_BATCH_SIZE,
+        help="the number of games played in lockstep by each batch",
+    )
+    parser.add_argument(
+        "--format",
+        choices=dealer.OUTPUT_FORMATS,
+        default="quiet",
+        help="how to output statistics for each game (as for toac)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="shuffle the deck of every game exactly as toac would with this seed",
+    )
+
+    return parser.parse_args()
+
+
+# Build the matrix of how many suspects every card in the deck shares with
+# every other card
+def get_match_matrix(deck):
+    return np.array(
+        [[len(card & other_card) for other_card in deck] for card in deck],
+        dtype=np.int8,
+    )
+
+
+# Create the shuffled decks for the given games as rows of card indices into
+# BASE_DECK; with a seed, each deck is shuffled exactly as the dealer would
+# shuffle it, while without one all decks are shuffled at once
+def create_decks(game_ids, seed=None):
+    if seed is None:
+        decks = np.tile(np.arange(len(dealer.BASE_DECK)), (len(game_ids), 1))
+        return np.random.default_rng().permuted(decks, axis=1)
+    return np.array(
+        [
+            dealer.create_card_deck(dealer.get_game_random(game_id, seed))
+            for game_id in game_ids
+        ],
+        dtype=np.intp,
+    )
+
+
+# Play every game in a batch in lockstep, following the same rules as
+# dealer.run_game: the last card of each deck is the eyewitness card, cards are
+# drawn from the end of the deck, and players take turns in seat order. Every
+# player guesses the first possible match in deck order (as toac.player:guess
+# does), so only each game's candidates need to be tracked; games are dropped
+# from the batch as soon as they are won. Retrieves the winning seat (or -1)
+# and number of rounds for every game
+def play_batch(decks, num_players, match_matrix):
+    num_games, deck_size = decks.shape
+    eyewitness_cards = decks[:, -1]
+    candidates = np.ones((num_games, deck_size), dtype=bool)
+    winners = np.full(num_games, -1)
+    rounds = np.full(num_games, deck_size - 1)
+    active = np.arange(num_games)
+
+    for turn in range(deck_size - 1):
+        cards = decks[active, -2 - turn]
+        match_counts = match_matrix[cards, eyewitness_cards[active]]
+        candidates[active] &= match_matrix[cards] == match_counts[:, None]
+        guesses = candidates[active].argmax(axis=1)
+        correct = guesses == eyewitness_cards[active]
+        winners[active[correct]] = turn % num_players
+        rounds[active[correct]] = turn + 1
+        # Guesses are never correct once made, so they are no longer candidates
+        candidates[active[~correct], guesses[~correct]] = False
+        active = active[~correct]
+        if not len(active):
+            break
+
+    return winners, rounds
+
+
+# Play a batch of games, retrieving a game object (as dealer.run_game would
+# return) for each
+def simulate_batch(game_ids, num_players, seed=None):
+    decks = create_decks(game_ids, seed)
+    winners, rounds = play_batch(decks, num_players, get_match_matrix(dealer.BASE_DECK))
+    games = []
+    for game_id, winner, game_rounds in zip(
+        game_ids, winners.tolist(), rounds.tolist()
+    ):
+        game = dealer.create_game(game_id)
+        game["winner"] = "P{}".format(winner + 1) if winner >= 0 else None
+        game["rounds"] = game_rounds
+        games.append(game)
+    return games
+
+
+# Simulate all games in batches spread across the given number of jobs,
+# yielding every game as its batch finishes
+def simulate_games(num_games, num_players, seed=None, jobs=None, batch_size=None):
+    numeric.require_numpy("simulation")
+    jobs = jobs or os.cpu_count() or 1
+    batches = dealer.get_game_chunks(
+        num_games, batch_size or numeric.DEFAULT_BATCH_SIZE
+    )
+    play = functools.partial(simulate_batch, num_players=num_players, seed=seed)
+    with multiprocessing.Pool(processes=jobs) as pool:
+        for games in pool.imap(play, batches):
+            yield from games
+
+
+def main():
+    cli_args = parse_cli_args()
+    games = simulate_games(
+        cli_args.num_games,
+        cli_args.players,
+        seed=cli_args.seed,
+        jobs=cli_args.jobs,
+        batch_size=cli_args.batch_size,
+    )
+    dealer.print_player_wins(
+        dealer.write_game_stats(games, cli_args.format), cli_args.format
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,873 @@
+import array
+import collections
+import functools
+import itertools
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+
+import toac.player as player
+
+# Layout of the precompiled lookup table written by toac/table.py: a header
+# (magic, format version, match length, number of cards, number of states and
+# size of the newline-separated suspect names), the suspect names padded to a
+# multiple of 8 bytes, one uint64 candidate mask per state, then one uint16
+# next state per (state, card, match count), all little-endian
+TABLE_MAGIC = b"TOAC-TBL"
+TABLE_VERSION = 1
+TABLE_HEADER = struct.Struct("<8sHHIII")
+NO_TABLE_STATE = 0xFFFF
+# The solver cache holds game states in a canonical form, which is found by
+# trying every order of the suspects it cannot otherwise tell apart; past this
+# many orders, one of them is used as is (which is still correct, but lets
+# fewer relabeled states share an entry)
+MAX_CANONICAL_ORDERS = 720
+DEFAULT_CACHE_SIZE = 64 * 2**20
+# The approximate bookkeeping cost of every cache entry beyond its key and
+# value (the entry in the ordered dict and its links)
+CACHE_ENTRY_OVERHEAD = 100
+CACHE_VERSION = 1
+# The number of candidate matches checked by each process at a time when
+# candidates are checked in parallel
+DEFAULT_SHARD_SIZE = 2**16
+
+
+# Assigns every suspect its own bit so that sets of suspects can be stored as
+# integers
+def get_suspect_bits(base_suspects):
+    return {suspect: 1 << s for s, suspect in enumerate(sorted(base_suspects))}
+
+
+# Converts a collection of suspects to an integer bitmask; suspects without a
+# bit are ignored, since they can never be part of a match
+def get_suspects_mask(suspects, suspect_bits):
+    mask = 0
+    for suspect in suspects:
+        mask |= suspect_bits.get(suspect, 0)
+    return mask
+
+
+# Converts an integer bitmask back to the set of suspects it represents
+def get_mask_suspects(mask, suspects_by_bit):
+    suspects = []
+    while mask:
+        bit = mask & -mask
+        suspects.append(suspects_by_bit[bit])
+        mask ^= bit
+    return frozenset(suspects)
+
+
+# Counts the number of set bits in an integer (int.bit_count needs Python 3.10)
+if hasattr(int, "bit_count"):
+    count_bits = int.bit_count
+else:
+
+    def count_bits(mask):
+        return bin(mask).count("1")
+
+
+# Retrieves set of bitmasks for all possible matches, given the bits assigned
+# to the (possible) suspects
+def get_match_masks(cards, suspect_bits, match_length, previous_guesses):
+    combinations = itertools.combinations(suspect_bits.values(), r=match_length)
+    matches = list(map(sum, combinations))
+
+    # Narrow down the candidates one card at a time, so that later cards only
+    # need to be checked against the combinations which survived earlier ones
+    for card in cards:
+        card_mask = get_suspects_mask(card["suspects"], suspect_bits)
+        match_count = card["match_count"]
+        matches = [
+            combination
+            for combination in matches
+            if count_bits(combination & card_mask) == match_count
+        ]
+
+    # A guess naming a suspect without a bit can never equal a match
+    guess_masks = {
+        get_suspects_mask(guess, suspect_bits)
+        for guess in previous_guesses
+        if all(suspect in suspect_bits for suspect in guess)
+    }
+    return set(matches) - guess_masks
+
+
+# Retrieves the same set of matches as get_matches, but represents cards,
+# guesses and candidates as integer bitmasks while solving
+def get_matches_bitmask(cards, base_suspects, match_length, previous_guesses):
+    base_suspects = set(base_suspects)
+    player.remove_impossible_suspects(cards, base_suspects)
+    suspect_bits = get_suspect_bits(base_suspects)
+    match_masks = get_match_masks(cards, suspect_bits, match_length, previous_guesses)
+    suspects_by_bit = {bit: suspect for suspect, bit in suspect_bits.items()}
+    return {get_mask_suspects(mask, suspects_by_bit) for mask in match_masks}
+
+
+# Holds the set of matches which agree with every card and guess seen so far,
+# so that each new card or guess only has to narrow down the survivors rather
+# than re-checking every combination against every card
+class Solver:
+    def __init__(self, base_suspects, match_length):
+        self.suspect_bits = get_suspect_bits(base_suspects)
+        self.suspects_by_bit = {
+            bit: suspect for suspect, bit in self.suspect_bits.items()
+        }
+        combinations = itertools.combinations(self.suspect_bits.values(), match_length)
+        self.candidates = set(map(sum, combinations))
+
+    # Builds a solver from a full data payload (as produced by transform_data)
+    @classmethod
+    def from_data(cls, data):
+        solver = cls(data["base_suspects"], data["match_length"])
+        solver.update(data)
+        return solver
+
+    # Narrows the candidates by the cards and guesses in a data payload, which
+    # may be either the full game state or only what changed since last time
+    def update(self, data):
+        for card in data["cards"]:
+            self.add_card(card["suspects"], card["match_count"])
+        for guess in data["previous_guesses"]:
+            self.add_guess(guess)
+
+    # Keeps only the candidates sharing exactly match_count suspects with card
+    def add_card(self, suspects, match_count):
+        card_mask = get_suspects_mask(suspects, self.suspect_bits)
+        self.candidates = {
+            combination
+            for combination in self.candidates
+            if count_bits(combination & card_mask) == match_count
+        }
+
+    # Discards a guess, since a guess which was made is known to be incorrect
+    def add_guess(self, guess):
+        if all(suspect in self.suspect_bits for suspect in guess):
+            self.candidates.discard(get_suspects_mask(guess, self.suspect_bits))
+
+    # Retrieves the set of all possible matches as sets of suspects
+    def get_matches(self):
+        return {
+            get_mask_suspects(mask, self.suspects_by_bit) for mask in self.candidates
+        }
+
+
+# Retrieves all possible matches by building an incremental solver from
+# scratch, for callers with no solver state carried over from earlier turns
+def get_matches_incremental(cards, base_suspects, match_length, previous_guesses):
+    solver = Solver(base_suspects, match_length)
+    solver.update({"cards": cards, "previous_guesses": previous_guesses})
+    return solver.get_matches()
+
+
+# Narrows down which suspects must be (True) or cannot be (False) on the
+# eyewitness card, given constraints which each require exactly some number
+# of the suspects (as indices) they name to be on it; this repeats until
+# nothing more can be deduced, retrieving None if the constraints conflict
+def propagate_constraints(constraints, assignment):
+    assignment = list(assignment)
+    changed = True
+    while changed:
+        changed = False
+        for suspects, match_count in constraints:
+            num_matches = 0
+            unknown_suspects = []
+            for suspect in suspects:
+                if assignment[suspect] is None:
+                    unknown_suspects.append(suspect)
+                elif assignment[suspect]:
+                    num_matches += 1
+            num_possible_matches = num_matches + len(unknown_suspects)
+            if num_matches > match_count or num_possible_matches < match_count:
+                return None
+            if unknown_suspects and match_count in (num_matches, num_possible_matches):
+                # Either every remaining suspect is needed or none of them are
+                value = num_matches < match_count
+                for suspect in unknown_suspects:
+                    assignment[suspect] = value
+                changed = True
+    return assignment
+
+
+# Chooses the suspect to branch on next, taken from the card constraint with
+# the fewest undecided suspects; retrieves None once every card is decided
+def choose_branch_suspect(card_constraints, assignment):
+    branch_suspects = None
+    for suspects, _ in card_constraints:
+        unknown_suspects = [s for s in suspects if assignment[s] is None]
+        if unknown_suspects and (
+            branch_suspects is None or len(unknown_suspects) < len(branch_suspects)
+        ):
+            branch_suspects = unknown_suspects
+    return branch_suspects[0] if branch_suspects else None
+
+
+# Yields every solution (as a tuple of suspect indices) to the constraints by
+# backtracking search, propagating what each decision implies before making
+# the next one; suspects named by no card are only enumerated at the very end
+def iter_constraint_solutions(constraints, card_constraints, assignment, match_length):
+    assignment = propagate_constraints(constraints, assignment)
+    if assignment is None:
+        return
+    branch_suspect = choose_branch_suspect(card_constraints, assignment)
+    if branch_suspect is None:
+        matches = tuple(s for s, value in enumerate(assignment) if value)
+        free_suspects = [s for s, value in enumerate(assignment) if value is None]
+        for combination in itertools.combinations(
+            free_suspects, match_length - len(matches)
+        ):
+            yield matches + combination
+        return
+    for value in (True, False):
+        branch_assignment = list(assignment)
+        branch_assignment[branch_suspect] = value
+        yield from iter_constraint_solutions(
+            constraints, card_constraints, branch_assignment, match_length
+        )
+
+
+# Yields every solution to the constraints like iter_constraint_solutions,
+# but in deck order: every suspect is decided in turn (trying it as a match
+# first) for as long as any card is undecided, and choices which leave no
+# solution are ruled out by the faster search of iter_constraint_solutions
+def iter_ordered_constraint_solutions(
+    constraints, card_constraints, assignment, match_length
+):
+    assignment = propagate_constraints(constraints, assignment)
+    if assignment is None:
+        return
+    solutions = iter_constraint_solutions(
+        constraints, card_constraints, assignment, match_length
+    )
+    if next(solutions, None) is None:
+        return
+    if choose_branch_suspect(card_constraints, assignment) is None:
+        # Only suspects named by no undecided card are left, and combinations
+        # of them come in deck order
+        matches = tuple(s for s, value in enumerate(assignment) if value)
+        free_suspects = [s for s, value in enumerate(assignment) if value is None]
+        for combination in itertools.combinations(
+            free_suspects, match_length - len(matches)
+        ):
+            yield matches + combination
+        return
+    branch_suspect = assignment.index(None)
+    for value in (True, False):
+        branch_assignment = list(assignment)
+        branch_assignment[branch_suspect] = value
+        yield from iter_ordered_constraint_solutions(
+            constraints, card_constraints, branch_assignment, match_length
+        )
+
+
+# Converts cards to constraints over suspect indices; suspects outside of the
+# base suspects are ignored, since they can never be matches
+def build_card_constraints(cards, suspect_indices):
+    return [
+        (
+            [suspect_indices[s] for s in card["suspects"] if s in suspect_indices],
+            card["match_count"],
+        )
+        for card in cards
+    ]
+
+
+# Yields every possible match by treating every card as a constraint on how
+# many of its suspects are matches, rather than by checking every combination
+# of suspects; this stays fast for games with many suspects, and since it
+# yields matches lazily and in deck order, callers needing only one match can
+# stop early (and still guess the match choose_match would)
+def iter_matches_constraints(cards, base_suspects, match_length, previous_guesses):
+    suspects = sorted(base_suspects)
+    suspect_indices = {suspect: s for s, suspect in enumerate(suspects)}
+    card_constraints = build_card_constraints(cards, suspect_indices)
+    constraints = card_constraints + [(range(len(suspects)), match_length)]
+    assignment = [None] * len(suspects)
+
+    for solution in iter_ordered_constraint_solutions(
+        constraints, card_constraints, assignment, match_length
+    ):
+        match = frozenset(suspects[s] for s in solution)
+        if match not in previous_guesses:
+            yield match
+
+
+# Retrieves the suspects which could be on the eyewitness card, in the
+# canonical order used to number the candidate matches
+def get_candidate_suspects(cards, base_suspects):
+    base_suspects = set(base_suspects)
+    player.remove_impossible_suspects(cards, base_suspects)
+    return sorted(base_suspects)
+
+
+# Retrieves how many candidate matches (combinations of the possible suspects)
+# there are, which is one more than the highest index of a candidate
+def count_candidates(cards, base_suspects, match_length):
+    return math.comb(len(get_candidate_suspects(cards, base_suspects)), match_length)
+
+
+# Retrieves the indices of the items of the combination with the given index,
+# where combinations are numbered in the order itertools.combinations yields
+# them
+def unrank_combination(index, num_items, length):
+    indices = []
+    item = 0
+    for remaining_length in range(length, 0, -1):
+        # Skip every combination beginning with an item which comes too early
+        num_combinations = math.comb(num_items - item - 1, remaining_length - 1)
+        while index >= num_combinations:
+            index -= num_combinations
+            item += 1
+            num_combinations = math.comb(num_items - item - 1, remaining_length - 1)
+        indices.append(item)
+        item += 1
+    return indices
+
+
+# Yields every combination of items from the one with the given item indices
+# onwards, in the order itertools.combinations yields them; all but the first
+# few are yielded by itertools.combinations itself
+def iter_combinations_from(items, indices):
+    if not indices:
+        yield ()
+        return
+    first_index, *other_indices = indices
+    for combination in iter_combinations_from(items, other_indices):
+        yield (items[first_index], *combination)
+    for item_index in range(first_index + 1, len(items)):
+        for combination in itertools.combinations(
+            items[item_index + 1 :], len(other_indices)
+        ):
+            yield (items[item_index], *combination)
+
+
+# Yields the bitmask of every possible match whose candidate index lies in the
+# given range, in deck order; the suspects_by_bit dictionary is filled in so
+# that the bitmasks can be converted back to suspects
+def iter_match_masks(
+    cards, base_suspects, match_length, previous_guesses, start, stop, suspects_by_bit
+):
+    suspects = get_candidate_suspects(cards, base_suspects)
+    if stop is None:
+        stop = math.comb(len(suspects), match_length)
+    if start >= stop:
+        return
+    suspect_bits = get_suspect_bits(suspects)
+    suspects_by_bit.update((bit, suspect) for suspect, bit in suspect_bits.items())
+    card_masks = [
+        (get_suspects_mask(card["suspects"], suspect_bits), card["match_count"])
+        for card in cards
+    ]
+    guess_masks = {
+        get_suspects_mask(guess, suspect_bits)
+        for guess in map(frozenset, previous_guesses)
+        if guess.issubset(suspect_bits)
+    }
+    combinations = iter_combinations_from(
+        list(suspect_bits.values()),
+        unrank_combination(start, len(suspects), match_length),
+    )
+    for mask in map(sum, itertools.islice(combinations, stop - start)):
+        for card_mask, match_count in card_masks:
+            if count_bits(mask & card_mask) != match_count:
+                break
+        else:
+            if mask not in guess_masks:
+                yield mask
+
+
+# Yields the same matches as get_matches, but lazily and in deck order (so
+# that the first match yielded is the one choose_match would choose); only the
+# candidates whose indices lie in range(start, stop) are checked, so that the
+# candidates can be split among several processes
+def iter_matches(
+    cards, base_suspects, match_length, previous_guesses, start=0, stop=None
+):
+    suspects_by_bit = {}
+    for mask in iter_match_masks(
+        cards,
+        base_suspects,
+        match_length,
+        previous_guesses,
+        start,
+        stop,
+        suspects_by_bit,
+    ):
+        yield get_mask_suspects(mask, suspects_by_bit)
+
+
+# Counts the possible matches whose candidate indices lie in range(start,
+# stop), without creating a set of suspects for any of them
+def count_matches(
+    cards, base_suspects, match_length, previous_guesses, start=0, stop=None
+):
+    masks = iter_match_masks(
+        cards, base_suspects, match_length, previous_guesses, start, stop, {}
+    )
+    return sum(1 for _ in masks)
+
+
+# Splits the candidate matches of a game state into shards (ranges of
+# candidate indices) of at most the given size
+def get_candidate_shards(cards, base_suspects, match_length, shard_size):
+    num_candidates = count_candidates(cards, base_suspects, match_length)
+    return [
+        range(start, min(start + shard_size, num_candidates))
+        for start in range(0, num_candidates, shard_size)
+    ]
+
+
+# Retrieves the possible matches in the given shard of a game state's
+# candidates (as run by each process of iter_matches_parallel)
+def get_shard_matches(data, shard):
+    return list(iter_matches(**data, start=shard.start, stop=shard.stop))
+
+
+# Counts the possible matches in the given shard of a game state's candidates
+# (as run by each process of count_matches_parallel)
+def count_shard_matches(data, shard):
+    return count_matches(**data, start=shard.start, stop=shard.stop)
+
+
+# Creates a pool of processes for checking shards of candidates in parallel;
+# multiprocessing is only imported when needed, since importing it would
+# otherwise slow down every run of the player program
+def create_shard_pool(jobs):
+    import multiprocessing
+
+    return multiprocessing.Pool(processes=jobs or os.cpu_count() or 1)
+
+
+# Yields the same matches as iter_matches, but checks shards of the
+# candidates in parallel across the given number of processes; the matches
+# are still yielded in deck order, and no more shards are checked once the
+# caller stops asking for matches
+def iter_matches_parallel(
+    cards,
+    base_suspects,
+    match_length,
+    previous_guesses,
+    jobs=None,
+    shard_size=DEFAULT_SHARD_SIZE,
+):
+    data = {
+        "cards": cards,
+        "base_suspects": base_suspects,
+        "match_length": match_length,
+        "previous_guesses": previous_guesses,
+    }
+    shards = get_candidate_shards(cards, base_suspects, match_length, shard_size)
+    with create_shard_pool(jobs) as pool:
+        yield from itertools.chain.from_iterable(
+            pool.imap(functools.partial(get_shard_matches, data), shards)
+        )
+
+
+# Counts the possible matches like count_matches, but counts shards of the
+# candidates in parallel across the given number of processes
+def count_matches_parallel(
+    cards,
+    base_suspects,
+    match_length,
+    previous_guesses,
+    jobs=None,
+    shard_size=DEFAULT_SHARD_SIZE,
+):
+    data = {
+        "cards": cards,
+        "base_suspects": base_suspects,
+        "match_length": match_length,
+        "previous_guesses": previous_guesses,
+    }
+    shards = get_candidate_shards(cards, base_suspects, match_length, shard_size)
+    with create_shard_pool(jobs) as pool:
+        return sum(
+            pool.imap_unordered(functools.partial(count_shard_matches, data), shards)
+        )
+
+
+# Retrieves every possible card (and match) for the given suspects in the
+# canonical order used to number them
+def get_deck(base_suspects, match_length):
+    combinations = itertools.combinations(sorted(base_suspects), r=match_length)
+    return list(map(frozenset, combinations))
+
+
+# Retrieves where the lookup table is written and read by default: in the
+# user's cache directory (following the XDG convention), since the package's
+# own directory may be read-only or shared between environments
+def get_default_table_path():
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache_dir, "toac", "table.bin")
+
+
+# Rounds a byte count up to the next multiple of 8
+def get_padded_size(size):
+    return (size + 7) // 8 * 8
+
+
+# Loads a precompiled lookup table by memory-mapping it, so that only the
+# parts of it which are looked up are ever read; retrieves None if the table
+# is missing or was written in a different format version
+@functools.lru_cache(maxsize=None)
+def load_table(path):
+    try:
+        with open(path, "rb") as table_file:
+            buffer = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):
+        return None
+    if len(buffer) < TABLE_HEADER.size:
+        return None
+    header = TABLE_HEADER.unpack_from(buffer)
+    magic, version, match_length, num_cards, num_states, suspects_size = header
+    if magic != TABLE_MAGIC or version != TABLE_VERSION:
+        return None
+
+    masks_offset = TABLE_HEADER.size + get_padded_size(suspects_size)
+    transitions_offset = masks_offset + num_states * 8
+    view = memoryview(buffer)
+    suspects_end = TABLE_HEADER.size + suspects_size
+    base_suspects = bytes(view[TABLE_HEADER.size : suspects_end]).decode("utf-8")
+    masks = view[masks_offset:transitions_offset].cast("Q")
+    transitions = view[transitions_offset:].cast("H")
+    if sys.byteorder != "little":
+        masks = array.array("Q", masks)
+        masks.byteswap()
+        transitions = array.array("H", transitions)
+        transitions.byteswap()
+
+    base_suspects = base_suspects.split("\n")
+    deck = get_deck(base_suspects, match_length)
+    return {
+        "base_suspects": frozenset(base_suspects),
+        "match_length": match_length,
+        "deck": deck,
+        "card_indices": {card: c for c, card in enumerate(deck)},
+        "masks": masks,
+        "transitions": transitions,
+    }
+
+
+# Follows the table's transitions for every drawn card, retrieving the mask
+# of candidates (numbered by the table's deck) or None if the cards lead to a
+# state which is not in the table
+def get_table_mask(table, cards):
+    num_cards = len(table["deck"])
+    num_match_counts = table["match_length"] + 1
+    state = 0
+    for card in cards:
+        card_index = table["card_indices"].get(frozenset(card["suspects"]))
+        match_count = card["match_count"]
+        if card_index is None or not 0 <= match_count < num_match_counts:
+            return None
+        transition = (state * num_cards + card_index) * num_match_counts
+        state = table["transitions"][transition + match_count]
+        if state == NO_TABLE_STATE:
+            return None
+    return table["masks"][state]
+
+
+# Retrieves all possible matches by looking up the drawn cards in a
+# precompiled table, solving live instead if the table is missing or does not
+# cover the given game
+def get_matches_table(cards, base_suspects, match_length, previous_guesses, table):
+    mask = None
+    if (
+        table is not None
+        and table["match_length"] == match_length
+        and table["base_suspects"] == frozenset(base_suspects)
+    ):
+        mask = get_table_mask(table, cards)
+    if mask is None:
+        return player.get_matches(cards, base_suspects, match_length, previous_guesses)
+
+    matches = {card for c, card in enumerate(table["deck"]) if mask >> c & 1}
+    player.remove_guesses_from_matches(matches, previous_guesses)
+    return matches
+
+
+# Converts a game state to the items which relate its suspects (numbered by
+# their sorted order): every card, labeled with its match count, and every
+# distinct guess which could still be a match, labeled with -1
+def get_state_items(cards, suspect_indices, match_length, previous_guesses):
+    items = [
+        (
+            card["match_count"],
+            tuple(
+                sorted(
+                    suspect_indices[suspect]
+                    for suspect in card["suspects"]
+                    if suspect in suspect_indices
+                )
+            ),
+        )
+        for card in cards
+    ]
+    guesses = {
+        tuple(sorted(suspect_indices[suspect] for suspect in guess))
+        for guess in map(frozenset, previous_guesses)
+        if len(guess) == match_length
+        and all(suspect in suspect_indices for suspect in guess)
+    }
+    items.extend((-1, guess) for guess in sorted(guesses))
+    return items
+
+
+# Colors every suspect by repeatedly refining its color with the colors of the
+# items it appears in (and those items' other suspects), until no color class
+# splits any further; colors only depend on the structure of the game state,
+# so relabeling the suspects of a state relabels their colors alike
+def refine_suspect_colors(num_suspects, items):
+    incidence = [[] for _ in range(num_suspects)]
+    for i, (_, members) in enumerate(items):
+        for suspect in members:
+            incidence[suspect].append(i)
+    # Start from the labels of the items every suspect appears in, which
+    # already tells most suspects apart
+    signatures = [
+        tuple(sorted(items[i][0] for i in incidence[suspect]))
+        for suspect in range(num_suspects)
+    ]
+    palette = {
+        signature: color for color, signature in enumerate(sorted(set(signatures)))
+    }
+    colors = [palette[signature] for signature in signatures]
+    num_colors = len(palette)
+    while num_colors < num_suspects:
+        item_colors = [
+            (label, tuple(sorted(colors[suspect] for suspect in members)))
+            for label, members in items
+        ]
+        signatures = [
+            (colors[suspect], tuple(sorted(item_colors[i] for i in incidence[suspect])))
+            for suspect in range(num_suspects)
+        ]
+        palette = {
+            signature: color for color, signature in enumerate(sorted(set(signatures)))
+        }
+        colors = [palette[signature] for signature in signatures]
+        if len(palette) == num_colors:
+            break
+        num_colors = len(palette)
+    return colors, incidence
+
+
+# Retrieves every order of the suspects worth trying for the canonical form:
+# suspects are ordered by color, and only suspects of the same color which
+# appear in different items need to be tried in every order (suspects which
+# appear in exactly the same items can be swapped without changing the state)
+def get_canonical_orders(num_suspects, items):
+    colors, incidence = refine_suspect_colors(num_suspects, items)
+    color_classes = collections.defaultdict(list)
+    for suspect in range(num_suspects):
+        color_classes[colors[suspect]].append(suspect)
+
+    class_orders = []
+    num_orders = 1
+    for color in sorted(color_classes):
+        twin_groups = collections.defaultdict(list)
+        for suspect in color_classes[color]:
+            twin_groups[tuple(incidence[suspect])].append(suspect)
+        groups = list(twin_groups.values())
+        class_orders.append(groups)
+        for n in range(2, len(groups) + 1):
+            num_orders *= n
+    if num_orders > MAX_CANONICAL_ORDERS:
+        yield [
+            suspect for groups in class_orders for group in groups for suspect in group
+        ]
+        return
+
+    for permuted_classes in itertools.product(
+        *(itertools.permutations(groups) for groups in class_orders)
+    ):
+        yield [
+            suspect
+            for groups in permuted_classes
+            for group in groups
+            for suspect in group
+        ]
+
+
+# Encodes the items of a game state with its suspects renumbered by the given
+# order, as a key which is equal for every game state with the same items up
+# to that renumbering
+def encode_state_items(items, order):
+    positions = [0] * len(order)
+    for position, suspect in enumerate(order):
+        positions[suspect] = position
+    return tuple(
+        sorted(
+            (label, sum(1 << positions[suspect] for suspect in members))
+            for label, members in items
+        )
+    )
+
+
+# Retrieves the canonical form of a game state, which is the same for every
+# game state which only differs by a relabeling of suspects (or the order of
+# its cards and guesses), along with the order of the (sorted) suspects by
+# which the canonical form numbers them
+def get_canonical_state(cards, base_suspects, match_length, previous_guesses):
+    suspects = sorted(base_suspects)
+    suspect_indices = {suspect: s for s, suspect in enumerate(suspects)}
+    items = get_state_items(cards, suspect_indices, match_length, previous_guesses)
+    encoded_items, order = min(
+        (encode_state_items(items, order), order)
+        for order in get_canonical_orders(len(suspects), items)
+    )
+    key = (len(suspects), match_length, encoded_items)
+    return key, [suspects[suspect] for suspect in order]
+
+
+# Creates a cache of the matches for game states, bounded by the given
+# (approximate) number of bytes, with the least recently used entries evicted
+# first
+def create_cache(max_bytes=DEFAULT_CACHE_SIZE):
+    return {
+        "entries": collections.OrderedDict(),
+        "max_bytes": max_bytes,
+        "num_bytes": 0,
+        "hits": 0,
+        "misses": 0,
+        "evictions": 0,
+    }
+
+
+# Estimates the memory used by a cache entry
+def get_cache_entry_size(key, value):
+    encoded_items = key[2]
+    return (
+        CACHE_ENTRY_OVERHEAD
+        + sys.getsizeof(key)
+        + sys.getsizeof(encoded_items)
+        + sum(map(sys.getsizeof, encoded_items))
+        + sum(sys.getsizeof(mask) for _, mask in encoded_items)
+        + sys.getsizeof(value)
+        + sum(map(sys.getsizeof, value))
+    )
+
+
+# Adds an entry to a cache, evicting the least recently used entries until
+# the cache fits within its size again
+def add_to_cache(cache, key, value):
+    entries = cache["entries"]
+    if key in entries:
+        return
+    entries[key] = value
+    cache["num_bytes"] += get_cache_entry_size(key, value)
+    while cache["num_bytes"] > cache["max_bytes"] and entries:
+        old_key, old_value = entries.popitem(last=False)
+        cache["num_bytes"] -= get_cache_entry_size(old_key, old_value)
+        cache["evictions"] += 1
+
+
+# Retrieves all possible matches from the cache, solving the game state with
+# the given engine (and caching its matches) if no game state equal to it up
+# to a relabeling of suspects has been solved before
+def get_cached_matches(
+    cards, base_suspects, match_length, previous_guesses, cache, engine=None
+):
+    key, suspects_by_position = get_canonical_state(
+        cards, base_suspects, match_length, previous_guesses
+    )
+    entries = cache["entries"]
+    if key in entries:
+        cache["hits"] += 1
+        entries.move_to_end(key)
+        suspects_by_bit = {
+            1 << p: suspect for p, suspect in enumerate(suspects_by_position)
+        }
+        return {get_mask_suspects(mask, suspects_by_bit) for mask in entries[key]}
+
+    cache["misses"] += 1
+    engine = engine or get_matches_bitmask
+    matches = set(engine(cards, base_suspects, match_length, previous_guesses))
+    positions = {suspect: p for p, suspect in enumerate(suspects_by_position)}
+    add_to_cache(
+        cache,
+        key,
+        tuple(
+            sorted(
+                sum(1 << positions[suspect] for suspect in match) for match in matches
+            )
+        ),
+    )
+    return matches
+
+
+# Retrieves the hit and miss statistics of a cache
+def get_cache_stats(cache):
+    num_lookups = cache["hits"] + cache["misses"]
+    return {
+        "hits": cache["hits"],
+        "misses": cache["misses"],
+        "hit_rate": cache["hits"] / num_lookups if num_lookups else 0.0,
+        "entries": len(cache["entries"]),
+        "bytes": cache["num_bytes"],
+        "evictions": cache["evictions"],
+    }
+
+
+# Loads a cache saved by save_cache (least recently used entries first, so
+# that they are the first evicted if the cache is now smaller); retrieves an
+# empty cache if the file is missing or was saved in a different version
+def load_cache(path, max_bytes=DEFAULT_CACHE_SIZE):
+    cache = create_cache(max_bytes)
+    try:
+        with open(path) as cache_file:
+            saved_cache = json.load(cache_file)
+    except (FileNotFoundError, ValueError):
+        return cache
+    if saved_cache.get("version") != CACHE_VERSION:
+        return cache
+    for (num_suspects, match_length, encoded_items), value in saved_cache["entries"]:
+        key = (num_suspects, match_length, tuple(map(tuple, encoded_items)))
+        add_to_cache(cache, key, tuple(value))
+    return cache
+
+
+# Saves the entries of a cache as JSON, replacing the file only once it has
+# been written in full
+def save_cache(cache, path):
+    temp_path = "{}.tmp".format(path)
+    with open(temp_path, "w") as cache_file:
+        json.dump(
+            {"version": CACHE_VERSION, "entries": list(cache["entries"].items())},
+            cache_file,
+            separators=(",", ":"),
+        )
+    os.replace(temp_path, path)
+
+
+# Retrieves the function used to find all possible matches for the named
+# engine; given a cache, the engine only solves game states missing from it,
+# and given a number of jobs, the lazy engine checks candidates in parallel
+def get_engine(name, table_path=None, cache=None, jobs=None):
+    if cache is not None:
+        engine = get_engine(name, table_path, jobs=jobs)
+        return functools.partial(get_cached_matches, cache=cache, engine=engine)
+    if name == "lazy" and jobs:
+        return functools.partial(iter_matches_parallel, jobs=jobs)
+    if name == "lazy":
+        return iter_matches
+    if name == "bitmask":
+        return get_matches_bitmask
+    if name == "incremental":
+        return get_matches_incremental
+    if name == "table":
+        table = load_table(table_path or get_default_table_path())
+        return functools.partial(get_matches_table, table=table)
+    if name == "constraints":
+        return iter_matches_constraints
+    return player.get_matches
+
+
+# Retrieves the cache shared by every game played in this process
+@functools.lru_cache(maxsize=None)
+def get_shared_cache():
+    return create_cache()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+import argparse
+import array
+import os
+import sys
+
+import toac.dealer as dealer
+import toac.solver as solver
+
+
+# Parse command-line arguments passed to table builder program
+def parse_cli_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "path",
+        nargs="?",
+        help="where to write the lookup table (default: table.bin in the toac "
+        "directory of the user's cache directory)",
+    )
+
+    return parser.parse_args()
+
+
+# Retrieves, for every card and match count, the mask of all cards (numbered
+# by their position in the deck) which share that many suspects with the card
+def get_level_masks(deck, match_length):
+    level_masks = []
+    for card in deck:
+        masks = [0] * (match_length + 1)
+        for c, other_card in enumerate(deck):
+            masks[len(card & other_card)] |= 1 << c
+        level_masks.append(masks)
+    return level_masks
+
+
+# Exhaustively walks every set of candidates which some sequence of drawn
+# cards can narrow the game down to, numbering each such state and recording
+# which state every (card, match count) observation leads to
+def build_table(base_suspects, match_length):
+    deck = solver.get_deck(base_suspects, match_length)
+    if len(deck) > 64:
+        raise ValueError("lookup tables support at most 64 cards")
+    level_masks = get_level_masks(deck, match_length)
+    all_cards_mask = (1 << len(deck)) - 1
+    state_ids = {all_cards_mask: 0}
+    masks = array.array("Q", [all_cards_mask])
+    transitions = array.array("H")
+
+    # New states are appended to masks as they are found, so this loop ends
+    # once every reachable state has had its transitions recorded
+    state = 0
+    while state < len(masks):
+        for card_masks in level_masks:
+            for level_mask in card_masks:
+                next_mask = masks[state] & level_mask
+                if not next_mask:
+                    # No eyewitness card can produce this observation here
+                    transitions.append(solver.NO_TABLE_STATE)
+                    continue
+                if next_mask not in state_ids:
+                    state_ids[next_mask] = len(masks)
+                    masks.append(next_mask)
+                    if len(masks) >= solver.NO_TABLE_STATE:
+                        raise ValueError("too many reachable states for a table")
+                transitions.append(state_ids[next_mask])
+        state += 1
+
+    return {
+        "base_suspects": sorted(base_suspects),
+        "match_length": match_length,
+        "num_cards": len(deck),
+        "masks": masks,
+        "transitions": transitions,
+    }
+
+
+# Write a lookup table to the given path in the layout read by solver.py
+def write_table(table, path):
+    suspects = "\n".join(table["base_suspects"]).encode("utf-8")
+    masks = array.array("Q", table["masks"])
+    transitions = array.array("H", table["transitions"])
+    if sys.byteorder != "little":
+        masks.byteswap()
+        transitions.byteswap()
+    header = solver.TABLE_HEADER.pack(
+        solver.TABLE_MAGIC,
+        solver.TABLE_VERSION,
+        table["match_length"],
+        table["num_cards"],
+        len(masks),
+        len(suspects),
+    )
+    padding = b"\0" * (solver.get_padded_size(len(suspects)) - len(suspects))
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "wb") as table_file:
+        table_file.write(header)
+        table_file.write(suspects + padding)
+        table_file.write(masks.tobytes())
+        table_file.write(transitions.tobytes())
+
+
+def main():
+    cli_args = parse_cli_args()
+    path = cli_args.path or solver.get_default_table_path()
+    table = build_table(dealer.BASE_SUSPECTS, dealer.MATCH_LENGTH)
+    write_table(table, path)
+    print(
+        "Wrote {} states for {} cards to {}".format(
+            len(table["masks"]), table["num_cards"], path
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
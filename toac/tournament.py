@@ -0,0 +1,322 @@
+import argparse
+import functools
+import itertools
+import json
+import multiprocessing
+import os
+import random
+
+import toac.dealer as dealer
+
+DEFAULT_PLAYERS_PER_GAME = 2
+DEFAULT_GAMES_PER_SEATING = 100
+DEFAULT_CHUNK_SIZE = 20
+TOURNAMENT_FORMATS = ("text", "jsonl")
+
+
+# Parse command-line arguments passed to tournament program (as
+# "toac tournament")
+def parse_cli_args(args=None):
+    parser = argparse.ArgumentParser(
+        prog="toac tournament",
+        description="Play every group of player programs against each other, "
+        "in every rotation of seats, on the same decks.",
+    )
+
+    parser.add_argument(
+        "programs",
+        metavar="program",
+        nargs="+",
+        help="two or more player programs (or Python players) to compete",
+    )
+    parser.add_argument(
+        "-p",
+        "--players",
+        type=int,
+        default=DEFAULT_PLAYERS_PER_GAME,
+        help="the number of players in every game",
+    )
+    parser.add_argument(
+        "-n",
+        "--games",
+        type=int,
+        default=DEFAULT_GAMES_PER_SEATING,
+        help="the number of games to play for every seating of every group",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help="the number of games handed to a job (and checkpointed) at once",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        metavar="FILE",
+        help="record finished games in this file, resuming from it if it exists",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="the number of chunks to play at once (default: the number of CPUs)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="shuffle decks based on this seed (default: a random seed, which "
+        "is saved to the checkpoint)",
+    )
+    parser.add_argument(
+        "--format",
+        choices=TOURNAMENT_FORMATS,
+        default="text",
+        help="how to output the standings",
+    )
+    parser.add_argument(
+        "--session",
+        action="append",
+        default=[],
+        metavar="PROGRAM",
+        help="speak the session protocol with this player program (as for toac)",
+    )
+    parser.add_argument(
+        "--fork-server",
+        action="store_true",
+        help="run Python player scripts from fork servers (as for toac)",
+    )
+
+    return parser.parse_args(args)
+
+
+# Retrieve every seating of the tournament: every group of programs (as
+# indices into the list of programs) in every rotation of seats, so that each
+# program plays every seat against every group of opponents
+def get_seatings(num_programs, players_per_game):
+    for group in itertools.combinations(range(num_programs), players_per_game):
+        for rotation in range(players_per_game):
+            yield group[rotation:] + group[:rotation]
+
+
+# Retrieve every task of the tournament as a seating and a range of game IDs;
+# every seating plays the same game IDs, and so the same decks
+def get_tournament_tasks(tournament):
+    seatings = get_seatings(len(tournament["programs"]), tournament["players"])
+    for seating in seatings:
+        chunks = dealer.get_game_chunks(tournament["games"], tournament["chunk_size"])
+        for chunk in chunks:
+            yield seating, chunk.start, chunk.stop
+
+
+# Create the settings which define a tournament (and which every run resumed
+# from its checkpoint must share)
+def create_tournament(programs, players, games, chunk_size, seed):
+    return {
+        "programs": programs,
+        "players": players,
+        "games": games,
+        "chunk_size": chunk_size,
+        "seed": seed,
+    }
+
+
+# Read the tournament and the results of every finished task from a
+# checkpoint; a line cut short by an interrupted run is ignored, as its task
+# will simply be played again
+def read_checkpoint(checkpoint_path):
+    tournament = None
+    results = []
+    with open(checkpoint_path) as checkpoint_file:
+        for line in checkpoint_file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if "tournament" in record:
+                tournament = record["tournament"]
+            else:
+                results.append(record)
+    return tournament, results
+
+
+# Cut a line left unfinished by an interrupted run off the end of the
+# checkpoint, so that the records appended when resuming each start on a line
+# of their own
+def trim_checkpoint(checkpoint_path):
+    with open(checkpoint_path, "rb+") as checkpoint_file:
+        contents = checkpoint_file.read()
+        checkpoint_file.truncate(contents.rfind(b"\n") + 1)
+
+
+# Append a record to the checkpoint, making sure it reaches the disk before
+# the task it records is considered finished
+def write_checkpoint_record(checkpoint_file, record):
+    checkpoint_file.write(json.dumps(record, separators=(",", ":")) + "\n")
+    checkpoint_file.flush()
+    os.fsync(checkpoint_file.fileno())
+
+
+# Play a task (a range of games for one seating), retrieving how many games
+# each seat won, along with the number of rounds played and of errors
+def play_task(task, tournament, session=(), fork_server=False):
+    seating, start, stop = task
+    programs = [tournament["programs"][p] for p in seating]
+    players = dealer.create_players(programs, session, fork_server)
+    seats = {player["id"]: seat for seat, player in enumerate(players)}
+    result = {
+        "seating": list(seating),
+        "start": start,
+        "stop": stop,
+        "wins": [0] * len(seating),
+        "rounds": 0,
+        "errors": 0,
+    }
+    for game in dealer.run_game_chunk(range(start, stop), players, tournament["seed"]):
+        if game["winner"] is not None:
+            result["wins"][seats[game["winner"]]] += 1
+        result["rounds"] += game["rounds"]
+        result["errors"] += game["error"] is not None
+    return result
+
+
+# Retrieve the key by which a task is recognized among finished results
+def get_task_key(seating, start, stop):
+    return tuple(seating), start, stop
+
+
+# Tally the results of every task into standings for every program (sorted by
+# most wins) and wins for every seat
+def get_standings(tournament, results):
+    programs = tournament["programs"]
+    games = [0] * len(programs)
+    wins = [0] * len(programs)
+    seat_wins = [0] * tournament["players"]
+    num_games = 0
+    for result in results:
+        num_result_games = result["stop"] - result["start"]
+        num_games += num_result_games
+        for seat, p in enumerate(result["seating"]):
+            games[p] += num_result_games
+            wins[p] += result["wins"][seat]
+            seat_wins[seat] += result["wins"][seat]
+    standings = [
+        {"program": program, "games": games[p], "wins": wins[p]}
+        for p, program in enumerate(programs)
+    ]
+    standings.sort(key=lambda standing: standing["wins"], reverse=True)
+    seats = [
+        {"seat": "P{}".format(seat + 1), "games": num_games, "wins": seat_wins[seat]}
+        for seat in range(tournament["players"])
+    ]
+    return {"standings": standings, "seats": seats}
+
+
+# Format a number of wins out of a number of games as a percentage
+def format_win_rate(wins, games):
+    return "{:.1f}%".format(100 * wins / games if games else 0)
+
+
+# Print the standings of every program and the wins of every seat
+def print_standings(standings, output_format="text"):
+    if output_format == "jsonl":
+        print(json.dumps(standings, separators=(",", ":")))
+        return
+    for standing in standings["standings"]:
+        print(
+            "{}: {} wins in {} games ({})".format(
+                standing["program"],
+                standing["wins"],
+                standing["games"],
+                format_win_rate(standing["wins"], standing["games"]),
+            )
+        )
+    for seat in standings["seats"]:
+        print(
+            "Seat {}: {} wins in {} games ({})".format(
+                seat["seat"],
+                seat["wins"],
+                seat["games"],
+                format_win_rate(seat["wins"], seat["games"]),
+            )
+        )
+
+
+# Run (or resume) a tournament, playing every task not yet recorded in the
+# checkpoint; tasks are handed to the pool one at a time as jobs free up, so
+# that slow seatings do not hold up the rest, and every result is
+# checkpointed as soon as it arrives. Retrieves the results of every task
+def run_tournament(
+    tournament, checkpoint_path=None, jobs=None, session=(), fork_server=False
+):
+    checkpoint_tournament = None
+    results = []
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        checkpoint_tournament, results = read_checkpoint(checkpoint_path)
+    if checkpoint_tournament is not None:
+        if checkpoint_tournament != tournament:
+            raise ValueError(
+                "checkpoint {} belongs to a different tournament".format(
+                    checkpoint_path
+                )
+            )
+    finished_tasks = {
+        get_task_key(result["seating"], result["start"], result["stop"])
+        for result in results
+    }
+    tasks = [
+        task
+        for task in get_tournament_tasks(tournament)
+        if get_task_key(*task) not in finished_tasks
+    ]
+
+    checkpoint_file = None
+    if checkpoint_path:
+        if os.path.exists(checkpoint_path):
+            trim_checkpoint(checkpoint_path)
+        checkpoint_file = open(checkpoint_path, "a")
+        if checkpoint_tournament is None:
+            write_checkpoint_record(checkpoint_file, {"tournament": tournament})
+    play = functools.partial(
+        play_task, tournament=tournament, session=session, fork_server=fork_server
+    )
+    try:
+        with multiprocessing.Pool(processes=jobs or os.cpu_count() or 1) as pool:
+            for result in pool.imap_unordered(play, tasks):
+                results.append(result)
+                if checkpoint_file:
+                    write_checkpoint_record(checkpoint_file, result)
+    finally:
+        if checkpoint_file:
+            checkpoint_file.close()
+    return results
+
+
+def main(args=None):
+    cli_args = parse_cli_args(args)
+    if len(cli_args.programs) < cli_args.players:
+        raise SystemExit("toac tournament: need at least as many programs as players")
+    checkpoint_tournament = None
+    if cli_args.checkpoint and os.path.exists(cli_args.checkpoint):
+        checkpoint_tournament, _ = read_checkpoint(cli_args.checkpoint)
+    seed = cli_args.seed
+    if seed is None and checkpoint_tournament is not None:
+        # Resume with the seed the interrupted run chose
+        seed = checkpoint_tournament["seed"]
+    if seed is None:
+        seed = random.randrange(2**32)
+    tournament = create_tournament(
+        cli_args.programs, cli_args.players, cli_args.games, cli_args.chunk_size, seed
+    )
+    if checkpoint_tournament is not None and checkpoint_tournament != tournament:
+        raise SystemExit(
+            "toac tournament: checkpoint {} belongs to a different tournament".format(
+                cli_args.checkpoint
+            )
+        )
+    results = run_tournament(
+        tournament,
+        cli_args.checkpoint,
+        jobs=cli_args.jobs,
+        session=cli_args.session,
+        fork_server=cli_args.fork_server,
+    )
+    print_standings(get_standings(tournament, results), cli_args.format)
@@ -0,0 +1,96 @@
+import itertools
+import mmap
+
+import toac.dealer as dealer
+import toac.numeric as numeric
+from toac.numeric import np
+
+
+# Reads the header of a game trace file (written by toac --trace) from the
+# start of the given buffer, retrieving the deck which the traces' card
+# indices refer to, the size of every record and where the records start
+def read_trace_header(buffer):
+    magic, version, match_length, num_cards, record_size, names_size = (
+        dealer.TRACE_HEADER.unpack_from(buffer)
+    )
+    if magic != dealer.TRACE_MAGIC or version != dealer.TRACE_VERSION:
+        raise ValueError("not a game trace file (or an unsupported version)")
+    names_offset = dealer.TRACE_HEADER.size
+    names = bytes(buffer[names_offset : names_offset + names_size]).decode("utf-8")
+    deck = list(
+        map(frozenset, itertools.combinations(names.split("\n"), r=match_length))
+    )
+    if len(deck) != num_cards:
+        raise ValueError("trace file header does not describe its deck")
+    return {
+        "deck": deck,
+        "num_turns": num_cards - 1,
+        "record_size": record_size,
+        "offset": names_offset + -(-names_size // 8) * 8,
+    }
+
+
+# Build the NumPy structured type of a single trace record
+def get_trace_dtype(num_turns):
+    return np.dtype(
+        [
+            ("id", "<u8"),
+            ("winner", "i1"),
+            ("rounds", "u1"),
+            ("error", "u1"),
+            ("eyewitness", "u1"),
+            ("cards", "u1", (num_turns,)),
+            ("match_counts", "u1", (num_turns,)),
+            ("guesses", "u1", (num_turns,)),
+        ]
+    )
+
+
+# Memory-map a game trace file as a NumPy structured array with one element
+# per game, so that no record is read (let alone parsed) until it is used;
+# retrieves the deck which card indices refer to along with the traces
+def load_traces(trace_path):
+    numeric.require_numpy("loading traces as arrays")
+    with open(trace_path, "rb") as trace_file:
+        header = read_trace_header(trace_file.read(4096))
+    dtype = get_trace_dtype(header["num_turns"])
+    if dtype.itemsize != header["record_size"]:
+        raise ValueError("trace records do not have the expected size")
+    traces = np.memmap(trace_path, dtype=dtype, mode="r", offset=header["offset"])
+    return header["deck"], traces
+
+
+# Unpack a trace record into a dictionary of the game's turns, trimmed to the
+# number of rounds played; cards and guesses are indices into the deck
+def unpack_trace(record):
+    game_id, winner, rounds, error, eyewitness, cards, match_counts, guesses = (
+        dealer.TRACE_RECORD.unpack(record)
+    )
+    return {
+        "id": game_id,
+        "winner": winner,
+        "rounds": rounds,
+        "error": bool(error),
+        "eyewitness": eyewitness,
+        "cards": list(cards[:rounds]),
+        "match_counts": list(match_counts[:rounds]),
+        "guesses": list(guesses[:rounds]),
+    }
+
+
+# A generator which memory-maps a game trace file and yields every trace as a
+# dictionary, without needing NumPy
+def iter_traces(trace_path):
+    with open(trace_path, "rb") as trace_file:
+        with mmap.mmap(trace_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            header = read_trace_header(buffer)
+            if header["record_size"] != dealer.TRACE_RECORD.size:
+                raise ValueError("trace records do not have the expected size")
+            view = memoryview(buffer)
+            try:
+                for offset in range(
+                    header["offset"], len(buffer), header["record_size"]
+                ):
+                    yield unpack_trace(view[offset : offset + header["record_size"]])
+            finally:
+                view.release()